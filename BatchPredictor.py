@@ -0,0 +1,284 @@
+# -*- coding: utf-8 -*-
+"""
+Predicts the target for new data with one of the models the search found.
+
+Each row of a MetaData file is a model, the formula and then its raw
+coefficients (the intercept, then x^1..x^d of each bus in the formula's
+order), row for row with the Output table. ReadMetaData picks a row out as a
+PolyModel, which can be saved on its own with Export (JSON) and read back
+with ReadModel, so a downstream service only needs this file and numpy.
+
+PolyModel.Predict works out
+    y = Intercept + sum over busses of (((c_d x + c_d-1) x + ..) x + c_1) x
+for a block of rows at a time, all the busses together, into buffers made
+once per call; nothing is made per row, so it runs at numpy speed on any
+number of rows. PredictCSV feeds it a CSV ChunkRows lines at a time, or the
+memory mapped columns of ParsedCache (see NumpyEngine.ReadCachedCSV), and
+PredictArray takes any array or np.load(..., mmap_mode = 'r').
+
+    python BatchPredictor.py "opFolder/MetaData/x.csv" --row -1 --predict new.csv --to predictions.csv
+    python BatchPredictor.py "opFolder/MetaData/x.csv" --export model.json
+    python BatchPredictor.py model.json --benchmark
+
+--benchmark times Predict against working each row out in plain python.
+
+@author: pbrogan
+"""
+
+import argparse
+import csv
+import json
+import re
+import time
+
+import numpy as np
+
+import NumpyEngine
+
+
+class PolyModel():
+    """Target = Intercept + the powers 1..Degree of each of Busses, with
+    Coefficients a busses x Degree array (column p holds the x^(p+1) term).
+    Aliased powers (NA from R:, nan from the numpy engines) play no part, as
+    with R:'s predict"""
+    def __init__(self, Target, Busses, Degree, Intercept, Coefficients,
+                 ResSquare = None):
+        self.Target = Target
+        self.Busses = list(Busses)
+        self.Degree = int(Degree)
+        self.Intercept = float(Intercept)
+        self.Coefficients = np.nan_to_num(np.asarray(Coefficients,
+            dtype = float).reshape(len(self.Busses), self.Degree), nan = 0.0)
+        self.ResSquare = ResSquare
+
+    def Export(self, FileName):
+        with open(FileName, 'w') as opFile:
+            json.dump({'Target': self.Target, 'Busses': self.Busses,
+                       'Degree': self.Degree, 'Intercept': self.Intercept,
+                       'Coefficients': self.Coefficients.tolist(),
+                       'ResSquare': self.ResSquare}, opFile, indent = 1)
+
+    def Columns(self, Headers):
+        """Where each bus is among the (R: style) Headers of some data"""
+        Missing = [Bus for Bus in self.Busses if Bus not in Headers]
+        if len(Missing) > 0:
+            raise ValueError('the model needs ' + str(Missing) + ', not in ' +
+                             str(Headers))
+        return [Headers.index(Bus) for Bus in self.Busses]
+
+    def Predict(self, X, Columns = None, Out = None, ChunkRows = 65536):
+        """Predictions for the rows of X, whose columns are the busses in
+        order (or, given Columns, X[:, Columns] are). X can be a memory map,
+        only ChunkRows rows of it are in memory at a time; Out (e.g. from
+        np.lib.format.open_memmap) is filled in if given"""
+        Rows = X.shape[0]
+        if Out is None:
+            Out = np.empty(Rows)
+        Terms = np.empty((min(ChunkRows, Rows), len(self.Busses)))
+        Highest = self.Coefficients[:, -1]
+        for Start in range(0, Rows, ChunkRows):
+            Stop = min(Start + ChunkRows, Rows)
+            Chunk = X[Start:Stop] if Columns is None else X[Start:Stop, Columns]
+            Block = Terms[:Stop - Start]
+            Block[:] = Highest
+            for p in range(self.Degree - 2, -1, -1):
+                Block *= Chunk
+                Block += self.Coefficients[:, p]
+            Block *= Chunk
+            np.sum(Block, axis = 1, out = Out[Start:Stop])
+            Out[Start:Stop] += self.Intercept
+        return Out
+
+
+def ParseFormula(Formula):
+    """The target, busses and degree of a formula made by SetFormula,
+    Y ~ poly( X1, d, raw = TRUE) + poly(X2, d, raw = TRUE) ..."""
+    Target, Terms = Formula.split('~', 1)
+    Polys = re.findall(r'poly\(\s*([^,]+?)\s*,\s*(\d+)\s*,\s*raw\s*=\s*TRUE\s*\)',
+                       Terms)
+    if len(Polys) == 0:
+        raise ValueError('not a formula made by the search: ' + Formula)
+    return Target.strip(), [Bus for Bus, Degree in Polys], int(Polys[0][1])
+
+
+def ReadTable(FileName):
+    """The rows of a CSV, without its header"""
+    with open(FileName, newline = '') as ipFile:
+        return [Row for Row in csv.reader(ipFile) if len(Row) > 0][1:]
+
+
+def BestRow(OutputFile, MaxBusses = None):
+    """Which row of an Output table scores best (Res^2, or the score the
+    search ranked by), only counting rows of at most MaxBusses busses"""
+    Best = None
+    for n, Row in enumerate(ReadTable(OutputFile)):
+        Busses = [Cell for Cell in Row[1:] if Cell != '-']
+        if MaxBusses is not None and len(Busses) > MaxBusses:
+            continue
+        if Best is None or float(Row[0]) > Best[1]:
+            Best = (n, float(Row[0]))
+    return Best[0]
+
+
+def ReadMetaData(FileName, Row = -1, OutputFile = None):
+    """The model in row Row (from 0, -1 the last, which has the most busses)
+    of a MetaData file. Given the matching Output table its score is read
+    from there too, and the busses checked against it"""
+    Cells = ReadTable(FileName)[Row]
+    Target, Busses, Degree = ParseFormula(Cells[0])
+    Values = [np.nan if Cell.strip() in ('', 'NA') else float(Cell)
+              for Cell in Cells[1:1 + len(Busses) * Degree + 1]]
+    ResSquare = None
+    if OutputFile is not None:
+        Placed = ReadTable(OutputFile)[Row]
+        if sorted(Cell for Cell in Placed[1:] if Cell != '-') != sorted(Busses):
+            raise ValueError('row ' + str(Row) + ' of ' + OutputFile +
+                             " isn't the model in " + FileName)
+        ResSquare = float(Placed[0])
+    return PolyModel(Target, Busses, Degree, Values[0], Values[1:], ResSquare)
+
+
+def ReadModel(FileName):
+    """A model saved by PolyModel.Export"""
+    with open(FileName) as ipFile:
+        Model = json.load(ipFile)
+    return PolyModel(Model['Target'], Model['Busses'], Model['Degree'],
+                     Model['Intercept'], Model['Coefficients'],
+                     Model.get('ResSquare'))
+
+
+def PredictArray(Model, X, Columns = None, OutFile = None, ChunkRows = 65536):
+    """Model.Predict, into an .npy file (memory mapped as it's filled) if
+    OutFile is given"""
+    Out = None
+    if OutFile is not None:
+        Out = np.lib.format.open_memmap(OutFile, 'w+', float, (X.shape[0],))
+    Out = Model.Predict(X, Columns, Out, ChunkRows)
+    if OutFile is not None:
+        Out.flush()
+    return Out
+
+
+def PredictCSV(Model, FileName, OutFile = None, ChunkRows = 100000,
+               CacheDirectory = None):
+    """Predictions for every row of a CSV, read ChunkRows lines at a time;
+    a row missing any of the busses gets nan. With CacheDirectory the parsed
+    columns are memory mapped from there instead (made on the first call,
+    see NumpyEngine.ReadCachedCSV; rows with missing values are left out, as
+    when searching). OutFile ending .npy is written as an array, otherwise
+    as a CSV of one column; without OutFile the predictions are returned"""
+    if CacheDirectory is not None:
+        Headers, Data, Rejected = NumpyEngine.ReadCachedCSV(FileName,
+                                                            CacheDirectory)
+        Columns = Model.Columns(Headers)
+        if OutFile is None or OutFile.endswith('.npy'):
+            return PredictArray(Model, Data, Columns, OutFile, ChunkRows)
+        Chunks = (Data[Start:Start + ChunkRows, Columns] for Start in
+                  range(0, Data.shape[0], ChunkRows))
+    else:
+        Chunks = NumpyEngine.CSVChunks(FileName, ChunkRows)
+        Columns = Model.Columns(next(Chunks))
+        Chunks = (Chunk[:, Columns].astype(float) for Chunk in Chunks)
+    Predictions = []
+    opFile = None
+    if OutFile is not None and not OutFile.endswith('.npy'):
+        opFile = open(OutFile, 'w', newline = '')
+        opFile.write(Model.Target + '.predicted\n')
+    try:
+        for Chunk in Chunks:
+            Predicted = Model.Predict(Chunk, ChunkRows = ChunkRows)
+            if opFile is not None:
+                np.savetxt(opFile, Predicted, fmt = '%.17g')
+            else:
+                Predictions.append(Predicted)
+    finally:
+        if opFile is not None:
+            opFile.close()
+    if opFile is not None:
+        return None
+    Predictions = np.concatenate(Predictions) if len(Predictions) > 0 else \
+                  np.empty(0)
+    if OutFile is not None:
+        #the number of rows isn't known until the end, so it's saved whole
+        np.save(OutFile, Predictions)
+        return None
+    return Predictions
+
+
+def NaivePredict(Model, X):
+    """Each row worked out in plain python, what Throughput compares with"""
+    Coefficients = Model.Coefficients.tolist()
+    Predictions = []
+    for Row in X.tolist():
+        y = Model.Intercept
+        for x, Terms in zip(Row, Coefficients):
+            for p, Coefficient in enumerate(Terms):
+                y += Coefficient * x ** (p + 1)
+        Predictions.append(y)
+    return np.array(Predictions)
+
+
+def Throughput(Model, Rows = 1000000, NaiveRows = 20000, Seed = 2017):
+    """Rows per second of Model.Predict and of NaivePredict (on NaiveRows of
+    the same made up rows, standard normal values) and the largest difference
+    between them, relative to the spread of the predictions"""
+    X = np.random.default_rng(Seed).standard_normal((Rows, len(Model.Busses)))
+    Start = time.perf_counter()
+    Predicted = Model.Predict(X)
+    Seconds = time.perf_counter() - Start
+    Start = time.perf_counter()
+    Naive = NaivePredict(Model, X[:NaiveRows])
+    NaiveSeconds = time.perf_counter() - Start
+    Difference = np.abs(Predicted[:NaiveRows] - Naive).max() / max(
+        np.ptp(Naive), 1e-300)
+    return {'Rows': Rows, 'Busses': len(Model.Busses), 'Degree': Model.Degree,
+            'RowsPerSecond': Rows / Seconds,
+            'NaiveRowsPerSecond': NaiveRows / NaiveSeconds,
+            'Speedup': (Rows / Seconds) / (NaiveRows / NaiveSeconds),
+            'RelativeDifference': float(Difference)}
+
+
+if __name__ == '__main__':
+    Parser = argparse.ArgumentParser(description = 'Predicts with a model' +
+                                     ' the search found')
+    Parser.add_argument('model', help = 'a MetaData file, or a model saved' +
+                        ' with --export')
+    Parser.add_argument('--row', type = int, help = 'row of the MetaData' +
+                        ' file, from 0 (default the last)')
+    Parser.add_argument('--output-table', help = 'the matching Output file;' +
+                        ' with no --row its best scoring row is used')
+    Parser.add_argument('--max-busses', type = int, help = 'with ' +
+                        '--output-table, the best row of at most this many')
+    Parser.add_argument('--export', help = 'save the model as JSON')
+    Parser.add_argument('--predict', help = 'CSV to predict the target for')
+    Parser.add_argument('--to', help = 'where the predictions go (.csv or' +
+                        ' .npy)')
+    Parser.add_argument('--chunk-rows', type = int, default = 100000)
+    Parser.add_argument('--cache', help = 'memory map the parsed columns' +
+                        ' kept in this folder')
+    Parser.add_argument('--benchmark', type = int, nargs = '?',
+                        const = 1000000, help = 'time Predict on this many' +
+                        ' made up rows against a python loop')
+    Arguments = Parser.parse_args()
+    if Arguments.model.endswith('.json'):
+        Model = ReadModel(Arguments.model)
+    else:
+        Row = Arguments.row
+        if Row is None and Arguments.output_table is not None:
+            Row = BestRow(Arguments.output_table, Arguments.max_busses)
+        elif Row is None:
+            Row = -1
+        Model = ReadMetaData(Arguments.model, Row, Arguments.output_table)
+    print(Model.Target, '~', Model.Busses, 'degree', Model.Degree,
+          'R^2', Model.ResSquare)
+    if Arguments.export is not None:
+        Model.Export(Arguments.export)
+    if Arguments.predict is not None:
+        Start = time.perf_counter()
+        Predictions = PredictCSV(Model, Arguments.predict, Arguments.to,
+                                 Arguments.chunk_rows, Arguments.cache)
+        print('predicted in', time.perf_counter() - Start, 'seconds')
+        if Arguments.to is None:
+            print(Predictions)
+    if Arguments.benchmark is not None:
+        print(json.dumps(Throughput(Model, Arguments.benchmark), indent = 1))
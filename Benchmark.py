@@ -0,0 +1,214 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmarks the placement search on synthetic data.
+
+A grid of cases (rows, candidate columns, noise, size of the true support,
+collinearity between the columns, polynomial degree and MaxPMUs) is worked
+through; for each case a CSV is made up, then read, searched and written out
+by a FileItterator, the same as ItterateAllFiles does. Every case runs in a
+process of its own so the peak memory (RSS) reported is that case's alone.
+
+The results (wall time of each stage, models fitted per second, peak RSS and
+the placements made, and how many of the true busses were found) are written
+to ResultsFile as JSON. Give a previous results file as Baseline and the time
+of each case is compared against it, e.g. run once with Engine = 'R' and then
+with Engine = 'gram' and Baseline = 'BenchmarkR.json'. The time to start a
+process that imports the module, and one that runs PlacementCLI.py --help, is
+recorded as well.
+
+@author: pbrogan
+"""
+
+import itertools
+import json
+import os
+import shutil
+import tempfile
+import time
+
+import numpy as np
+
+
+#every combination of these is run
+Grid = {'Rows': [1000, 10000],
+        'Columns': [20, 60],
+        'Noise': [0.1],
+        'Support': [4],
+        'Collinearity': [0.0, 0.9],
+        'PolynomialDegree': [2, 3],
+        'MaxPMUs': [8]}
+
+#FileItterator settings used for every case
+Settings = {'Engine': 'gram',
+            'Workers': 1}
+
+Seed = 2017
+ResultsFile = 'BenchmarkResults.json'
+Baseline = None
+
+
+def MakeDataset(FileName, Rows, Columns, Noise, Support, Collinearity,
+                PolynomialDegree, Seed = 2017):
+    """Writes a CSV of Columns candidate columns (Bus1, Bus2 ...) and a
+    target. Every column shares a common factor, Collinearity is the
+    correlation between any two of them. The target is a random polynomial
+    of PolynomialDegree in Support of the columns (the true busses, returned)
+    plus Noise times its standard deviation in gaussian noise"""
+    Random = np.random.RandomState(Seed)
+    Common = Random.standard_normal((Rows, 1))
+    Xdata = np.sqrt(Collinearity) * Common + np.sqrt(1.0 - Collinearity) * \
+            Random.standard_normal((Rows, Columns))
+    Headers = ['Bus' + str(n + 1) for n in range(Columns)]
+    TrueBusses = sorted(Random.choice(Columns, Support, replace = False))
+    Target = np.zeros(Rows)
+    for Column in TrueBusses:
+        for Power in range(1, PolynomialDegree + 1):
+            Target += Random.uniform(-1, 1) * Xdata[:, Column] ** Power
+    Target += Noise * Target.std() * Random.standard_normal(Rows)
+    np.savetxt(FileName, np.column_stack([Target, Xdata]), delimiter = ',',
+               header = ','.join(['Target'] + Headers), comments = '',
+               fmt = '%.10g')
+    return [Headers[Column] for Column in TrueBusses]
+
+
+def PeakRSS():
+    """Peak resident memory of this process in MB"""
+    import resource
+    import sys
+    Peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        return Peak / 2.0 ** 20
+    return Peak / 2.0 ** 10
+
+
+def RunCase(Case):
+    """Makes the data for one case and runs the search on it, returns the
+    case with its timings and results added"""
+    import ParsimoniusPlacement
+    Folder = tempfile.mkdtemp(prefix = 'PlacementBenchmark')
+    try:
+        FileName = os.path.join(Folder, 'Synthetic.csv')
+        for SubFolder in ['Output', 'MetaData', 'VerboseOutput']:
+            os.mkdir(os.path.join(Folder, SubFolder))
+        TrueBusses = MakeDataset(FileName, Case['Rows'], Case['Columns'],
+            Case['Noise'], Case['Support'], Case['Collinearity'],
+            Case['PolynomialDegree'], Case['Seed'])
+        run = ParsimoniusPlacement.FileItterator()
+        for Name, Value in Case['Settings'].items():
+            setattr(run, Name, Value)
+        run.working_directory = Folder + '/'
+        run.op_directory = Folder + '/'
+        run.TargetValue = 'Target'
+        run.PolynomialDegree = Case['PolynomialDegree']
+        run.MaxPMUs = Case['MaxPMUs']
+        run.Instrument = True
+        run.ip_filename = FileName
+        Start = time.time()
+        run.Rread()
+        Read = time.time()
+        run.PlaceAllPMUs()
+        Search = time.time()
+        #models evaluated in the add and remove steps
+        Fits = sum(Count for Phase, Count in run.Trace.Fits.items() 
+                   if Phase is not None)
+        Placements = [list(Placement) for Placement in run.DataOP]
+        run.WriteAllToCSV()
+        Write = time.time()
+        run.Reset()
+    finally:
+        shutil.rmtree(Folder, ignore_errors = True)
+    Result = dict(Case)
+    Result['ReadSeconds'] = Read - Start
+    Result['SearchSeconds'] = Search - Read
+    Result['WriteSeconds'] = Write - Search
+    Result['WallSeconds'] = Write - Start
+    Result['Fits'] = Fits
+    Result['FitsPerSecond'] = Fits / max(Search - Read, 1e-9)
+    Result['PeakRSSMB'] = PeakRSS()
+    Result['TrueBusses'] = TrueBusses
+    Result['Placements'] = Placements
+    Result['TrueBussesFound'] = len(set(TrueBusses) &
+                                    set(Placements[-1][1:]))
+    return Result
+
+
+def StartupTimes(Repeats = 10):
+    """Best of Repeats wall times (ms) to start python, import
+    ParsimoniusPlacement and make a FileItterator, and run the command line
+    --help, each in a new process as a scheduler would"""
+    import subprocess
+    import sys
+    Commands = {'Python': [sys.executable, '-c', 'pass'],
+                'Import': [sys.executable, '-c', 'import ParsimoniusPlacement;' +
+                           ' ParsimoniusPlacement.FileItterator()'],
+                'Help': [sys.executable, 'PlacementCLI.py', '--help']}
+    Times = {}
+    for Name, Command in Commands.items():
+        Times[Name] = []
+        for n in range(Repeats):
+            Start = time.perf_counter()
+            subprocess.run(Command, stdout = subprocess.DEVNULL, check = True,
+                           cwd = os.path.dirname(os.path.abspath(__file__)))
+            Times[Name].append(1000 * (time.perf_counter() - Start))
+        Times[Name] = min(Times[Name])
+        print('      ', Name, 'starts in', round(Times[Name], 1), 'ms')
+    return Times
+
+
+def ExpandGrid(Grid, Settings, Seed = 2017):
+    Names = sorted(Grid)
+    Cases = []
+    for Values in itertools.product(*[Grid[Name] for Name in Names]):
+        Case = dict(zip(Names, Values))
+        Case['Support'] = min(Case['Support'], Case['Columns'])
+        Case['Settings'] = dict(Settings)
+        Case['Seed'] = Seed
+        Cases.append(Case)
+    return Cases
+
+
+def CaseName(Case, Names):
+    return ' '.join(Name + ' ' + str(Case[Name]) for Name in sorted(Names))
+
+
+def RunBenchmark(Grid, Settings, ResultsFile, Baseline = None, Seed = 2017):
+    """Runs every case in the grid, one fresh process each, and writes the
+    results to ResultsFile"""
+    import JobScheduler
+    Cases = ExpandGrid(Grid, Settings, Seed)
+    print('###### startup ######')
+    Startup = StartupTimes()
+    Compare = {}
+    if Baseline is not None:
+        with open(Baseline) as ipFile:
+            for Result in json.load(ipFile)['Results']:
+                Compare[CaseName(Result, Grid)] = Result
+    Results = []
+    for n, Case in enumerate(Cases):
+        print('######', n + 1, 'of', len(Cases), CaseName(Case, Grid), '######')
+        with JobScheduler.MakePool(1) as Pool:
+            Result = Pool.submit(RunCase, Case).result()
+        print('       wall', round(Result['WallSeconds'], 3), 's',
+              round(Result['FitsPerSecond'], 1), 'fits/s peak RSS',
+              round(Result['PeakRSSMB'], 1), 'MB true busses found',
+              Result['TrueBussesFound'], 'of', Result['Support'])
+        if CaseName(Case, Grid) in Compare:
+            Old = Compare[CaseName(Case, Grid)]
+            Result['BaselineWallSeconds'] = Old['WallSeconds']
+            Result['Speedup'] = Old['WallSeconds'] / Result['WallSeconds']
+            Result['SamePlacements'] = [Placement[1:] for Placement in 
+                Old['Placements']] == [Placement[1:] for Placement in 
+                Result['Placements']]
+            print('       speedup on baseline', round(Result['Speedup'], 2),
+                  'same placements', Result['SamePlacements'])
+        Results.append(Result)
+    with open(ResultsFile, 'w') as opFile:
+        json.dump({'Grid': Grid, 'Settings': Settings, 'Seed': Seed,
+                   'Startup': Startup, 'Results': Results}, opFile, 
+                  indent = 1)
+    return Results
+
+
+#the guard stops worker processes re-running this on Windows
+if __name__ == '__main__':
+    RunBenchmark(Grid, Settings, ResultsFile, Baseline, Seed)
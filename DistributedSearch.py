@@ -0,0 +1,521 @@
+# -*- coding: utf-8 -*-
+"""
+Spreads the search over worker processes, on this machine or several.
+
+The coordinator runs the search as a FileItterator would, but holds no data.
+Every worker reads the file itself (use CacheParsedCSV to memory map the
+parsed columns, and put the file where every host sees it at the same path)
+and the candidate columns are dealt out into shards, each owned by a worker.
+For every add step the coordinator sends out the current placement, each
+worker scores the candidates of its shards and sends back the best one, and
+the best of those is placed. Removals and the MetaData fits only involve
+the placed columns, they go to whichever worker is least busy.
+
+    python DistributedSearch.py coordinator inputFolder --engine gram --listen 0.0.0.0:8766 --min-workers 4
+    python DistributedSearch.py worker --connect coordinator-host:8766      (on each host)
+
+or on one box, python DistributedSearch.py coordinator inputFolder
+--local-workers 4 starts the workers too. The coordinator takes all the
+options of PlacementCLI.py (--target, --degrees, --engine ...), each file,
+target and degree is searched in turn (--jobs is ignored).
+
+Workers and coordinator talk in lines of JSON over TCP. A worker sends a
+heartbeat every HeartbeatSeconds, even while busy; one that hasn't been heard
+from for DeadSeconds, or whose connection drops, is taken as lost, its
+shards are handed to the workers left and whatever it was working on is
+sent again. Workers can join at any time, they are given the file being
+searched and take on any shards without an owner. The verbose output isn't
+gathered from the workers, and the beam search and rolling windows aren't
+spread.
+
+@author: pbrogan
+"""
+
+import argparse
+import json
+import queue
+import socket
+import subprocess
+import sys
+import threading
+import time
+import traceback
+
+import ParsimoniusPlacement
+
+
+#a worker searches with these whatever the coordinator's settings are
+WorkerSettings = {'VerboseOP': False, 'StreamOutput': False,
+                  'CheckpointDirectory': None, 'IncrementalDirectory': None,
+                  'Instrument': False, 'TraceFile': None, 'ProfileFile': None,
+                  'BeamWidth': 1}
+
+
+def SendLine(Socket, Lock, Message):
+    with Lock:
+        Socket.sendall((json.dumps(Message) + '\n').encode())
+
+
+class WorkerLink():
+    """The coordinator's end of a worker's connection. Everything the worker
+    sends, other than heartbeats, is put on Inbox along with this link, and
+    None once the connection is gone"""
+    def __init__(self, Socket, Address, Inbox):
+        self.Socket = Socket
+        self.Address = '%s:%s' % Address[:2]
+        self.Lock = threading.Lock()
+        self.LastSeen = time.monotonic()
+        self.Alive = True
+        self.Loaded = None
+        self.Shards = set()
+        self.Pending = set()
+        threading.Thread(target = self.Read, args = (Inbox,),
+                         daemon = True).start()
+
+    def Read(self, Inbox):
+        try:
+            for Line in self.Socket.makefile('rb'):
+                self.LastSeen = time.monotonic()
+                Message = json.loads(Line)
+                if Message.get('event') != 'heartbeat':
+                    Inbox.put((self, Message))
+        except (OSError, ValueError):
+            pass
+        Inbox.put((self, None))
+
+    def Send(self, Message):
+        """False if the worker can't be reached"""
+        try:
+            SendLine(self.Socket, self.Lock, Message)
+            return True
+        except OSError:
+            return False
+
+    def Close(self):
+        self.Alive = False
+        try:
+            self.Socket.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.Socket.close()
+
+
+class DistributedPlacement(ParsimoniusPlacement.FileItterator):
+    """A FileItterator whose add and remove steps and MetaData fits are
+    worked out by the workers connected to it, see the top of this file"""
+    def __init__(self):
+        ParsimoniusPlacement.FileItterator.__init__(self)
+        #where the coordinator listens for workers, port 0 picks a free one
+        self.Listen = ('127.0.0.1', 8766)
+        #workers to wait for before the first file is read, and how long to
+        #wait for them (or for any to join if they have all been lost)
+        self.MinWorkers = 1
+        self.WorkerWaitSeconds = 60.0
+        #a worker not heard from for this long is taken as lost
+        self.DeadSeconds = 5.0
+        #shards of the candidates per worker, more spreads a lost worker's
+        #share over the rest more evenly
+        self.ShardsPerWorker = 2
+        #worker processes started on this machine, see StartLocalWorkers
+        self.LocalWorkers = 0
+        self.HeartbeatSeconds = 1.0
+        self.Server = None
+        self.Inbox = queue.Queue()
+        self.Links = []
+        self.Processes = []
+        self.Requests = {}
+        self.Results = {}
+        self.NextId = 0
+        self.Dataset = None
+        self.Shards = []
+        self.Owners = []
+
+    def StartCoordinator(self):
+        """Listens for workers (and starts the local ones) if not already"""
+        if self.Server is not None:
+            return
+        self.Server = socket.create_server(self.Listen)
+        self.Listen = (self.Listen[0], self.Server.getsockname()[1])
+        print('       coordinator listening on %s:%s' % self.Listen)
+        threading.Thread(target = self.Accept, daemon = True).start()
+        self.StartLocalWorkers(self.LocalWorkers)
+
+    def StartLocalWorkers(self, Count):
+        for n in range(Count):
+            self.Processes.append(subprocess.Popen([sys.executable, __file__,
+                'worker', '--connect', '127.0.0.1:%s' % self.Listen[1],
+                '--heartbeat', str(self.HeartbeatSeconds)]))
+
+    def Accept(self):
+        while True:
+            try:
+                Socket, Address = self.Server.accept()
+            except OSError:
+                return
+            Socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            self.Inbox.put((WorkerLink(Socket, Address, self.Inbox), 'joined'))
+
+    def Live(self):
+        return [Link for Link in self.Links if Link.Alive]
+
+    def Pump(self, Timeout = 0.2):
+        """Deals with what has come in from the workers (joins, results and
+        lost connections) and with workers that have gone quiet"""
+        try:
+            Link, Message = self.Inbox.get(timeout = Timeout)
+        except queue.Empty:
+            Link, Message = None, None
+        if Message == 'joined':
+            self.Links.append(Link)
+            print('       worker', Link.Address, 'joined,', len(self.Live()),
+                  'working')
+            if self.Dataset is not None:
+                self.Adopt(Link)
+        elif Link is not None and Message is None:
+            self.Lost(Link, 'connection closed')
+        elif Link is not None and Link.Alive:
+            Id = Message.get('id')
+            if Message.get('event') == 'error' and Id not in self.Requests:
+                #a file that couldn't be read, say
+                raise RuntimeError('worker ' + Link.Address + ' failed\n' +
+                                   Message['message'])
+            Link.Pending.discard(Id)
+            if Id in self.Requests:
+                self.Results[Id] = Message
+        Now = time.monotonic()
+        for Link in self.Live():
+            if Now - Link.LastSeen > self.DeadSeconds:
+                self.Lost(Link, 'no heartbeat for ' + str(self.DeadSeconds) +
+                          's')
+
+    def Lost(self, Link, Reason):
+        """Takes a worker out, its shards go to the workers left and what it
+        was working on is sent again"""
+        if Link.Alive == False:
+            return
+        Link.Close()
+        print('       worker', Link.Address, 'lost -', Reason + ',',
+              len(self.Live()), 'left')
+        for Shard in sorted(Link.Shards):
+            self.Owners[Shard] = None
+        Link.Shards = set()
+        for Link2 in self.Live():
+            self.Adopt(Link2)
+        for Id in sorted(Link.Pending):
+            if Id not in self.Results:
+                self.Dispatch(Id)
+        Link.Pending = set()
+
+    def Adopt(self, Link):
+        """Gets a worker the current file, and a fair share of any shards
+        without an owner"""
+        self.Prepare(Link)
+        Orphans = [Shard for Shard, Owner in enumerate(self.Owners) if Owner
+                   is None]
+        Share = -(-len(Orphans) // max(1, len(self.Live())))
+        for Shard in Orphans[:Share]:
+            self.Assign(Shard, Link)
+        for Id, (Request, Owner) in list(self.Requests.items()):
+            if Owner is None and Id not in self.Results:
+                self.Dispatch(Id)
+
+    def Prepare(self, Link):
+        """Sends the current file to a worker that doesn't have it"""
+        if self.Dataset is not None and Link.Loaded != self.Dataset['id']:
+            Link.Loaded = self.Dataset['id']
+            if Link.Send(self.Dataset) == False:
+                self.Lost(Link, 'send failed')
+
+    def Assign(self, Shard, Link):
+        self.Owners[Shard] = Link
+        Link.Shards.add(Shard)
+        if Link.Send({'op': 'assign', 'shard': Shard, 'busses':
+                      self.Shards[Shard]}) == False:
+            self.Lost(Link, 'send failed')
+
+    def Request(self, Message):
+        """Queues a request to the workers, returns its id (see Gather)"""
+        Message['id'] = self.NextId
+        self.NextId += 1
+        self.Requests[Message['id']] = (Message, None)
+        self.Dispatch(Message['id'])
+        return Message['id']
+
+    def Dispatch(self, Id):
+        """Sends a request to the owner of its shard, or to the least busy
+        worker; if there are none it waits for one to join (see Adopt)"""
+        Message = self.Requests[Id][0]
+        Live = self.Live()
+        if len(Live) == 0:
+            self.Requests[Id] = (Message, None)
+            return
+        if 'shard' in Message:
+            Link = self.Owners[Message['shard']]
+            if Link is None:
+                Link = min(Live, key = lambda Link: len(Link.Shards))
+                self.Assign(Message['shard'], Link)
+        else:
+            Link = min(Live, key = lambda Link: len(Link.Pending))
+        self.Prepare(Link)
+        if Link.Alive == False:
+            self.Dispatch(Id)
+            return
+        self.Requests[Id] = (Message, Link)
+        Link.Pending.add(Id)
+        if Link.Alive == False or Link.Send(Message) == False:
+            self.Lost(Link, 'send failed')
+
+    def Gather(self, Ids):
+        """Waits for the results of the requests Ids, in that order"""
+        Waiting = time.monotonic()
+        while any(Id not in self.Results for Id in Ids):
+            self.Pump()
+            if len(self.Live()) > 0:
+                Waiting = time.monotonic()
+            elif time.monotonic() - Waiting > self.WorkerWaitSeconds:
+                raise RuntimeError('all the workers have been lost')
+        Results = [self.Results.pop(Id) for Id in Ids]
+        for Id in Ids:
+            del self.Requests[Id]
+        for Result in Results:
+            if Result.get('event') == 'error':
+                raise RuntimeError('worker failed\n' + Result['message'])
+        return Results
+
+    def Step(self):
+        """What the workers need to know of the current search"""
+        return {'placed': list(self.PlacedPMUs[1:]), 'degree':
+                self.PolynomialDegree, 'excluded': list(self.ExcludedBusses)}
+
+    def Rread(self):
+        """Has every worker read the file, then deals the candidate columns
+        out into shards"""
+        if self.BeamWidth > 1:
+            raise ValueError('the beam search runs on one machine, set ' +
+                             'BeamWidth = 1')
+        if self.VerboseOP == True:
+            print('       VerboseOP - the verbose rows stay on the workers')
+            self.VerboseOP = False
+        self.StartTrace()
+        Start = time.perf_counter()
+        self.StartCoordinator()
+        Waiting = time.monotonic()
+        while len(self.Live()) < max(1, self.MinWorkers):
+            if time.monotonic() - Waiting > self.WorkerWaitSeconds:
+                raise RuntimeError(str(len(self.Live())) + ' workers joined,' +
+                                   ' ' + str(self.MinWorkers) + ' needed')
+            self.Pump()
+        Settings = {Name: getattr(self, Name) for Name in self.SettingNames}
+        Settings.update(WorkerSettings)
+        self.Shards = []
+        self.Owners = []
+        self.Dataset = {'op': 'load', 'id': self.NextId, 'file':
+                        self.ip_filename, 'settings': Settings}
+        self.NextId += 1
+        for Link in self.Live():
+            self.Prepare(Link)
+        Headers = self.Gather([self.Request({'op': 'headers'})])[0]
+        self.Xheaders = Headers['Xheaders']
+        self.Yheader = Headers['Yheader']
+        self.ColumnIndexRows = Headers['index']
+        Candidates = [Bus for Bus in self.Xheaders if Bus not in
+                      self.ExcludedBusses]
+        Count = max(1, min(len(Candidates), self.ShardsPerWorker *
+                           len(self.Live())))
+        self.Shards = [Candidates[n::Count] for n in range(Count)]
+        self.Owners = [None] * Count
+        for Link in self.Live():
+            Link.Shards = set()
+            self.Adopt(Link)
+        print('      ', len(Candidates), 'candidates in', Count, 'shards on',
+              len(self.Live()), 'workers')
+        self.TraceStage('read', Start)
+
+    def AddBestPMU(self):
+        if self.Trace is not None:
+            Start = self.Trace.StartStep('add')
+        Step = self.Step()
+        Ids = [self.Request(dict(Step, op = 'add', shard = Shard)) for Shard
+               in range(len(self.Shards))]
+        Best = None
+        for Result in self.Gather(Ids):
+            if Result['best'] is not None and (Best is None or
+                                               Result['best'] > Best):
+                Best = Result['best']
+            if self.Trace is not None:
+                self.Trace.StepFits += Result['scored']
+        self.PlacedPMUs = [Best[0]] + list(self.PlacedPMUs[1:]) + [Best[1]]
+        if self.Trace is not None:
+            self.Trace.EndStep(Start, self.PolynomialDegree, self.PlacedPMUs)
+
+    def RemoveWorstPMU(self):
+        if self.Trace is not None:
+            Start = self.Trace.StartStep('remove')
+        self.PlacedPMUs = self.Gather([self.Request(dict(self.Step(),
+                                                    op = 'remove'))])[0]['placed']
+        if self.Trace is not None:
+            self.Trace.EndStep(Start, self.PolynomialDegree, self.PlacedPMUs)
+
+    def GenerateMetaData(self):
+        if self.GenMetaData == True:
+            Start = time.perf_counter()
+            self.MetaDataOP.append(self.Gather([self.Request(dict(self.Step(),
+                                   op = 'fit'))])[0]['metadata'])
+            self.TraceStage('metadata', Start)
+
+    def MultiTargetAllFiles(self, Targets, Degrees = None):
+        """The targets are searched one after the other, the workers read
+        the file again for each"""
+        for self.TargetValue in Targets:
+            self.SweepAllFiles(Degrees or [self.PolynomialDegree])
+
+    def WindowAllFiles(self):
+        raise ValueError('the rolling windows run on one machine')
+
+    def Shutdown(self):
+        """Stops the workers and closes the coordinator"""
+        for Link in self.Live():
+            Link.Send({'op': 'stop'})
+            Link.Close()
+        if self.Server is not None:
+            self.Server.close()
+            self.Server = None
+        for Process in self.Processes:
+            try:
+                Process.wait(10)
+            except subprocess.TimeoutExpired:
+                Process.kill()
+        self.Processes = []
+
+
+class Worker():
+    """Scores the candidates of the shards it's given for the coordinator,
+    on its own FileItterator holding the file"""
+    def __init__(self, Address, HeartbeatSeconds = 1.0, ConnectSeconds = 30.0):
+        Waiting = time.monotonic()
+        while True:
+            try:
+                self.Socket = socket.create_connection(Address)
+                break
+            except OSError:
+                if time.monotonic() - Waiting > ConnectSeconds:
+                    raise
+                time.sleep(0.5)
+        self.Socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.Lock = threading.Lock()
+        self.HeartbeatSeconds = HeartbeatSeconds
+        self.Stopped = threading.Event()
+        self.run = None
+        self.Shards = {}
+        self.Excluded = []
+
+    def Heartbeat(self):
+        while not self.Stopped.wait(self.HeartbeatSeconds):
+            try:
+                SendLine(self.Socket, self.Lock, {'event': 'heartbeat'})
+            except OSError:
+                return
+
+    def Serve(self):
+        threading.Thread(target = self.Heartbeat, daemon = True).start()
+        try:
+            for Line in self.Socket.makefile('rb'):
+                Request = json.loads(Line)
+                if Request['op'] == 'stop':
+                    break
+                try:
+                    Reply = self.Handle(Request)
+                    Reply['event'] = 'result'
+                except Exception:
+                    Reply = {'event': 'error', 'message': traceback.format_exc()}
+                if Reply is not None and 'id' in Request:
+                    Reply['id'] = Request['id']
+                    SendLine(self.Socket, self.Lock, Reply)
+        finally:
+            self.Stopped.set()
+            self.Socket.close()
+            if self.run is not None:
+                self.run.Reset()
+
+    def Handle(self, Request):
+        Op = Request['op']
+        if Op == 'load':
+            if self.run is not None:
+                self.run.Reset()
+            self.run = ParsimoniusPlacement.FileItterator()
+            for Name, Value in Request['settings'].items():
+                setattr(self.run, Name, Value)
+            self.run.ip_filename = Request['file']
+            self.run.Rread()
+            self.Shards = {}
+            return {}
+        if Op == 'assign':
+            self.Shards[Request['shard']] = frozenset(Request['busses'])
+            return {}
+        if Op == 'headers':
+            return {'Xheaders': self.run.Xheaders, 'Yheader': self.run.Yheader,
+                    'index': self.run.ColumnIndexRows}
+        run = self.run
+        run.PolynomialDegree = Request['degree']
+        run.ExcludedBusses = Request['excluded']
+        run.PlacedPMUs = [0] + Request['placed']
+        if Op == 'add':
+            Shard = self.Shards[Request['shard']]
+            if all(Bus in Request['placed'] for Bus in Shard):
+                return {'best': None, 'scored': 0}
+            #everything outside the shard is excluded for the step
+            run.ExcludedBusses = set(run.Xheaders) - Shard
+            run.AddBestPMU()
+            return {'best': [float(run.PlacedPMUs[0]), run.PlacedPMUs[-1]],
+                    'scored': len(run.TrialPMUs)}
+        if Op == 'remove':
+            run.RemoveWorstPMU()
+            return {'placed': [float(run.PlacedPMUs[0])] + run.PlacedPMUs[1:]}
+        if Op == 'fit':
+            run.MetaDataOP = []
+            run.GenerateMetaData()
+            return {'metadata': [float(Value) if not isinstance(Value, str)
+                                 else Value for Value in run.MetaDataOP[-1]]}
+        raise ValueError('unknown op ' + str(Op))
+
+
+def Address(Text):
+    Host, Port = Text.rsplit(':', 1)
+    return (Host, int(Port))
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == 'worker':
+        Parser = argparse.ArgumentParser(description = 'Distributed search' +
+                                         ' worker')
+        Parser.add_argument('--connect', type = Address, required = True,
+                            help = 'the coordinator, host:port')
+        Parser.add_argument('--heartbeat', type = float, default = 1.0,
+                            help = 'seconds between heartbeats')
+        Arguments = Parser.parse_args(sys.argv[2:])
+        Worker(Arguments.connect, Arguments.heartbeat).Serve()
+    elif len(sys.argv) > 1 and sys.argv[1] == 'coordinator':
+        Parser = argparse.ArgumentParser(description = 'Distributed search' +
+            ' coordinator, the other options are those of PlacementCLI.py')
+        Parser.add_argument('--listen', type = Address, default =
+                            ('127.0.0.1', 8766), help = 'host:port to take' +
+                            ' workers on (default 127.0.0.1:8766)')
+        Parser.add_argument('--min-workers', type = int, default = 1)
+        Parser.add_argument('--local-workers', type = int, default = 0,
+                            help = 'start this many workers on this machine')
+        Parser.add_argument('--shards-per-worker', type = int, default = 2)
+        Parser.add_argument('--dead-seconds', type = float, default = 5.0,
+                            help = 'a worker silent this long is lost')
+        Arguments, Rest = Parser.parse_known_args(sys.argv[2:])
+        run = DistributedPlacement()
+        run.Listen = Arguments.listen
+        run.MinWorkers = max(Arguments.min_workers, Arguments.local_workers)
+        run.LocalWorkers = Arguments.local_workers
+        run.ShardsPerWorker = Arguments.shards_per_worker
+        run.DeadSeconds = Arguments.dead_seconds
+        try:
+            ParsimoniusPlacement.Main(Rest + ['--jobs', '1'], run)
+        finally:
+            run.Shutdown()
+    else:
+        print('python DistributedSearch.py coordinator|worker --help')
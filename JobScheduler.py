@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+"""
+Runs a batch of placements as independent jobs on a pool of processes.
+
+A job is one (file, target, degree, excluded busses) combination. Each one
+runs in its own process with its own FileItterator (and its own R: session
+when the R engine is used, so nothing attached by one job can mask another)
+and writes its own Output/MetaData/VerboseOutput files. A job that fails is
+retried up to Attempts times, like FailoverAllFiles, and a job that keeps
+failing is reported without stopping the rest of the batch. A job that kills
+its worker process is found by running the jobs that were in the pool with
+it one at a time, so the others aren't charged for it.
+
+Used through FileItterator.ScheduleAllJobs(), see QuickRun.py.
+
+@author: pbrogan
+"""
+
+import concurrent.futures
+import itertools
+import os
+import time
+import traceback
+
+
+def ExpandJobs(FileNames, Targets, Degrees, ExcludedSets, Settings):
+    """One job (a dictionary of FileItterator settings) per combination"""
+    Jobs = []
+    for FileName, Target, Degree, Excluded in itertools.product(
+            FileNames, Targets, Degrees, ExcludedSets):
+        Job = dict(Settings)
+        Job['ip_filename'] = FileName
+        Job['TargetValue'] = Target
+        Job['PolynomialDegree'] = int(Degree)
+        Job['ExcludedBusses'] = list(Excluded)
+        #the pool is already using the cores
+        Job['Workers'] = 1
+        Jobs.append(Job)
+    return Jobs
+
+
+def JobName(Job):
+    Name = os.path.basename(Job['ip_filename']) + ' ' + str(Job['TargetValue'])
+    Name += ' degree ' + str(Job['PolynomialDegree'])
+    if len(Job['ExcludedBusses']) > 0:
+        Name += ' excluding ' + ' '.join(str(Bus) for Bus in Job['ExcludedBusses'])
+    return Name
+
+
+def RunJob(Job):
+    """Runs one job start to finish in this process, returns the error
+    traceback (None if it worked) and the time taken"""
+    import ParsimoniusPlacement
+    Start = time.time()
+    run = None
+    try:
+        run = ParsimoniusPlacement.FileItterator()
+        for Name, Value in Job.items():
+            setattr(run, Name, Value)
+        run.Rread()
+        run.PlaceAllPMUs()
+        run.WriteAllToCSV()
+        Error = None
+    except Exception:
+        Error = traceback.format_exc()
+    if run is not None:
+        try:
+            run.Reset()
+        except Exception:
+            pass
+    return Error, time.time() - Start
+
+
+def MakePool(MaxWorkers):
+    """A fresh process for every job where Python supports it (3.11 on)"""
+    try:
+        return concurrent.futures.ProcessPoolExecutor(MaxWorkers, 
+                                                      max_tasks_per_child = 1)
+    except TypeError:
+        return concurrent.futures.ProcessPoolExecutor(MaxWorkers)
+
+
+def ScheduleJobs(Jobs, MaxWorkers = 2, Attempts = 3):
+    """Runs the jobs at most MaxWorkers at a time, returns a list with one
+    (job name, error or None, seconds) entry per job in the order given
+
+    A worker process dying (R: crashing, os._exit, running out of memory)
+    breaks the whole pool and every job in it fails with BrokenProcessPool,
+    so that isn't counted as a try. The jobs that were running when it broke
+    are run again one at a time, each in a pool of its own, where a crash
+    can only be down to that job, and the rest are carried on with."""
+    Results = [None] * len(Jobs)
+    Tries = [0] * len(Jobs)
+    Pending = list(range(len(Jobs)))
+    Suspects = []
+    while len(Pending) + len(Suspects) > 0:
+        if len(Suspects) > 0:
+            Queue, Workers = [Suspects.pop(0)], 1
+        else:
+            Queue, Workers, Pending = sorted(Pending), MaxWorkers, []
+        with MakePool(Workers) as Pool:
+            #only as many submitted as can run, so those left when the pool
+            #breaks are the ones that were in it
+            Running = {}
+            while len(Queue) + len(Running) > 0:
+                while len(Queue) > 0 and len(Running) < Workers:
+                    n = Queue.pop(0)
+                    Running[Pool.submit(RunJob, Jobs[n])] = n
+                Done, _ = concurrent.futures.wait(
+                    Running, return_when = concurrent.futures.FIRST_COMPLETED)
+                Broken = False
+                for Future in Done:
+                    n = Running.pop(Future)
+                    Crashed = False
+                    try:
+                        Error, Seconds = Future.result()
+                    except concurrent.futures.process.BrokenProcessPool:
+                        if Workers > 1:
+                            #can't tell which job took the pool down yet
+                            Broken = True
+                            Suspects.append(n)
+                            continue
+                        Error, Seconds = traceback.format_exc(), 0.0
+                        Crashed = True
+                    except Exception:
+                        Error, Seconds = traceback.format_exc(), 0.0
+                    Tries[n] += 1
+                    if Error is None:
+                        print('###### done', JobName(Jobs[n]), 'in', 
+                              round(Seconds, 1), 's ######')
+                    elif Tries[n] < Attempts:
+                        print('~~~~~~~~~~~~############~~~~~~~~~~~~~~~')
+                        print('         ', JobName(Jobs[n]), 'failed', Tries[n], 'time')
+                        print('~~~~~~~~~~~~############~~~~~~~~~~~~~~~')
+                        #a job that crashed its worker keeps a pool to itself
+                        (Suspects if Crashed else Pending).append(n)
+                        continue
+                    else:
+                        print('!!!!!!!!!!!!   Failure   !!!!!!!!!!!!!!!')
+                        print(JobName(Jobs[n]), 'gave up after', Tries[n], 'attempts')
+                        print(Error)
+                    Results[n] = (JobName(Jobs[n]), Error, Seconds)
+                if Broken:
+                    print('~~~~~~~~~~~~############~~~~~~~~~~~~~~~')
+                    print('          a worker died, running', 
+                          len(Suspects) + len(Running), 'jobs on their own')
+                    print('~~~~~~~~~~~~############~~~~~~~~~~~~~~~')
+                    Suspects.extend(sorted(Running.values()))
+                    Pending.extend(Queue)
+                    break
+    return Results
@@ -0,0 +1,992 @@
+# -*- coding: utf-8 -*-
+"""
+Least squares back end that works directly on numpy arrays, used in place of
+R: when FileItterator.Engine = 'numpy'. Nothing in here needs R: or rpy2.
+
+The models fitted are the same as the R: formula built by SetFormula, i.e.
+Y ~ poly(X1, d, raw = TRUE) + poly(X2, d, raw = TRUE) + ... so an intercept
+plus the powers 1 through d of every column. Raw powers of big numbers (e.g.
+Time.UTC is ~1.2e9) are horribly conditioned, so each column is shifted and
+scaled into [-1, 1] before the powers are taken and the fitted coefficients
+are mapped back onto the raw powers afterwards. R^2 doesn't change under that
+transform, the coefficients are the ones R: would report.
+
+@author: pbrogan
+"""
+
+import csv
+from math import comb
+
+import numpy as np
+
+
+def MakeNames(Headers):
+    """Mimics R:'s make.names(unique = TRUE), which read.csv applies to the
+    headers, so 'CO2 Intensity kg/MW' becomes 'CO2.Intensity.kg.MW' and the
+    TargetValue is spelled the same whichever engine is used"""
+    Names = []
+    for Header in Headers:
+        Name = ''
+        for Char in Header:
+            if Char.isalnum() or Char in '._':
+                Name += Char
+            else:
+                Name += '.'
+        if Name == '' or Name[0].isdigit() or Name[0] == '_' or \
+        (Name[0] == '.' and len(Name) > 1 and Name[1].isdigit()):
+            Name = 'X' + Name
+        Names.append(Name)
+    Seen = {}
+    for n, Name in enumerate(Names):
+        if Name in Seen:
+            Count = Seen[Name]
+            while (Name + '.' + str(Count)) in Names:
+                Count += 1
+            Seen[Name] = Count + 1
+            Names[n] = Name + '.' + str(Count)
+        else:
+            Seen[Name] = 1
+    return Names
+
+
+def ReadNumericCSV(FileName):
+    """Reads a CSV file, first line headers, and returns the (R: style)
+    headers of the numeric columns, the numeric data as a rows x columns float
+    array and the headers of the columns that were rejected as not numeric.
+    Rows with missing values ('' or 'NA') in any numeric column are dropped,
+    lm would drop them in R: anyway"""
+    with open(FileName, newline = '') as ipFile:
+        reader = csv.reader(ipFile)
+        Headers = MakeNames(next(reader))
+        Rows = [Row for Row in reader if len(Row) > 0]
+    NumericHeaders = []
+    Rejected = []
+    Columns = []
+    for n, Header in enumerate(Headers):
+        Column = [Row[n] if n < len(Row) else '' for Row in Rows]
+        Column = ['nan' if Cell.strip() in ('', 'NA') else Cell
+                  for Cell in Column]
+        try:
+            Columns.append(np.array(Column, dtype = float))
+            NumericHeaders.append(Header)
+        except ValueError:
+            Rejected.append(Header)
+    if len(Columns) == 0:
+        return NumericHeaders, np.empty((len(Rows), 0)), Rejected
+    Data = np.column_stack(Columns)
+    Complete = ~np.isnan(Data).any(axis = 1)
+    if not Complete.all():
+        print('      ', int((~Complete).sum()), 'rows with missing values dropped')
+        Data = Data[Complete]
+    return NumericHeaders, Data, Rejected
+
+
+def FileHash(FileName, BlockSize = 1 << 20):
+    """sha1 of a file's contents, read a block at a time"""
+    import hashlib
+    Hash = hashlib.sha1()
+    with open(FileName, 'rb') as ipFile:
+        for Block in iter(lambda: ipFile.read(BlockSize), b''):
+            Hash.update(Block)
+    return Hash.hexdigest()
+
+
+def ReadHeaders(FileName):
+    """The (R: style) headers of every column of a CSV"""
+    with open(FileName, newline = '') as ipFile:
+        return MakeNames(next(csv.reader(ipFile)))
+
+
+def PrefixSample(FileName, Size, BlockSize = 1 << 20):
+    """sha1 of the first and last BlockSize bytes of the first Size bytes of
+    a file; enough to tell a file that has only had rows added to its end
+    from one that was rewritten, without reading it all again"""
+    import hashlib
+    Hash = hashlib.sha1(str(Size).encode())
+    with open(FileName, 'rb') as ipFile:
+        Hash.update(ipFile.read(min(Size, BlockSize)))
+        ipFile.seek(max(0, Size - BlockSize))
+        Hash.update(ipFile.read(min(Size, BlockSize)))
+    return Hash.hexdigest()
+
+
+def ReadAppendedRows(FileName, Offset, Width, Columns):
+    """The rows of a CSV after byte Offset (the size it was when last read,
+    which has to have ended a line) as floats, just the Columns (positions
+    among the Width headers) kept. Rows with missing values are dropped as
+    ReadNumericCSV does. Returns the values and how many rows were dropped,
+    or None if the rows can't simply be added on; the last read didn't end
+    on a line, or one of the Columns has something that isn't a number (a
+    full read would reject that column)"""
+    import io
+    with open(FileName, 'rb') as ipFile:
+        ipFile.seek(max(0, Offset - 1))
+        if Offset > 0 and ipFile.read(1) not in (b'\n', b'\r'):
+            return None
+        Text = ipFile.read().decode()
+    Rows = [Row + [''] * (Width - len(Row)) for Row in 
+            csv.reader(io.StringIO(Text, newline = '')) if len(Row) > 0]
+    if len(Rows) == 0:
+        return np.empty((0, len(Columns))), 0
+    Chunk = np.array(Rows, dtype = str)[:, Columns]
+    Chunk[np.isin(np.char.strip(Chunk), ['', 'NA'])] = 'nan'
+    try:
+        Values = Chunk.astype(float)
+    except ValueError:
+        return None
+    Complete = ~np.isnan(Values).any(axis = 1)
+    return Values[Complete], int((~Complete).sum())
+
+
+def ReadCachedCSV(FileName, CacheDirectory):
+    """ReadNumericCSV, but the parsed columns are kept in CacheDirectory as a
+    column major .npy file with a schema.json beside it (headers, rejected
+    columns and the size, modification time and sha1 of the CSV it came
+    from). If the CSV hasn't changed the cached array is memory mapped rather
+    than parsing the text again. A changed modification time with the same
+    size only costs a hash of the file."""
+    import json
+    import os
+    Folder = os.path.join(CacheDirectory, os.path.basename(FileName))
+    SchemaFile = os.path.join(Folder, 'schema.json')
+    DataFile = os.path.join(Folder, 'data.npy')
+    Status = os.stat(FileName)
+    Schema = None
+    if os.path.exists(SchemaFile) and os.path.exists(DataFile):
+        with open(SchemaFile) as ipFile:
+            Schema = json.load(ipFile)
+        if Schema['Size'] != Status.st_size:
+            Schema = None
+        elif Schema['ModifiedTime'] != Status.st_mtime:
+            if Schema['Hash'] == FileHash(FileName):
+                Schema['ModifiedTime'] = Status.st_mtime
+                with open(SchemaFile, 'w') as opFile:
+                    json.dump(Schema, opFile)
+            else:
+                Schema = None
+    if Schema is not None:
+        Data = np.load(DataFile, mmap_mode = 'r')
+        return Schema['Headers'], Data, Schema['Rejected']
+    Headers, Data, Rejected = ReadNumericCSV(FileName)
+    os.makedirs(Folder, exist_ok = True)
+    np.save(DataFile, np.asfortranarray(Data))
+    Schema = {'Source': os.path.abspath(FileName), 'Size': Status.st_size, 
+              'ModifiedTime': Status.st_mtime, 'Hash': FileHash(FileName),
+              'Rows': int(Data.shape[0]), 'Headers': Headers, 
+              'Rejected': Rejected}
+    #schema last, a half written cache is never picked up
+    with open(SchemaFile, 'w') as opFile:
+        json.dump(Schema, opFile, indent = 1)
+    return Headers, Data, Rejected
+
+
+def ColumnScaling(Data):
+    """Returns the centre and half range of each column, used to map the
+    column into [-1, 1] before taking powers. Constant columns get a scale of
+    1 so they come out as zeros rather than NaNs"""
+    Data = np.asarray(Data, dtype = float)
+    if Data.ndim == 1:
+        Data = Data[:, None]
+    High = Data.max(axis = 0)
+    Low = Data.min(axis = 0)
+    Centres = (High + Low) / 2.0
+    Scales = (High - Low) / 2.0
+    Scales[Scales == 0] = 1.0
+    return Centres, Scales
+
+
+def PolyBlock(Column, Degree, Centre, Scale):
+    """The powers 1..Degree of one scaled column, rows x Degree"""
+    z = (np.asarray(Column, dtype = float) - Centre) / Scale
+    return np.column_stack([z ** p for p in range(1, Degree + 1)])
+
+
+def RawBlockCoefficients(Scaled, Centre, Scale):
+    """Maps the coefficients of the powers of z = (x - Centre) / Scale back
+    onto the raw powers of x, i.e. what poly(x, d, raw = TRUE) would give.
+    Returns the amount to add to the intercept and the raw coefficients of
+    x^1..x^d"""
+    Degree = len(Scaled)
+    Raw = np.zeros(Degree + 1)
+    for p in range(1, Degree + 1):
+        bp = Scaled[p - 1] / Scale ** p
+        for q in range(0, p + 1):
+            Raw[q] += bp * comb(p, q) * (-Centre) ** (p - q)
+    return Raw[0], Raw[1:]
+
+
+def FitPolyModel(Columns, y, Degree, Centres = None, Scales = None,
+                 Score = 'R2', HoldoutBlocks = 5):
+    """Fits y ~ poly(X1, d, raw = TRUE) + poly(X2, d, raw = TRUE) + ... where
+    Columns is rows x k with one column per variable in the formula. Returns
+    the multiple R^2 (or the Score asked for, see FitFeatures) and the 
+    coefficient list in R:'s order; intercept then x1^1..x1^d, x2^1..x2^d etc."""
+    Columns = np.asarray(Columns, dtype = float)
+    if Columns.ndim == 1:
+        Columns = Columns[:, None]
+    if Centres is None or Scales is None:
+        Centres, Scales = ColumnScaling(Columns)
+    Blocks = [PolyBlock(Columns[:, n], Degree, Centres[n], Scales[n])
+              for n in range(Columns.shape[1])]
+    return FitFeatures(np.hstack(Blocks), y, Degree, Centres, Scales, Score,
+                       HoldoutBlocks)
+
+
+def FitFeatures(Features, y, Degree, Centres, Scales, Score = 'R2', 
+                HoldoutBlocks = 5):
+    """FitPolyModel on features already made, rows x (k * Degree) holding
+    the scaled powers of each column in turn, e.g. a slice of a feature bank
+    (see PolyFeatures). Score = 'PRESS' gives 1 - PRESS / TSS instead of R^2,
+    the leave one out errors come from the leverages (the row sums of Q^2
+    from the QR the fit is solved with) so nothing is refitted. Score =
+    'holdout' gives HoldoutScore over HoldoutBlocks runs of rows"""
+    y = np.asarray(y, dtype = float)
+    Design = np.hstack([np.ones((len(y), 1)), Features])
+    Aliased = AliasedColumns(Design)
+    Beta = np.zeros(Design.shape[1])
+    Kept = ~Aliased
+    TSS = float(((y - y.mean()) ** 2).sum())
+    if Score == 'PRESS':
+        Q, R = np.linalg.qr(Design[:, Kept])
+        Beta[Kept] = np.linalg.solve(R, Q.T @ y)
+        Residuals = y - Design[:, Kept] @ Beta[Kept]
+        Left = 1.0 - (Q ** 2).sum(axis = 1)
+        #a row with a leverage of 1 can't be predicted without itself
+        if (Left <= 1e-10).any():
+            ResSquare = -np.inf
+        else:
+            PRESS = float(((Residuals / Left) ** 2).sum())
+            ResSquare = 1.0 - PRESS / TSS if TSS > 0 else 0.0
+        return ResSquare, RawCoefficients(Beta, Degree, Centres, Scales, Aliased)
+    Beta[Kept] = np.linalg.lstsq(Design[:, Kept], y, rcond = None)[0]
+    if Score == 'holdout':
+        Width = int(Kept.sum())
+        Folds = HoldoutFolds(BlockMomentStats(np.column_stack([
+            Design[:, Kept][:, 1:], y]), HoldoutBlocks))
+        ResSquare = HoldoutScore(Folds, np.arange(Width - 1), Width - 1)
+        return ResSquare, RawCoefficients(Beta, Degree, Centres, Scales, Aliased)
+    if Score != 'R2':
+        raise ValueError('Score should be R2, PRESS or holdout, not ' + 
+                         str(Score))
+    Residuals = y - Design[:, Kept] @ Beta[Kept]
+    RSS = float(Residuals @ Residuals)
+    if TSS > 0:
+        ResSquare = max(0.0, 1.0 - RSS / TSS)
+    else:
+        ResSquare = 0.0
+    return ResSquare, RawCoefficients(Beta, Degree, Centres, Scales, Aliased)
+
+
+def AliasedColumns(Design, Tolerance = 1e-7):
+    """Flags the columns lm would report as NA; a column is aliased when what
+    is left of it, after projecting out the columns before it, is smaller
+    than Tolerance times its own length (the same test as R:'s dqrdc2)"""
+    Norms = np.sqrt((Design ** 2).sum(axis = 0))
+    Diagonal = np.abs(np.diag(np.linalg.qr(Design, mode = 'r')))
+    return Diagonal <= Tolerance * np.maximum(Norms, np.finfo(float).tiny)
+
+
+def RawCoefficients(Beta, Degree, Centres, Scales, Aliased = None):
+    """Turns a scaled coefficient vector (intercept then one block of Degree
+    per variable) into the raw coefficient list R: would report, coefficients
+    of aliased columns come out as NaN the way lm gives NA"""
+    Intercept = float(Beta[0])
+    Coefficients = []
+    for n in range(len(Centres)):
+        Shift, Raw = RawBlockCoefficients(
+            Beta[1 + n * Degree: 1 + (n + 1) * Degree], Centres[n], Scales[n])
+        Intercept += Shift
+        Coefficients += [float(a) for a in Raw]
+    if Aliased is not None:
+        Coefficients = [np.nan if Aliased[n + 1] else Coefficient
+                        for n, Coefficient in enumerate(Coefficients)]
+    return [Intercept] + Coefficients
+
+
+def PolyFeatures(Data, Degree, Centres, Scales):
+    """The scaled powers 1..Degree of every column of Data, rows x (columns *
+    Degree) with column j's powers in positions j*Degree .. j*Degree+Degree-1"""
+    z = (np.asarray(Data, dtype = float) - Centres) / Scales
+    Features = np.empty((z.shape[0], z.shape[1], Degree))
+    Features[:, :, 0] = z
+    for p in range(1, Degree):
+        Features[:, :, p] = Features[:, :, p - 1] * z
+    return Features.reshape(z.shape[0], z.shape[1] * Degree)
+
+
+def ScreenFeatures(Data, Degree, Centres, Scales):
+    """PolyFeatures centred and scaled to unit length, for ScreenScores"""
+    Features = PolyFeatures(Data, Degree, Centres, Scales)
+    Features -= Features.mean(axis = 0)
+    Lengths = np.sqrt((Features ** 2).sum(axis = 0))
+    Lengths[Lengths == 0] = 1.0
+    Features /= Lengths
+    return Features
+
+
+def ScreenScores(Features, y, Placed, Degree):
+    """A rough score for adding each column to the model of y on the Placed
+    columns: the squared partial correlations of its powers with the 
+    residual of that model, summed over the column's block. Features comes
+    from ScreenFeatures; the residual needs one least squares fit (a QR of
+    the placed block) and then every column is scored from two matrix
+    products, the residual's and the placed block's with all the features"""
+    Residual = y - y.mean()
+    Lengths = np.ones(Features.shape[1])
+    if len(Placed) > 0:
+        Q = np.linalg.qr(Features[:, [Column * Degree + p for Column in Placed
+                                      for p in range(Degree)]])[0]
+        Residual = Residual - Q @ (Q.T @ Residual)
+        #what's left of each (unit length) power once the placed are taken out
+        Lengths = 1.0 - ((Q.T @ Features) ** 2).sum(axis = 0)
+    Length = np.sqrt(Residual @ Residual)
+    if Length == 0:
+        return np.zeros(Features.shape[1] // Degree)
+    #the residual is already clear of the placed columns so the plain
+    #product gives the partial correlation's numerator
+    Correlations = (Features.T @ Residual) / Length
+    Squared = np.where(Lengths > 1e-10, Correlations ** 2 / np.maximum(
+        Lengths, 1e-10), 0.0)
+    return np.minimum(Squared, 1.0).reshape(-1, Degree).sum(axis = 1)
+
+
+class MomentStats():
+    """Running mean and centred cross products (co-moments) of a set of
+    columns; everything a least squares fit with an intercept needs. Chunks of
+    rows are merged in with Chan's pairwise update rather than summing raw
+    cross products, which keeps the sums well conditioned"""
+    def __init__(self, Width):
+        self.n = 0
+        self.Mean = np.zeros(Width)
+        self.CoMoment = np.zeros((Width, Width))
+        
+    def Update(self, Chunk):
+        """Merges a rows x Width chunk into the statistics"""
+        Chunk = np.asarray(Chunk, dtype = float)
+        nb = Chunk.shape[0]
+        if nb == 0:
+            return
+        MeanB = Chunk.mean(axis = 0)
+        Centred = Chunk - MeanB
+        CoMomentB = Centred.T @ Centred
+        Delta = MeanB - self.Mean
+        nTotal = self.n + nb
+        self.CoMoment += CoMomentB + np.outer(Delta, Delta) * (self.n * nb / nTotal)
+        self.Mean += Delta * (nb / nTotal)
+        self.n = nTotal
+        
+    def Merge(self, Other):
+        """Merges in the statistics of another set of rows"""
+        if Other.n == 0:
+            return
+        Delta = Other.Mean - self.Mean
+        nTotal = self.n + Other.n
+        self.CoMoment += Other.CoMoment + np.outer(Delta, Delta) * (
+            self.n * Other.n / nTotal)
+        self.Mean += Delta * (Other.n / nTotal)
+        self.n = nTotal
+        
+    def LeaveOut(self, Other):
+        """The statistics of these rows less those of Other (rows that were
+        merged into these), Chan's merge run backwards"""
+        Rest = MomentStats(len(self.Mean))
+        Rest.n = self.n - Other.n
+        if Rest.n <= 0:
+            return Rest
+        Rest.Mean = (self.n * self.Mean - Other.n * Other.Mean) / Rest.n
+        Delta = Other.Mean - Rest.Mean
+        Rest.CoMoment = self.CoMoment - Other.CoMoment - np.outer(Delta, 
+            Delta) * (Rest.n * Other.n / self.n)
+        return Rest
+        
+    def RawDiagonal(self):
+        """Sum of squares of each column about zero rather than the mean"""
+        return np.diag(self.CoMoment) + self.n * self.Mean ** 2
+
+
+def BuildMomentStats(Data, Targets, Degree, Centres, Scales, ChunkRows = 20000):
+    """Builds the MomentStats of the polynomial features of Data (see
+    PolyFeatures) followed by the Targets columns, a chunk of rows at a time
+    so the full feature matrix is never held in memory"""
+    Targets = np.asarray(Targets, dtype = float)
+    if Targets.ndim == 1:
+        Targets = Targets[:, None]
+    Stats = MomentStats(Data.shape[1] * Degree + Targets.shape[1])
+    for Start in range(0, Data.shape[0], ChunkRows):
+        Stop = Start + ChunkRows
+        Stats.Update(np.hstack([PolyFeatures(Data[Start:Stop], Degree, Centres,
+                     Scales), Targets[Start:Stop]]))
+    return Stats
+
+
+def ColumnFingerprints(Data, Centres, Scales, ChunkRows = 20000, Digits = 8):
+    """A fingerprint of every column once it is mapped into [-1, 1] (see
+    ColumnScaling) and turned over, if need be, so its first value well off
+    the centre is positive: its first three moments and its sum against a
+    fixed random vector, rounded. Columns that are a straight line function
+    of each other (copies, the same thing in other units, negated) get the
+    same fingerprint and, poly(x, d) spanning the same space for all of them,
+    give the same fits. Returns the fingerprints and the sign each column was
+    turned over by, 0 for a constant column"""
+    Rows, Width = Data.shape
+    Weights = np.random.default_rng(0).standard_normal(Rows)
+    Sign = np.zeros(Width)
+    Sums = np.zeros((4, Width))
+    for Start in range(0, Rows, ChunkRows):
+        z = (Data[Start:Start + ChunkRows] - Centres) / Scales
+        Off = np.abs(z) > 0.5
+        First = Off.argmax(axis = 0)
+        New = (Sign == 0) & Off.any(axis = 0)
+        Sign[New] = np.sign(z[First[New], np.flatnonzero(New)])
+        Square = z * z
+        Sums += [z.sum(axis = 0), Square.sum(axis = 0), (Square * z).sum(axis = 0),
+                 Weights[Start:Start + ChunkRows] @ z]
+    Sums[[0, 2, 3]] *= Sign
+    return [tuple(Column) for Column in np.round(Sums.T / Rows, Digits)], Sign
+
+
+def DuplicateColumns(Data, Centres, Scales, Tolerance = 1e-9):
+    """Groups the columns of Data that are a straight line function of each
+    other, found by their fingerprints (see ColumnFingerprints) and then
+    checked value by value. Returns the groups of two or more (lists of
+    column numbers, in order) and the constant columns"""
+    Prints, Sign = ColumnFingerprints(Data, Centres, Scales)
+    Constant = [n for n in range(len(Prints)) if Sign[n] == 0]
+    Buckets = {}
+    for n, Print in enumerate(Prints):
+        if Sign[n] != 0:
+            Buckets.setdefault(Print, []).append(n)
+    Groups = []
+    for Members in Buckets.values():
+        while len(Members) > 1:
+            z = Sign[Members] * (Data[:, Members] - Centres[Members]) / \
+                Scales[Members]
+            Same = np.abs(z - z[:, :1]).max(axis = 0) <= Tolerance
+            if Same.sum() > 1:
+                Groups.append([n for n, Match in zip(Members, Same) if Match])
+            Members = [n for n, Match in zip(Members, Same) if not Match]
+    return sorted(Groups), Constant
+
+
+def StatsCorrelation(Stats, Columns, Stride):
+    """The correlation matrix of the Columns (their first powers) from the
+    cross products in a MomentStats built with Stride powers per column, and
+    the variance of each; constant columns get 0 correlations"""
+    Positions = np.asarray(Columns, dtype = int) * Stride
+    CoMoment = Stats.CoMoment[np.ix_(Positions, Positions)]
+    Variance = np.clip(np.diag(CoMoment) / max(Stats.n, 1), 0.0, None)
+    Root = np.sqrt(np.diag(CoMoment).clip(0.0))
+    Root[Root == 0] = np.inf
+    return CoMoment / np.outer(Root, Root), Variance
+
+
+def DataCorrelation(Data, Columns, ChunkRows = 20000):
+    """StatsCorrelation of the Columns of Data, from the rows"""
+    Stats = MomentStats(len(Columns))
+    for Start in range(0, Data.shape[0], ChunkRows):
+        Stats.Update(Data[Start:Start + ChunkRows][:, Columns])
+    return StatsCorrelation(Stats, range(len(Columns)), 1)
+
+
+def StatsDuplicateColumns(Stats, Columns, Stride, Tolerance = 1e-12):
+    """DuplicateColumns from the cross products alone (when the rows aren't
+    held): columns correlated to within Tolerance of +-1 are taken as a
+    straight line function of each other"""
+    C, Variance = StatsCorrelation(Stats, Columns, Stride)
+    Constant = [n for n in range(len(Columns)) if Variance[n] == 0]
+    Groups = []
+    Grouped = set(Constant)
+    for n in range(len(Columns)):
+        if n not in Grouped:
+            Members = [m for m in range(n, len(Columns)) if m not in Grouped
+                       and 1.0 - abs(C[n, m]) <= Tolerance]
+            Grouped.update(Members)
+            if len(Members) > 1:
+                Groups.append(Members)
+    return Groups, Constant
+
+
+def PivotedCholesky(C, Tolerance):
+    """Rank revealing Cholesky of the correlation matrix C, the column with
+    the most variance left unexplained is taken as the next pivot until none
+    has more than Tolerance left. Returns the pivots in order, the variance
+    of every column left unexplained by them (1 - R^2 on the pivots, 0 for
+    the pivots themselves) and the factor, a column per pivot"""
+    Width = len(C)
+    L = np.zeros((Width, Width))
+    Left = np.diag(C).astype(float).copy()
+    Pivots = []
+    for k in range(Width):
+        Scores = Left.copy()
+        Scores[Pivots] = -1.0
+        j = int(np.argmax(Scores))
+        if Scores[j] <= Tolerance:
+            break
+        L[:, k] = (C[:, j] - L[:, :k] @ L[j, :k]) / np.sqrt(Left[j])
+        Left = np.clip(Left - L[:, k] ** 2, 0.0, None)
+        Pivots.append(j)
+        Left[Pivots] = 0.0
+    return Pivots, Left, L[:, :len(Pivots)]
+
+
+def CollinearClusters(C, Tolerance = 1e-6, Share = 0.01):
+    """Clusters of columns that are (near) linear combinations of each other,
+    from PivotedCholesky of their correlation matrix C. Each column with less
+    than Tolerance of its variance left unexplained by the pivots is put with
+    the pivots that make up at least Share of its combination, and clusters
+    that share a column are merged. Returns [Members, Dependent, Unexplained]
+    for each, the column numbers in order, those of them that were left
+    over, and the most variance left unexplained among those"""
+    Pivots, Left, L = PivotedCholesky(C, Tolerance)
+    Pivots = np.asarray(Pivots, dtype = int)
+    Owner = list(range(len(C)))
+
+    def Find(n):
+        while Owner[n] != n:
+            Owner[n] = Owner[Owner[n]]
+            n = Owner[n]
+        return n
+    Dependent = [n for n in range(len(C)) if n not in Pivots and C[n, n] > 0]
+    if len(Dependent) > 0:
+        Weights = np.abs(np.linalg.lstsq(L[Pivots].T, L[Dependent].T, 
+                                         rcond = None)[0])
+        for n, Column in zip(Dependent, Weights.T):
+            for Pivot in Pivots[Column >= Share * Column.sum()]:
+                Owner[Find(int(Pivot))] = Find(n)
+    Clusters = {}
+    for n in range(len(C)):
+        Clusters.setdefault(Find(n), []).append(n)
+    return sorted([Members, [n for n in Members if n in Dependent],
+                   float(max(Left[n] for n in Members))]
+                  for Members in Clusters.values() if len(Members) > 1)
+
+
+def BlockBounds(Rows, Blocks):
+    """Where each of Blocks runs of rows starts (and the last ends), block j
+    being rows Bounds[j]:Bounds[j + 1]; the same split as R:'s 
+    ceiling(seq_len(n) * k / n)"""
+    return [Rows * j // Blocks for j in range(Blocks + 1)]
+
+
+def BlockMomentStats(Data, Blocks):
+    """The MomentStats of each of Blocks contiguous runs of the rows of Data"""
+    Bounds = BlockBounds(Data.shape[0], Blocks)
+    Stats = []
+    for Start, Stop in zip(Bounds[:-1], Bounds[1:]):
+        Stats.append(MomentStats(Data.shape[1]))
+        Stats[-1].Update(Data[Start:Stop])
+    return Stats
+
+
+def BuildBlockStats(Data, Targets, Degree, Centres, Scales, Blocks):
+    """BuildMomentStats for each of Blocks contiguous runs of rows"""
+    Bounds = BlockBounds(Data.shape[0], Blocks)
+    return [BuildMomentStats(Data[Start:Stop], Targets[Start:Stop], Degree,
+            Centres, Scales) for Start, Stop in zip(Bounds[:-1], Bounds[1:])]
+
+
+def HoldoutFolds(Blocks):
+    """(everything else, the block) pairs of MomentStats for holding out
+    each block in turn"""
+    Total = MomentStats(len(Blocks[0].Mean))
+    for Block in Blocks:
+        Total.Merge(Block)
+    return [(Total.LeaveOut(Block), Block) for Block in Blocks]
+
+
+def HoldoutScore(Folds, Features, Target):
+    """Blocked holdout R^2 of Target on the columns Features (positions in
+    the MomentStats of Folds, see HoldoutFolds). Each block is predicted by
+    the least squares fit to the rest, and 1 - (the sum of the squared
+    errors) / (the same for predicting each block by the mean of the rest)
+    is returned. Only the cross products are needed; the errors on a block
+    come from its own mean and co-moments"""
+    Features = np.asarray(Features, dtype = int)
+    SSE = 0.0
+    SSE0 = 0.0
+    for Train, Test in Folds:
+        if Train.n == 0 or Test.n == 0:
+            continue
+        G = Train.CoMoment
+        Beta = np.linalg.lstsq(G[np.ix_(Features, Features)], 
+                               G[Features, Target], rcond = None)[0]
+        Shift = Test.Mean[Target] - Train.Mean[Target]
+        Offset = Shift - Beta @ (Test.Mean[Features] - Train.Mean[Features])
+        H = Test.CoMoment
+        SSE += H[Target, Target] - 2 * Beta @ H[Features, Target] + \
+               Beta @ H[np.ix_(Features, Features)] @ Beta + Test.n * Offset ** 2
+        SSE0 += H[Target, Target] + Test.n * Shift ** 2
+    if SSE0 <= 0:
+        return 0.0
+    return float(1.0 - SSE / SSE0)
+
+
+def CSVChunks(FileName, ChunkRows):
+    """Reads a CSV ChunkRows lines at a time, yields the (R: style) headers
+    and then each chunk as a rows x columns array of strings, missing values
+    as 'nan'"""
+    import itertools
+    with open(FileName, newline = '') as ipFile:
+        reader = csv.reader(ipFile)
+        Headers = MakeNames(next(reader))
+        yield Headers
+        while True:
+            Rows = [Row + [''] * (len(Headers) - len(Row)) for Row in
+                    itertools.islice(reader, ChunkRows) if len(Row) > 0]
+            if len(Rows) == 0:
+                return
+            Chunk = np.array(Rows, dtype = str)[:, :len(Headers)]
+            Chunk[np.isin(np.char.strip(Chunk), ['', 'NA'])] = 'nan'
+            yield Chunk
+
+
+def ScanCSV(FileName, ChunkRows):
+    """First pass of a streamed read; finds which columns are numeric and
+    the range of each, without holding more than a chunk of rows"""
+    Chunks = CSVChunks(FileName, ChunkRows)
+    Headers = next(Chunks)
+    Numeric = np.ones(len(Headers), dtype = bool)
+    Lows = np.full(len(Headers), np.inf)
+    Highs = np.full(len(Headers), -np.inf)
+    for Chunk in Chunks:
+        Values = np.full(Chunk.shape, np.nan)
+        for n in np.nonzero(Numeric)[0]:
+            try:
+                Values[:, n] = Chunk[:, n].astype(float)
+            except ValueError:
+                Numeric[n] = False
+        Complete = ~np.isnan(Values[:, Numeric]).any(axis = 1)
+        if Complete.any():
+            Lows = np.fmin(Lows, Values[Complete].min(axis = 0))
+            Highs = np.fmax(Highs, Values[Complete].max(axis = 0))
+    return Headers, Numeric, Lows, Highs
+
+
+def StreamMomentStats(FileName, ChunkRows, TargetValue, Degree):
+    """Builds the MomentStats the gram engine searches on straight from the
+    CSV, ChunkRows lines at a time, so the whole file is never in memory. Two
+    passes are made, the first (ScanCSV) gets the range of each column so the
+    powers can be scaled into [-1, 1] the same as when the file is loaded.
+    Returns the numeric headers, the index of the target among them, the
+    rejected headers, the stats and the centres and scales of the columns
+    other than the target"""
+    Headers, Numeric, Lows, Highs = ScanCSV(FileName, ChunkRows)
+    NumericHeaders = [Header for n, Header in enumerate(Headers) if Numeric[n]]
+    Rejected = [Header for n, Header in enumerate(Headers) if not Numeric[n]]
+    Columns = np.nonzero(Numeric)[0]
+    if TargetValue in NumericHeaders:
+        Yindex = NumericHeaders.index(TargetValue)
+    else:
+        Yindex = 0
+    Xcolumns = np.delete(Columns, Yindex)
+    Centres = (Highs[Xcolumns] + Lows[Xcolumns]) / 2.0
+    Scales = (Highs[Xcolumns] - Lows[Xcolumns]) / 2.0
+    Scales[~(Scales > 0)] = 1.0
+    Stats = MomentStats(len(Xcolumns) * Degree + 1)
+    Chunks = CSVChunks(FileName, ChunkRows)
+    next(Chunks)
+    Dropped = 0
+    for Chunk in Chunks:
+        Values = Chunk[:, Columns].astype(float)
+        Complete = ~np.isnan(Values).any(axis = 1)
+        Dropped += int((~Complete).sum())
+        Values = Values[Complete]
+        Stats.Update(np.hstack([PolyFeatures(np.delete(Values, Yindex, axis = 1),
+                     Degree, Centres, Scales), Values[:, [Yindex]]]))
+    if Dropped > 0:
+        print('      ', Dropped, 'rows with missing values dropped')
+    return NumericHeaders, Yindex, Rejected, Stats, Centres, Scales
+
+
+class BlockSolver():
+    """Least squares on the cross products held in a MomentStats, where the
+    model is built up a block (the Degree powers of one column) at a time.
+    The inverse of the Gram matrix of the placed features is kept, so the R^2
+    of adding any candidate block is a block Schur complement, a few small
+    dense sums that don't depend on the number of rows. Taking a block back
+    out is a downdate of the same inverse.
+    
+    Columns are referred to by their index in the original data, feature
+    column j*Stride + p - 1 holds power p of column j, Stride being the degree
+    the MomentStats was built with (it can be more than Degree). Powers that
+    are aliased (lm would give NA) are left out of self.Active."""
+    def __init__(self, Stats, Degree, Stride, Target, Centres, Scales,
+                 Tolerance = 1e-11):
+        self.Stats = Stats
+        self.Degree = Degree
+        self.Stride = Stride
+        self.Target = Target
+        self.Centres = Centres
+        self.Scales = Scales
+        #R: calls a column aliased when less than 1e-7 of its length is left,
+        #the Gram matrix holds squared lengths and squares the conditioning
+        #too so rounding alone leaves ~1e-13 of an exactly collinear column,
+        #hence a test of 1e-11 on squared lengths
+        self.Tolerance = Tolerance
+        self.RawDiagonal = Stats.RawDiagonal()
+        self.TSS = float(Stats.CoMoment[Target, Target])
+        self.Clear()
+        
+    def Clear(self):
+        """Back to the intercept only model"""
+        self.Placed = []
+        self.Active = np.zeros(0, dtype = int)
+        self.Ginv = np.zeros((0, 0))
+        self.Beta = np.zeros(0)
+        self.RSS = self.TSS
+        
+    def Block(self, Column):
+        return Column * self.Stride + np.arange(self.Degree)
+    
+    def ResSquare(self, RSS):
+        if self.TSS > 0:
+            return np.maximum(0.0, 1.0 - RSS / self.TSS)
+        return np.zeros_like(RSS)
+    
+    def Snapshot(self):
+        return (list(self.Placed), self.Active, self.Ginv, self.Beta, self.RSS)
+    
+    def Restore(self, State):
+        self.Placed, self.Active, self.Ginv, self.Beta, self.RSS = State
+        self.Placed = list(self.Placed)
+        
+    def Schur(self, Blocks):
+        """For groups of features (c x d) returns the Schur complements of
+        each group given the placed features (c x d x d), the cross products
+        of the groups with the current residual (c x d) and Ginv times the
+        cross products of the placed features with the groups (c x p x d)"""
+        G = self.Stats.CoMoment
+        Gbb = G[Blocks[:, :, None], Blocks[:, None, :]]
+        Gby = G[Blocks, self.Target]
+        if len(self.Active) == 0:
+            return Gbb, Gby, np.zeros((len(Blocks), 0, Blocks.shape[1]))
+        Gsb = G[self.Active[None, :, None], Blocks[:, None, :]]
+        M = np.einsum('pq,cqd->cpd', self.Ginv, Gsb)
+        C = Gbb - np.einsum('cpd,cpe->cde', Gsb, M)
+        r = Gby - np.einsum('cpd,p->cd', Gsb, self.Beta)
+        return C, r, M
+    
+    def SequentialKeep(self, C, r, Reference):
+        """Cholesky of each d x d Schur complement in power order, skipping
+        the powers that are aliased (R: would give them NA). Returns the keep
+        mask (c x d) and the drop in RSS that adding each group gives"""
+        c, d = r.shape
+        L = np.zeros((c, d, d))
+        z = np.zeros((c, d))
+        Keep = np.zeros((c, d), dtype = bool)
+        for i in range(d):
+            v = C[:, i, i] - (L[:, i, :i] ** 2).sum(axis = 1)
+            Keep[:, i] = v > self.Tolerance * np.maximum(Reference[:, i],
+                                                         np.finfo(float).tiny)
+            Lii = np.where(Keep[:, i], np.sqrt(np.maximum(v, 0)), 1.0)
+            L[:, i, i] = np.where(Keep[:, i], Lii, 0.0)
+            z[:, i] = np.where(Keep[:, i], (r[:, i] - (L[:, i, :i] * z[:, :i])
+                               .sum(axis = 1)) / Lii, 0.0)
+            for j in range(i + 1, d):
+                L[:, j, i] = np.where(Keep[:, i], (C[:, j, i] - (L[:, j, :i] *
+                             L[:, i, :i]).sum(axis = 1)) / Lii, 0.0)
+        return Keep, (z ** 2).sum(axis = 1)
+    
+    def ScoreAdd(self, Columns):
+        """R^2 of the placed model plus each candidate column"""
+        if len(Columns) == 0:
+            return np.zeros(0)
+        Blocks = np.array([self.Block(Column) for Column in Columns])
+        C, r, M = self.Schur(Blocks)
+        Keep, Drop = self.SequentialKeep(C, r, self.RawDiagonal[Blocks])
+        return self.ResSquare(self.RSS - Drop)
+    
+    def AddFeatures(self, Features, Refine = True):
+        """Adds the features that aren't aliased, in the order given, with a
+        block update of the inverse Gram matrix"""
+        Features = np.asarray(Features, dtype = int)
+        if len(Features) == 0:
+            return
+        C, r, M = self.Schur(Features[None, :])
+        Keep = self.SequentialKeep(C, r, self.RawDiagonal[Features][None, :])[0][0]
+        if not Keep.any():
+            return
+        Cinv = np.linalg.inv(C[0][np.ix_(Keep, Keep)])
+        MB = M[0][:, Keep]
+        p = len(self.Active)
+        q = int(Keep.sum())
+        Ginv = np.empty((p + q, p + q))
+        Ginv[:p, :p] = self.Ginv + MB @ Cinv @ MB.T
+        Ginv[:p, p:] = -MB @ Cinv
+        Ginv[p:, :p] = Ginv[:p, p:].T
+        Ginv[p:, p:] = Cinv
+        BetaB = Cinv @ r[0][Keep]
+        self.Beta = np.concatenate([self.Beta - MB @ BetaB, BetaB])
+        self.RSS = self.RSS - float(r[0][Keep] @ BetaB)
+        self.Ginv = Ginv
+        self.Active = np.concatenate([self.Active, Features[Keep]])
+        if Refine == True:
+            self.Refine()
+    
+    def Add(self, Column, Refine = True):
+        """Places a column"""
+        self.Placed.append(Column)
+        self.AddFeatures(self.Block(Column), Refine)
+        
+    def Refine(self):
+        """One Newton-Schulz step on the inverse Gram matrix, which mops up
+        the rounding that long runs of updates and downdates would otherwise
+        pile up, then the betas and RSS are taken from the refined inverse"""
+        G = self.Stats.CoMoment
+        if len(self.Active) > 0:
+            Gss = G[np.ix_(self.Active, self.Active)]
+            self.Ginv = 2 * self.Ginv - self.Ginv @ Gss @ self.Ginv
+            self.Ginv = (self.Ginv + self.Ginv.T) / 2
+        Gsy = G[self.Active, self.Target]
+        self.Beta = self.Ginv @ Gsy
+        self.RSS = self.TSS - float(Gsy @ self.Beta)
+        
+    def Positions(self, Column):
+        """Where the kept powers of a placed column sit in self.Active"""
+        return np.nonzero(np.isin(self.Active, self.Block(Column)))[0]
+    
+    def Aliased(self, Exclude = None):
+        """The powers of the placed columns that were left out as aliased"""
+        Features = [Feature for Column in self.Placed if Column != Exclude 
+                    for Feature in self.Block(Column) 
+                    if Feature not in self.Active]
+        return np.array(Features, dtype = int)
+        
+    def ScoreDrop(self, Column):
+        """The RSS if a placed column were removed, straight from the inverse
+        Gram matrix. Taking a column out can free up powers of the other
+        columns that were aliased with it, so the residual covariance of those
+        and the target is downdated together and they are allowed back in"""
+        G = self.Stats.CoMoment
+        b = self.Positions(Column)
+        Z = np.concatenate([self.Aliased(Column), [self.Target]]).astype(int)
+        W = self.Ginv @ G[np.ix_(self.Active, Z)]
+        Sigma = G[np.ix_(Z, Z)] - G[np.ix_(Z, self.Active)] @ W
+        if len(b) > 0:
+            Wb = W[b]
+            Sigma = Sigma + Wb.T @ np.linalg.solve(self.Ginv[np.ix_(b, b)], Wb)
+        if len(Z) == 1:
+            return float(Sigma[0, 0])
+        Keep, Drop = self.SequentialKeep(Sigma[None, :-1, :-1], Sigma[None, :-1, -1],
+                                         self.RawDiagonal[Z[:-1]][None, :])
+        return float(Sigma[-1, -1] - Drop[0])
+    
+    def ScoreRemove(self):
+        """R^2 of the placed model less each placed column (in self.Placed
+        order), no refitting needed"""
+        return self.ResSquare(np.array(
+            [self.ScoreDrop(Column) for Column in self.Placed]))
+        
+    def Remove(self, Column, Refine = True):
+        """Takes a placed column out, downdating the inverse Gram matrix, any
+        powers of other columns it had made aliased are then let back in"""
+        b = self.Positions(Column)
+        Rest = np.setdiff1d(np.arange(len(self.Active)), b)
+        if len(b) > 0:
+            GbbInv = np.linalg.inv(self.Ginv[np.ix_(b, b)])
+            Grb = self.Ginv[np.ix_(Rest, b)]
+            self.Beta = self.Beta[Rest] - Grb @ GbbInv @ self.Beta[b]
+            self.Ginv = self.Ginv[np.ix_(Rest, Rest)] - Grb @ GbbInv @ Grb.T
+            self.Active = self.Active[Rest]
+            Gsy = self.Stats.CoMoment[self.Active, self.Target]
+            self.RSS = self.TSS - float(Gsy @ self.Beta)
+        self.Placed.remove(Column)
+        self.AddFeatures(self.Aliased(), Refine = False)
+        if Refine == True:
+            self.Refine()
+        
+    def SetPlaced(self, Columns):
+        """Brings the solver to the given set of placed columns by removing
+        and adding blocks, it never has to start again from scratch"""
+        for Column in list(self.Placed):
+            if Column not in Columns:
+                self.Remove(Column)
+        for Column in Columns:
+            if Column not in self.Placed:
+                self.Add(Column)
+        
+    def Coefficients(self, Columns, Ordered = False):
+        """The raw coefficient list (intercept, then x^1..x^d per column in
+        the order given) of the placed model, NaN where a power is aliased.
+        Ordered = True says the columns were placed in this order, otherwise
+        when anything is aliased the model is solved again in formula order,
+        as which of a collinear set lm calls NA depends on that order"""
+        if Ordered == False and len(self.Aliased()) > 0:
+            return self.FitSubset(list(Columns))[1]
+        Scaled = np.zeros(1 + len(Columns) * self.Degree)
+        Aliased = np.zeros(len(Scaled), dtype = bool)
+        Position = {Feature: n for n, Feature in enumerate(self.Active)}
+        Intercept = self.Stats.Mean[self.Target]
+        for n, Column in enumerate(Columns):
+            for p, Feature in enumerate(self.Block(Column)):
+                Index = 1 + n * self.Degree + p
+                if Feature in Position:
+                    Scaled[Index] = self.Beta[Position[Feature]]
+                    Intercept -= Scaled[Index] * self.Stats.Mean[Feature]
+                else:
+                    Aliased[Index] = True
+        Scaled[0] = Intercept
+        return RawCoefficients(Scaled, self.Degree, self.Centres[Columns],
+                               self.Scales[Columns], Aliased)
+    
+    def FitSubset(self, Columns):
+        """R^2 and coefficients of any set of columns, solved from the cross
+        products without touching this solver's placed model"""
+        Scratch = BlockSolver(self.Stats, self.Degree, self.Stride, self.Target,
+                              self.Centres, self.Scales)
+        Scratch.Tolerance = self.Tolerance
+        Scratch.SetPlaced(Columns)
+        return float(Scratch.ResSquare(Scratch.RSS)), Scratch.Coefficients(
+            Columns, Ordered = True)
+    
+    def DropCoefficients(self, Columns, Column):
+        """Coefficients of the placed model less Column, without removing it"""
+        State = self.Snapshot()
+        self.Remove(Column, Refine = False)
+        Coefficients = self.Coefficients(Columns)
+        self.Restore(State)
+        return Coefficients
+    
+    def CandidateCoefficients(self, Columns, Column):
+        """Coefficients of the placed model plus Column, without placing it"""
+        State = self.Snapshot()
+        self.Add(Column, Refine = False)
+        Coefficients = self.Coefficients(Columns)
+        self.Restore(State)
+        return Coefficients
+
+
+#the arrays a worker process fits against, set up by AttachShared
+WorkerData = {}
+
+
+def ShareArray(Array):
+    """Copies an array into a new block of shared memory, returns the
+    SharedMemory (keep hold of it, and unlink it when done) and what a worker
+    needs to attach to it"""
+    from multiprocessing import shared_memory
+    Array = np.ascontiguousarray(Array, dtype = float)
+    Memory = shared_memory.SharedMemory(create = True, size = max(1, Array.nbytes))
+    np.ndarray(Array.shape, dtype = float, buffer = Memory.buf)[...] = Array
+    return Memory, (Memory.name, Array.shape)
+
+
+def AttachShared(X, Y, Centres, Scales):
+    """Process pool initializer, maps the shared X and Y arrays into the
+    worker without copying them"""
+    from multiprocessing import shared_memory
+    for Name, (MemoryName, Shape) in (('X', X), ('Y', Y)):
+        Memory = shared_memory.SharedMemory(name = MemoryName)
+        WorkerData[Name + 'memory'] = Memory
+        WorkerData[Name] = np.ndarray(Shape, dtype = float, buffer = Memory.buf)
+    WorkerData['Centres'] = Centres
+    WorkerData['Scales'] = Scales
+
+
+def FitShared(Task):
+    """FitPolyModel on the columns Index of the shared X, run in a worker,
+    Task being (Index, Degree, Score, HoldoutBlocks)"""
+    Index, Degree, Score, HoldoutBlocks = Task
+    return FitPolyModel(WorkerData['X'][:, Index], WorkerData['Y'], Degree,
+                        WorkerData['Centres'][Index], WorkerData['Scales'][Index],
+                        Score, HoldoutBlocks)
@@ -0,0 +1,200 @@
+# -*- coding: utf-8 -*-
+"""
+Writers for the Output, MetaData and VerboseOutput files.
+
+The files are opened once and rows are appended as they are made, through a
+buffer that is written out every FlushRows rows or FlushSeconds seconds
+(whichever comes first). FsyncPolicy says when the data is forced onto the
+disk: 'never' leaves it to the operating system, 'flush' does it on every
+write out, 'close' only when the file is closed. Checkpoint() writes out
+what's buffered and returns where the file is up to; a writer made with that
+Offset cuts the file back to it and carries on, so a resumed search doesn't
+duplicate anything written after its last checkpoint.
+
+The verbose output (one row per candidate model, by far the largest file)
+can also be kept as a compact columnar .npz (VerboseNPZ) rather than CSV;
+ReadVerboseNPZ turns it back into the same rows the CSV would hold.
+
+@author: pbrogan
+"""
+
+import csv
+import os
+import time
+
+
+class BufferedCSV():
+    """Appends rows to a CSV that is held open"""
+    def __init__(self, FileName, Header = None, FlushRows = 1000,
+                 FlushSeconds = 5.0, FsyncPolicy = 'never', Offset = None):
+        self.FileName = FileName
+        self.FlushRows = FlushRows
+        self.FlushSeconds = FlushSeconds
+        self.FsyncPolicy = FsyncPolicy
+        if Offset is None:
+            self.File = open(FileName, 'w', newline = '')
+        else:
+            os.truncate(FileName, Offset)
+            self.File = open(FileName, 'a', newline = '')
+        self.Writer = csv.writer(self.File, delimiter = ',')
+        self.Buffer = []
+        self.LastFlush = time.monotonic()
+        if Header is not None and Offset is None:
+            self.Write(Header)
+
+    def Write(self, Row):
+        self.Buffer.append(Row)
+        if len(self.Buffer) >= self.FlushRows or \
+        time.monotonic() - self.LastFlush >= self.FlushSeconds:
+            self.Flush()
+
+    def Flush(self):
+        self.Writer.writerows(self.Buffer)
+        self.Buffer = []
+        self.File.flush()
+        if self.FsyncPolicy == 'flush':
+            os.fsync(self.File.fileno())
+        self.LastFlush = time.monotonic()
+        
+    def Checkpoint(self):
+        self.Flush()
+        return self.File.tell()
+
+    def Close(self):
+        if self.File is None:
+            return
+        self.Flush()
+        if self.FsyncPolicy == 'close':
+            os.fsync(self.File.fileno())
+        self.File.close()
+        self.File = None
+
+
+class VerboseNPZ():
+    """Keeps the verbose rows ([R^2, formula, busses..., coefficients...])
+    as columns: R2, Counts (busses in each model), Busses (their positions in
+    Headers, one after another) and Coefficients (intercept then x^1..x^d of
+    each bus, one model after another). The formula isn't stored, it follows
+    from the busses. While the search runs the columns are appended to raw
+    files beside FileName, Close packs them into the .npz and removes them"""
+    Columns = [('R2', 'float64'), ('Counts', 'int32'), ('Busses', 'int32'),
+               ('Coefficients', 'float64')]
+
+    def __init__(self, FileName, Headers, Target, Degree, FlushRows = 1000,
+                 FlushSeconds = 5.0, FsyncPolicy = 'never', Offset = None):
+        import numpy
+        self.np = numpy
+        self.FileName = FileName
+        self.Headers = list(Headers)
+        self.Column = {Bus: n for n, Bus in enumerate(self.Headers)}
+        self.Target = Target
+        self.Degree = Degree
+        self.FlushRows = FlushRows
+        self.FlushSeconds = FlushSeconds
+        self.FsyncPolicy = FsyncPolicy
+        if Offset is None:
+            self.Files = {Name: open(self.PartName(Name), 'wb') for Name, 
+                          Type in self.Columns}
+        else:
+            for Name, Type in self.Columns:
+                os.truncate(self.PartName(Name), Offset[Name])
+            self.Files = {Name: open(self.PartName(Name), 'ab') for Name, 
+                          Type in self.Columns}
+        self.Buffer = {Name: [] for Name, Type in self.Columns}
+        self.Rows = 0
+        self.LastFlush = time.monotonic()
+
+    def PartName(self, Name):
+        return self.FileName + '.' + Name
+
+    def Write(self, Row):
+        Busses = [Cell for Cell in Row[2:] if type(Cell) == str]
+        self.Buffer['R2'].append(Row[0])
+        self.Buffer['Counts'].append(len(Busses))
+        self.Buffer['Busses'].extend(self.Column[Bus] for Bus in Busses)
+        self.Buffer['Coefficients'].extend(Row[2 + len(Busses):])
+        self.Rows += 1
+        if self.Rows >= self.FlushRows or \
+        time.monotonic() - self.LastFlush >= self.FlushSeconds:
+            self.Flush()
+
+    def Flush(self):
+        for Name, Type in self.Columns:
+            self.np.asarray(self.Buffer[Name], dtype = Type).tofile(
+                self.Files[Name])
+            self.Buffer[Name] = []
+            self.Files[Name].flush()
+            if self.FsyncPolicy == 'flush':
+                os.fsync(self.Files[Name].fileno())
+        self.Rows = 0
+        self.LastFlush = time.monotonic()
+        
+    def Checkpoint(self):
+        self.Flush()
+        return {Name: self.Files[Name].tell() for Name, Type in self.Columns}
+
+    def Suspend(self):
+        """Closes the raw files without packing them, they're left for a
+        search resumed from a checkpoint to carry on (see Checkpoint)"""
+        if self.Files is None:
+            return
+        self.Flush()
+        for Name, Type in self.Columns:
+            self.Files[Name].close()
+        self.Files = None
+
+    @classmethod
+    def CanResume(cls, FileName, Offset):
+        """If the raw files a Checkpoint's Offset points into are still there
+        and as long"""
+        return all(os.path.exists(FileName + '.' + Name) and os.path.getsize(
+                   FileName + '.' + Name) >= Offset[Name] for Name, Type in
+                   cls.Columns)
+
+    def Close(self):
+        if self.Files is None:
+            return
+        self.Flush()
+        Arrays = {}
+        for Name, Type in self.Columns:
+            self.Files[Name].close()
+            if os.path.getsize(self.PartName(Name)) > 0:
+                #memory mapped so savez copies it over a piece at a time
+                Arrays[Name] = self.np.memmap(self.PartName(Name), Type, 'r')
+            else:
+                Arrays[Name] = self.np.zeros(0, Type)
+        with open(self.FileName, 'wb') as opFile:
+            self.np.savez(opFile, Headers = self.np.array(self.Headers),
+                          Target = self.np.array(self.Target),
+                          Degree = self.np.array(self.Degree), **Arrays)
+            opFile.flush()
+            if self.FsyncPolicy != 'never':
+                os.fsync(opFile.fileno())
+        Arrays = None
+        for Name, Type in self.Columns:
+            os.remove(self.PartName(Name))
+        self.Files = None
+
+
+def ReadVerboseNPZ(FileName):
+    """The rows of a VerboseNPZ file, as they would be in the CSV"""
+    import numpy
+    with numpy.load(FileName) as Data:
+        Headers = [str(Bus) for Bus in Data['Headers']]
+        Target = str(Data['Target'])
+        Degree = int(Data['Degree'])
+        Busses = Data['Busses'].tolist()
+        Coefficients = Data['Coefficients'].tolist()
+        Rows = []
+        b = 0
+        c = 0
+        for ResSquare, Count in zip(Data['R2'].tolist(), Data['Counts'].tolist()):
+            BusList = [Headers[n] for n in Busses[b:b + Count]]
+            Ending = ', ' + str(Degree) + ', raw = TRUE)'
+            Formula = Target + ' ~ poly( ' + BusList[0] + Ending + ''.join(
+                ' + poly(' + Bus + Ending for Bus in BusList[1:])
+            Rows.append([ResSquare, Formula] + BusList +
+                        Coefficients[c:c + 1 + Count * Degree])
+            b += Count
+            c += 1 + Count * Degree
+    return Rows
@@ -2,7 +2,12 @@
 """
 Created on Thu Mar 12 12:43:40 2015
 
-This code uses R: as a back end and the rpy2 module as an api.
+This code uses R: as a back end and the rpy2 module as an api. Setting
+self.Engine = 'numpy' fits the same models with numpy instead (NumpyEngine.py)
+in which case R: and rpy2 don't need to be installed at all. self.Engine =
+'gram' goes further, the cross products of the polynomial features are worked
+out once per file and every candidate is scored from them without going back
+over the rows.
 
 This code takes as an input a CSV file with the dependent variable (the one you
 want to predict) in the first column and the independent variables (the ones 
@@ -39,11 +44,223 @@ in a fresh consol.
 @author: pbrogan
 """
 
-import rpy2.robjects as robjects
+import OutputWriter
 import glob
 import csv
+import json
+import os
+import time
+from collections import OrderedDict
 from numbers import Number
 
+#the back ends are only imported when a file is first read (LoadBackend),
+#starting R: or even importing numpy takes longer than many short jobs do
+robjects = None
+NumpyEngine = None
+
+def LoadBackend(Engine):
+    """Imports what Engine needs ('R' needs rpy2, 'numpy' and 'gram' need
+    numpy) the first time it is used. R:'s workspace is cleared as it starts"""
+    global robjects, NumpyEngine
+    if Engine == 'R' and robjects is None:
+        try:
+            import rpy2.robjects
+        except ImportError:
+            raise ImportError('R: and rpy2 are needed for Engine = R, or set' +
+                              ' Engine = numpy')
+        robjects = rpy2.robjects
+        robjects.r['rm']()
+    elif Engine != 'R' and NumpyEngine is None:
+        try:
+            import NumpyEngine as Loaded
+        except ImportError:
+            raise ImportError('numpy is needed for Engine = numpy')
+        NumpyEngine = Loaded
+
+#R: functions for ScoreMethod, given the fitted lm and HoldoutBlocks. PRESS
+#comes from the leverages (hatvalues) of the fit; the holdout fits are made
+#from the cross products of the orthonormal Q of the fit's own QR, a block's
+#worth at a time taken out, rather than refitting on the rows
+RScores = {'PRESS': """function(m, k) {
+    y <- model.response(model.frame(m))
+    1 - sum((residuals(m) / (1 - hatvalues(m))) ^ 2) / sum((y - mean(y)) ^ 2)
+}""", 'holdout': """function(m, k) {
+    Q <- qr.Q(m$qr)[, seq_len(m$rank), drop = FALSE]
+    y <- model.response(model.frame(m))
+    n <- length(y)
+    Block <- ceiling(seq_len(n) * k / n)
+    Qty <- crossprod(Q, y)
+    SSE <- 0
+    SSE0 <- 0
+    for (j in seq_len(k)) {
+        Test <- Block == j
+        Qj <- Q[Test, , drop = FALSE]
+        Beta <- qr.coef(qr(diag(ncol(Q)) - crossprod(Qj)), 
+                        Qty - crossprod(Qj, y[Test]))
+        Beta[is.na(Beta)] <- 0
+        SSE <- SSE + sum((y[Test] - Qj %*% Beta) ^ 2)
+        SSE0 <- SSE0 + sum((y[Test] - mean(y[!Test])) ^ 2)
+    }
+    1 - SSE / SSE0
+}"""}
+#the R: functions above once they've been made
+RScoreFunctions = {}
+
+#what WindowAllFiles runs every window's search with, whatever the settings
+#say; each window is scored from its own cross products and only the table of
+#windows is written out
+WindowSettings = {'Engine': 'gram', 'ScoreMethod': 'R2', 'StreamChunkRows': 0,
+                  'IncrementalDirectory': None, 'CheckpointDirectory': None,
+                  'StreamOutput': False, 'VerboseOP': False, 'GenMetaData': False}
+
+class FitCache():
+    """Remembers the R^2 and coefficients of models already fitted, keyed
+    by (file, target, degree, score, frozenset of busses) as the search
+    keeps coming back to the same sets of busses. The file is its path, size
+    and modification time when read (see StampFile), so a file that has
+    changed since, had rows added say, isn't handed the fits of the old one.
+    Coefficients are stored per bus so a hit can be handed back in whatever
+    order the formula lists the busses. Once MaxSize models are held the
+    least recently used is dropped. Hits and Misses count how many lm calls
+    were saved and made."""
+    def __init__(self, MaxSize = 50000):
+        self.MaxSize = MaxSize
+        self.Fits = OrderedDict()
+        self.Hits = 0
+        self.Misses = 0
+        
+    def Key(self, Source, Target, Degree, BusList, Score = 'R2'):
+        return (Source, Target, Degree, Score, frozenset(BusList))
+        
+    def Get(self, Key, BusList, Degree):
+        """Returns (R^2, coefficients in BusList order) or None"""
+        if Key not in self.Fits:
+            self.Misses += 1
+            return None
+        self.Hits += 1
+        self.Fits.move_to_end(Key)
+        ResSquare, Intercept, BusCoefficients = self.Fits[Key]
+        Coefficients = [Intercept]
+        for Bus in BusList:
+            Coefficients += BusCoefficients[Bus]
+        return ResSquare, Coefficients
+    
+    def Put(self, Key, BusList, Degree, ResSquare, Coefficients):
+        if self.MaxSize <= 0:
+            return
+        BusCoefficients = {}
+        for n, Bus in enumerate(BusList):
+            BusCoefficients[Bus] = list(Coefficients[1 + n * Degree:
+                                                     1 + (n + 1) * Degree])
+        self.Fits[Key] = (ResSquare, Coefficients[0], BusCoefficients)
+        self.Fits.move_to_end(Key)
+        while len(self.Fits) > self.MaxSize:
+            self.Fits.popitem(last = False)
+
+class StateStore():
+    """The PMU placements a search has been through. Each state is keyed by
+    the frozenset of its busses, so checking if one has been seen before
+    takes the same time however long the search has been running. States
+    holds them in the order they were found along with their R^2, Edges the
+    moves from each state to the next one recorded. 'in' takes any list of
+    busses and iterating gives the sorted bus lists, as PMUstates used to"""
+    def __init__(self):
+        self.States = OrderedDict()
+        self.Edges = []
+        self.Last = None
+        
+    def __contains__(self, BusList):
+        return frozenset(BusList) in self.States
+    
+    def __len__(self):
+        return len(self.States)
+    
+    def __iter__(self):
+        return (sorted(Key) for Key in self.States)
+    
+    def Add(self, PlacedPMUs):
+        """Records the state PlacedPMUs ([R^2, bus, bus ...]) and the move
+        to it from the last one recorded"""
+        Key = frozenset(PlacedPMUs[1:])
+        if Key not in self.States:
+            self.States[Key] = PlacedPMUs[0]
+        if self.Last is not None and self.Last != Key:
+            self.Edges.append((self.Last, Key))
+        self.Last = Key
+        
+    def Graph(self):
+        """The states (R^2 then the sorted busses) and the moves between them
+        (pairs of positions in States) as plain lists, e.g. for json"""
+        Index = {Key: n for n, Key in enumerate(self.States)}
+        return {'States': [[float(ResSquare)] + sorted(Key) for Key, ResSquare
+                           in self.States.items()],
+                'Edges': [[Index[From], Index[To]] for From, To in self.Edges]}
+
+class SearchTrace():
+    """Times and counts the work done on one file. Seconds and Counts total
+    each stage (reading, adding and removing PMUs, fits, R:'s gc, lm, summary
+    and coef, the MetaData, writing out) and Fits counts the models evaluated
+    in each kind of step. If FileName is given every step and every model
+    evaluated is also written to it as a line of JSON with the busses, R^2 
+    and the time taken"""
+    def __init__(self, FileName = None, Source = None):
+        self.Seconds = OrderedDict()
+        self.Counts = OrderedDict()
+        self.Fits = OrderedDict()
+        self.Steps = 0
+        self.StepFits = 0
+        self.Phase = None
+        self.Source = Source
+        self.File = None
+        if FileName is not None:
+            self.File = open(FileName, 'a')
+            
+    def Stage(self, Name, Seconds, Count = 1):
+        self.Seconds[Name] = self.Seconds.get(Name, 0.0) + Seconds
+        self.Counts[Name] = self.Counts.get(Name, 0) + Count
+        
+    def Write(self, Event, **Record):
+        if self.File is not None:
+            Record = dict(event = Event, file = self.Source, **Record)
+            self.File.write(json.dumps(Record) + '\n')
+            
+    def Fit(self, BusList, ResSquare, Seconds, Cached = False):
+        """One model evaluated, fits made for the MetaData (outside of a
+        step) have a phase of None"""
+        self.StepFits += 1
+        self.Fits[self.Phase] = self.Fits.get(self.Phase, 0) + 1
+        self.Stage('cached fit' if Cached else 'fit', Seconds)
+        self.Write('fit', step = self.Steps, phase = self.Phase, busses = 
+                   list(BusList), r2 = float(ResSquare), seconds = Seconds,
+                   cached = Cached)
+        
+    def StartStep(self, Phase):
+        self.Steps += 1
+        self.StepFits = 0
+        self.Phase = Phase
+        return time.perf_counter()
+    
+    def EndStep(self, Start, Degree, PlacedPMUs):
+        Seconds = time.perf_counter() - Start
+        self.Stage(self.Phase, Seconds)
+        self.Write('step', step = self.Steps, phase = self.Phase, degree = 
+                   Degree, busses = list(PlacedPMUs[1:]), r2 = 
+                   float(PlacedPMUs[0]), fits = self.StepFits, seconds = Seconds)
+        self.Phase = None
+        
+    def Report(self):
+        for Name, Seconds in self.Seconds.items():
+            print('      ', Name, self.Counts[Name], 'in', round(Seconds, 4), 
+                  's, mean', round(1000 * Seconds / max(1, self.Counts[Name]),
+                  4), 'ms')
+        for Phase, Fits in self.Fits.items():
+            print('       fits for', Phase or 'metadata', Fits)
+            
+    def Close(self):
+        if self.File is not None:
+            self.File.close()
+            self.File = None
+
 class Files():
     """This method utilises the rpy2 module for polynomial regression,
     the idea is to parsimoniously place PMUs at busses to give an 
@@ -70,16 +287,145 @@ class Files():
         self.GenMetaData = True
         self.AttachData = True
         self.VerboseOP = True
+        #'R' fits every model through rpy2, 'numpy' fits them directly,
+        #'gram' scores candidates from cross products worked out once per file
+        self.Engine = 'R'
+        #with the gram engine score removals and drop PMUs by downdating the
+        #current fit, rather than solving every reduced model afresh
+        self.DowndateRemovals = True
+        #number of fitted models remembered, 0 turns the fit cache off
+        self.FitCacheSize = 50000
+        #numpy engine only, candidate fits in each step are spread over this
+        #many processes with the data held in shared memory
+        self.Workers = 1
+        #numpy and gram engines, build the powers of every column up to this
+        #degree once per file so a sweep over lower degrees (SweepAllFiles)
+        #reuses them; None is just self.PolynomialDegree
+        self.BankDegree = None
+        #numpy and gram engines, keep the parsed columns of each CSV in 
+        #working_directory/ParsedCache/ and memory map them on later runs
+        self.CacheParsedCSV = False
+        #gram engine only, more than 0 reads the CSV this many rows at a time
+        #and only keeps the cross products, so any number of rows will fit
+        self.StreamChunkRows = 0
+        #time every stage and count the fits in each step, reported for each
+        #file when it is finished with
+        self.Instrument = False
+        #if given every step and model evaluated is appended to this file as
+        #a line of JSON (turns on Instrument)
+        self.TraceFile = None
+        #if given each file is run under cProfile and the stats are dumped to
+        #this name with the input file's name in front
+        self.ProfileFile = None
+        #write the output files as the search goes, rather than all at the
+        #end; the verbose rows then go straight to disk and aren't held
+        self.StreamOutput = False
+        #rows are written out in batches of FlushRows, or every FlushSeconds
+        self.FlushRows = 1000
+        self.FlushSeconds = 5.0
+        #when to force the output onto the disk, 'never', 'flush' or 'close'
+        self.FsyncPolicy = 'never'
+        #'csv' or 'npz', a compact columnar file (see OutputWriter.py)
+        self.VerboseFormat = 'csv'
+        #if given the search is saved here after every step and a rerun of
+        #the same file and settings carries on from there; best used with
+        #StreamOutput as otherwise the verbose rows are saved every time too
+        self.CheckpointDirectory = None
+        #R: and numpy engines, before fitting the candidates in an add step
+        #score them all by how well their powers correlate with the current
+        #residual and only fit the ScreenTopK best (0 fits them all) and/or
+        #those scoring at least ScreenThreshold (summed squared correlation)
+        self.ScreenTopK = 0
+        self.ScreenThreshold = None
+        #every ScreenCheckEvery add steps fit all the candidates anyway and 
+        #say if the screening would have missed the best one (0 never checks)
+        self.ScreenCheckEvery = 0
+        #what the search ranks models by (and the first column of the Output
+        #holds): 'R2', 'PRESS' (1 - PRESS / TSS, the leave one out errors 
+        #from the leverages of each fit) or 'holdout' (1 - SSE / SSE of the
+        #mean, each of HoldoutBlocks runs of rows in turn predicted from the
+        #rest, from each block's cross products). With the gram engine PRESS
+        #needs the rows so each model is fitted as the numpy engine does
+        self.ScoreMethod = 'R2'
+        self.HoldoutBlocks = 5
+        #gram engine only, the cross products of each file are kept here and
+        #when the file has only had rows added to its end since, just those
+        #rows are read and merged in. The last search on the file is then
+        #replayed, only the steps whose choice could have changed are scored
+        #again (with ScoreMethod = 'R2' and VerboseOP = False)
+        self.IncrementalDirectory = None
+        #WindowAllFiles searches WindowRows rows at a time, each window 
+        #starting WindowStride rows after the last (0 is WindowRows, so they
+        #don't overlap). WindowWarmStart starts each window's search from the
+        #last one's placement (see SwapSearch) and the first and last values
+        #of WindowLabel (a numeric column, a time stamp say) in each window go
+        #in the table
+        self.WindowRows = 0
+        self.WindowStride = 0
+        self.WindowWarmStart = True
+        self.WindowLabel = None
+        #more than 1 runs a beam search in place of the parsimonious one, the
+        #BeamWidth best sets of busses of each size are kept and extended
+        #(see PlaceBeam); checkpoints and incremental replays don't apply
+        self.BeamWidth = 1
+        #index the candidate columns as each file is read (numpy is needed,
+        #whatever the engine): constant columns are left out, and of columns
+        #that are a straight line function of each other (copies, the same
+        #thing in other units) only the first is searched. Clusters of columns
+        #within CollinearTolerance (1 - R^2) of a linear combination of the
+        #others are found too, but only reported unless DropCollinear, which
+        #just searches the pivots of each. See IndexCandidates, the classes
+        #found are written to op_directory/ColumnIndex/
+        self.IndexColumns = False
+        self.CollinearTolerance = 1e-6
+        self.DropCollinear = False
+        #everything above is a setting, handed on to scheduled jobs
+        self.SettingNames = list(vars(self))
         #These are simply declared Lists etc. no change suggested
         self.MetaDataOP = []
         self.VerboseDataOP = []
         self.PlacedPMUs = [0]
-        self.PMUstates = []
+        self.PMUstates = StateStore()
         self.DataOP = []
         self.ip_filenames_list = []
         self.dataframe = 0
+        self.Xdata = None
+        self.Ydata = None
+        self.Solver = None
+        self.Stats = None
+        self.FeatureBank = None
+        self.FitCache = None
+        self.Pool = None
+        self.SharedData = []
+        self.Trace = None
+        self.Profiler = None
+        self.ScreenBlock = None
+        self.ScreenDegree = None
+        self.Folds = None
+        self.Incremental = None
+        self.Replay = None
+        self.StepLog = []
+        self.RunnerUp = None
+        self.Replayed = 0
+        self.Rescored = 0
+        self.ScreenSteps = 0
+        self.ScreenMisses = 0
+        self.AllHeaders = None
+        self.TargetColumns = None
+        self.TargetColumn = None
+        self.FileStamp = None
+        self.ColumnIndex = None
+        self.ColumnIndexRows = None
+        self.OPwriter = None
+        self.MetaWriter = None
+        self.VerboseWriter = None
+        self.RowsWritten = 0
+        self.MetaRowsWritten = 0
+        #called with each placement recorded and its MetaData row (or None)
+        self.StepCallback = None
         #robjects.r['detach']()
-        robjects.r['rm']()
+        if robjects is not None:
+            robjects.r['rm']()
         self.formula = None
         self.fomulaBreakDown = []
         if self.SetMaxPMUs == False:
@@ -90,23 +436,82 @@ class Files():
         are first appended, other variables are set to 'None' type, clearing 
         memory and preventing the possibility of carry over of data in those
         varables"""
+        self.StopTrace()
+        self.ResetSearch()
+        self.Xheaders = None
+        self.Yheader = None
+        self.ip_filename = None
+        self.Xdata = None
+        self.Ydata = None
+        self.Stats = None
+        self.FeatureBank = None
+        self.ScreenBlock = None
+        self.Folds = None
+        self.Incremental = None
+        self.AllHeaders = None
+        self.TargetColumns = None
+        self.TargetColumn = None
+        self.FileStamp = None
+        self.ColumnIndex = None
+        self.ColumnIndexRows = None
+        self.StopPool()
+        #robjects.r['detach']()
+        if robjects is not None:
+            robjects.r['rm']()
+            robjects.r['gc']()
+            
+    def ResetSearch(self):
+        """Clears the placements and output of one search but keeps the file
+        that is loaded, so another search (e.g. at another degree) can be run
+        on it straight away"""
         self.PlacedPMUs = [0]
-        self.PMUstates = []
+        self.PMUstates = StateStore()
         self.DataOP = []
         self.VerboseDataOP = []
-        self.Xheaders = None
-        self.Yheader = None
         self.Header = None
         self.formula = None
         self.fomulaBreakDown = []
         self.lmResults = None
         self.ResSquare = None
         self.TrialPMUs = None
-        self.ip_filename = None
         self.MetaDataOP = []
-        #robjects.r['detach']()
-        robjects.r['rm']()
-        robjects.r['gc']()
+        self.Solver = None
+        self.ScreenSteps = 0
+        self.ScreenMisses = 0
+        self.Replay = None
+        self.StepLog = []
+        self.Replayed = 0
+        self.Rescored = 0
+        self.CloseOutput()
+        
+    def StartTrace(self):
+        """Sets up the instrumentation for the file about to be read, if
+        any is asked for"""
+        self.StopTrace()
+        if self.Instrument == True or self.TraceFile is not None:
+            self.Trace = SearchTrace(self.TraceFile, self.ip_filename)
+        if self.ProfileFile is not None:
+            import cProfile
+            self.Profiler = cProfile.Profile()
+            self.Profiler.enable()
+            
+    def TraceStage(self, Name, Start):
+        if self.Trace is not None:
+            self.Trace.Stage(Name, time.perf_counter() - Start)
+            
+    def StopTrace(self):
+        if self.Trace is not None:
+            print('       timings for', self.Trace.Source)
+            self.Trace.Report()
+            self.Trace.Close()
+            self.Trace = None
+        if self.Profiler is not None:
+            self.Profiler.disable()
+            Name = os.path.basename(str(self.ip_filename))[:-4] + ' ' + \
+                   os.path.basename(self.ProfileFile)
+            self.Profiler.dump_stats(os.path.join(
+                os.path.dirname(self.ProfileFile), Name))
+            self.Profiler = None
         
         
     def filenames(self):
@@ -134,7 +539,22 @@ class ReadCSVdata(Files):
     def __init__(self):
         Files.__init__(self)
         
+    def StampFile(self):
+        """What the fits of the file about to be read are cached under"""
+        Stat = os.stat(self.ip_filename)
+        self.FileStamp = (os.path.abspath(self.ip_filename), Stat.st_size,
+                          Stat.st_mtime_ns)
+        
     def Rread(self):
+        self.StampFile()
+        self.StartTrace()
+        LoadBackend(self.Engine)
+        Start = time.perf_counter()
+        if self.Engine in ('numpy', 'gram'):
+            self.NumpyRead()
+            self.TraceStage('read', Start)
+            self.IndexCandidates()
+            return
         self.dataframe = robjects.r['read.csv'](self.ip_filename)
         Headers = list(robjects.r['colnames'](self.dataframe))
         if self.AttachData == True:
@@ -152,6 +572,330 @@ class ReadCSVdata(Files):
             print('Header Error', self.TargetValue, 'not in', Headers)
             self.Yheader = Headers[0]
             self.Xheaders = Headers[1:]
+        self.TraceStage('read', Start)
+        self.IndexCandidates()
+            
+    def NumpyRead(self):
+        """The numpy engine equivalent of Rread, the columns are held as
+        arrays in self.Xdata (one column per entry in self.Xheaders) and
+        self.Ydata. Headers are mangled the same way read.csv does it, columns
+        that aren't numbers are rejected."""
+        if self.StreamChunkRows > 0:
+            if self.Engine == 'gram' and self.ScoreMethod == 'R2':
+                self.StreamRead()
+                return
+            elif self.Engine == 'gram':
+                print('       ScoreMethod', self.ScoreMethod, 'needs the rows,' +
+                      ' loading it all')
+            else:
+                print('       StreamChunkRows needs Engine = gram, loading it all')
+        if self.IncrementalDirectory is not None:
+            if self.IncrementalRead() == True:
+                return
+        if self.CacheParsedCSV == True:
+            Headers, Data, Rejected = NumpyEngine.ReadCachedCSV(self.ip_filename,
+                os.path.join(self.working_directory, 'ParsedCache'))
+        else:
+            Headers, Data, Rejected = NumpyEngine.ReadNumericCSV(self.ip_filename)
+        if len(Rejected) > 0:
+            print('       non numeric columns rejected', Rejected)
+        try:
+            Yindex = Headers.index(self.TargetValue)
+            self.Yheader = self.TargetValue
+        except ValueError:
+            print('Header Error', self.TargetValue, 'not in', Headers)
+            Yindex = 0
+            self.Yheader = Headers[0]
+        self.Xheaders = Headers[:Yindex] + Headers[Yindex + 1:]
+        self.Ydata = Data[:, Yindex]
+        self.Xdata = NumpyEngine.np.delete(Data, Yindex, axis = 1)
+        self.XColumn = {Bus: n for n, Bus in enumerate(self.Xheaders)}
+        self.Centres, self.Scales = NumpyEngine.ColumnScaling(self.Xdata)
+        self.BuildFeatureBank()
+        if self.Incremental is not None:
+            self.NewIncremental(Headers)
+        if self.Engine == 'numpy' and self.Workers > 1:
+            self.StartPool()
+            
+    def MultiTargetRead(self, Targets):
+        """Rread for searching several targets in the same file (numpy and 
+        gram engines). The file is read once and every numeric column is kept
+        in self.Xdata; the powers of the columns (or, for the gram engine,
+        their cross products along with every target) are worked out once for
+        all the targets (None takes every column as a target). SelectTarget
+        then points the search at one of them"""
+        LoadBackend('numpy')
+        self.StampFile()
+        self.StartTrace()
+        Start = time.perf_counter()
+        if self.CacheParsedCSV == True:
+            Headers, Data, Rejected = NumpyEngine.ReadCachedCSV(self.ip_filename,
+                os.path.join(self.working_directory, 'ParsedCache'))
+        else:
+            Headers, Data, Rejected = NumpyEngine.ReadNumericCSV(self.ip_filename)
+        if len(Rejected) > 0:
+            print('       non numeric columns rejected', Rejected)
+        if Targets is None:
+            Targets = Headers
+        for Target in Targets:
+            if Target not in Headers:
+                print('Header Error', Target, 'not in', Headers)
+        self.AllHeaders = Headers
+        self.TargetColumns = [Headers.index(Target) for Target in Targets
+                              if Target in Headers]
+        self.Xdata = Data
+        self.Centres, self.Scales = NumpyEngine.ColumnScaling(Data)
+        self.BuildFeatureBank()
+        self.TraceStage('read', Start)
+        if self.IndexColumns == True:
+            Start = time.perf_counter()
+            self.BuildColumnIndex(Headers, Data)
+            self.TraceStage('index', Start)
+        
+    def SelectTarget(self, Target):
+        """After MultiTargetRead, sets up the search for Target, every other
+        column of the file being a candidate"""
+        self.ResetSearch()
+        self.TargetValue = Target
+        self.Yheader = Target
+        self.TargetColumn = self.AllHeaders.index(Target)
+        self.Xheaders = [Bus for Bus in self.AllHeaders if Bus != Target]
+        self.XColumn = {Bus: n for n, Bus in enumerate(self.AllHeaders) 
+                        if Bus != Target}
+        self.Ydata = self.Xdata[:, self.TargetColumn]
+        if self.ColumnIndex is not None:
+            self.ApplyColumnIndex()
+        if self.Engine == 'numpy' and self.Workers > 1:
+            self.StartPool()
+            
+    def IncrementalName(self):
+        return os.path.join(self.IncrementalDirectory, os.path.basename(
+            self.ip_filename) + '_' + str(self.TargetValue) + '.stats')
+    
+    def IncrementalRead(self):
+        """NumpyRead from the cross products kept in IncrementalDirectory
+        (see NewIncremental), reading only the rows added to the file since.
+        Returns False if the file has to be read in full; it's not been seen
+        before, has been changed other than by adding rows, or the powers
+        kept don't go up to the degree needed"""
+        import pickle
+        if self.Engine != 'gram' or self.ScoreMethod != 'R2':
+            print('       IncrementalDirectory needs Engine = gram and',
+                  "ScoreMethod = 'R2', reading it all")
+            return False
+        Name = self.IncrementalName()
+        Size = os.path.getsize(self.ip_filename)
+        self.Incremental = {'Size': Size}
+        if not os.path.exists(Name):
+            return False
+        with open(Name, 'rb') as ipFile:
+            State = pickle.load(ipFile)
+        if State['Source'] != os.path.abspath(self.ip_filename) or \
+        Size < State['Size'] or State['Stride'] < max(self.BankDegree or 0, 
+        self.PolynomialDegree) or State['Headers'] != NumpyEngine.ReadHeaders(
+        self.ip_filename) or State['Sample'] != NumpyEngine.PrefixSample(
+        self.ip_filename, State['Size']):
+            print('       file changed since', Name, 'was made, reading it all')
+            return False
+        if Size > State['Size']:
+            Appended = NumpyEngine.ReadAppendedRows(self.ip_filename, 
+                State['Size'], len(State['Headers']), State['Columns'])
+            if Appended is None:
+                print('       rows added to', self.ip_filename, "can't just be",
+                      'merged in, reading it all')
+                return False
+            Values, Dropped = Appended
+            Yindex = State['NumericHeaders'].index(State['Yheader'])
+            State['Stats'].Merge(NumpyEngine.BuildMomentStats(
+                NumpyEngine.np.delete(Values, Yindex, axis = 1), 
+                Values[:, Yindex], State['Stride'], State['Centres'], 
+                State['Scales']))
+            print('      ', len(Values), 'rows added since the last run merged in',
+                  '(' + str(Dropped), 'with missing values dropped)')
+            State['Size'] = Size
+            State['Sample'] = NumpyEngine.PrefixSample(self.ip_filename, Size)
+            self.Incremental = State
+            self.SaveIncremental()
+        self.Incremental = State
+        self.Yheader = State['Yheader']
+        self.Xheaders = [Bus for Bus in State['NumericHeaders'] if Bus != 
+                         self.Yheader]
+        self.XColumn = {Bus: n for n, Bus in enumerate(self.Xheaders)}
+        self.Stride = State['Stride']
+        self.Stats = State['Stats']
+        self.Centres = State['Centres']
+        self.Scales = State['Scales']
+        self.Xdata = None
+        self.Ydata = None
+        return True
+    
+    def NewIncremental(self, Headers):
+        """Keeps the cross products of the file just read (and what's needed
+        to check it's only been added to and to read the new rows) for
+        IncrementalRead"""
+        Raw = NumpyEngine.ReadHeaders(self.ip_filename)
+        Size = self.Incremental['Size']
+        self.Incremental = {'Source': os.path.abspath(self.ip_filename),
+            'Size': Size, 'Sample': NumpyEngine.PrefixSample(self.ip_filename,
+            Size), 'Headers': Raw, 'Columns': [Raw.index(Header) for Header
+            in Headers], 'NumericHeaders': Headers, 'Yheader': self.Yheader,
+            'Stride': self.Stride, 'Centres': self.Centres, 
+            'Scales': self.Scales, 'Stats': self.Stats, 'Searches': {}}
+        self.SaveIncremental()
+        
+    def SaveIncremental(self):
+        import pickle
+        os.makedirs(self.IncrementalDirectory, exist_ok = True)
+        Name = self.IncrementalName()
+        with open(Name + '.tmp', 'wb') as opFile:
+            pickle.dump(self.Incremental, opFile, pickle.HIGHEST_PROTOCOL)
+        os.replace(Name + '.tmp', Name)
+        
+    def StreamRead(self):
+        """NumpyRead for files too big to hold, only the cross products of
+        the powers are kept (self.Stats), built self.StreamChunkRows rows at
+        a time; self.Xdata and self.Ydata stay None"""
+        self.Stride = max(self.BankDegree or 0, self.PolynomialDegree)
+        Headers, Yindex, Rejected, self.Stats, self.Centres, self.Scales = \
+            NumpyEngine.StreamMomentStats(self.ip_filename, 
+            self.StreamChunkRows, self.TargetValue, self.Stride)
+        if len(Rejected) > 0:
+            print('       non numeric columns rejected', Rejected)
+        if Headers[Yindex] != self.TargetValue:
+            print('Header Error', self.TargetValue, 'not in', Headers)
+        self.Yheader = Headers[Yindex]
+        self.Xheaders = Headers[:Yindex] + Headers[Yindex + 1:]
+        self.XColumn = {Bus: n for n, Bus in enumerate(self.Xheaders)}
+        self.Xdata = None
+        self.Ydata = None
+        
+    def IndexCandidates(self):
+        """Builds the column index of the file just read and trims the
+        candidates with it, if IndexColumns. R: holds the data itself, so with
+        the R: engine the numeric columns are read again with numpy"""
+        if self.IndexColumns != True:
+            return
+        Start = time.perf_counter()
+        if self.Engine == 'R':
+            LoadBackend('numpy')
+            Headers, Data, Rejected = NumpyEngine.ReadNumericCSV(self.ip_filename)
+            Columns = [n for n, Bus in enumerate(Headers) if Bus in self.Xheaders]
+            self.BuildColumnIndex([Headers[n] for n in Columns], Data[:, Columns])
+        else:
+            self.BuildColumnIndex(self.Xheaders, self.Xdata)
+        self.ApplyColumnIndex()
+        self.TraceStage('index', Start)
+        
+    def BuildColumnIndex(self, Headers, Data = None):
+        """Indexes the columns Headers; from their rows in Data, or from
+        self.Stats (laid out in Headers order) if the rows aren't held. Finds
+        the constant columns and the groups of columns that are a straight
+        line function of each other (by fingerprint, see
+        NumpyEngine.DuplicateColumns) and keeps the correlations of the rest
+        for ApplyColumnIndex"""
+        if Data is not None:
+            Centres, Scales = NumpyEngine.ColumnScaling(Data)
+            Groups, Constant = NumpyEngine.DuplicateColumns(Data, Centres, Scales)
+        else:
+            Groups, Constant = NumpyEngine.StatsDuplicateColumns(self.Stats,
+                range(len(Headers)), self.Stride)
+        Repeats = set(Constant + [n for Group in Groups for n in Group[1:]])
+        Kept = [n for n in range(len(Headers)) if n not in Repeats]
+        if self.Stats is not None:
+            Correlation = NumpyEngine.StatsCorrelation(self.Stats, Kept, 
+                                                       self.Stride)[0]
+        else:
+            Correlation = NumpyEngine.DataCorrelation(Data, Kept)[0]
+        self.ColumnIndex = {'Constant': [Headers[n] for n in Constant],
+            'Duplicates': [[Headers[n] for n in Group] for Group in Groups],
+            'Kept': [Headers[n] for n in Kept], 'Correlation': Correlation}
+        
+    def ApplyColumnIndex(self):
+        """Leaves the constant columns, and all but the first of each group
+        of duplicates (the target aside), out of self.Xheaders and finds the
+        clusters of near collinear candidates (NumpyEngine.CollinearClusters);
+        with DropCollinear all but the pivots of each are left out too. The
+        classes found go in self.ColumnIndexRows, see WriteColumnIndex"""
+        Index = self.ColumnIndex
+        LeftOut = set(Index['Constant'])
+        Rows = []
+        if len(Index['Constant']) > 0:
+            Rows.append(['constant', '-', ' '.join(Index['Constant']), 
+                         ' '.join(Index['Constant'])])
+        #a duplicate of the target stands in for it in the correlations
+        Stand = {}
+        for Group in Index['Duplicates']:
+            Members = [Bus for Bus in Group if Bus != self.Yheader]
+            Stand[Group[0]] = Members[0]
+            LeftOut.update(Members[1:])
+            if len(Members) > 1:
+                Rows.append(['duplicate', '-', ' '.join(Members), 
+                             ' '.join(Members[1:])])
+        Kept = [n for n, Bus in enumerate(Index['Kept']) if Stand.get(Bus, 
+                Bus) != self.Yheader]
+        Names = [Stand.get(Index['Kept'][n], Index['Kept'][n]) for n in Kept]
+        Clusters = NumpyEngine.CollinearClusters(Index['Correlation'][
+            NumpyEngine.np.ix_(Kept, Kept)], self.CollinearTolerance)
+        for Members, Dependent, Unexplained in Clusters:
+            Dropped = []
+            if self.DropCollinear == True:
+                Dropped = [Names[n] for n in Dependent]
+            LeftOut.update(Dropped)
+            Rows.append(['collinear', Unexplained, ' '.join(Names[n] for n in
+                         Members), ' '.join(Dropped)])
+        Candidates = len(self.Xheaders)
+        self.Xheaders = [Bus for Bus in self.Xheaders if Bus not in LeftOut]
+        self.ColumnIndexRows = Rows
+        print('       column index -', Candidates - len(self.Xheaders), 'of',
+              Candidates, 'candidates left out,', len(Clusters), 
+              'collinear clusters')
+        
+    def BuildFeatureBank(self):
+        """Works out the powers of every column up to self.BankDegree once,
+        any degree up to that then uses a slice of them. The gram engine only
+        keeps the cross products of the powers (self.Stats), the numpy engine
+        keeps the powers themselves (self.FeatureBank) if BankDegree is set"""
+        self.Stride = max(self.BankDegree or 0, self.PolynomialDegree)
+        if self.Engine == 'gram' and self.TargetColumns is not None:
+            Targets = self.Xdata[:, self.TargetColumns]
+        else:
+            Targets = self.Ydata
+        if self.Engine == 'gram':
+            self.Stats = NumpyEngine.BuildMomentStats(self.Xdata, Targets,
+                self.Stride, self.Centres, self.Scales)
+            if self.ScoreMethod == 'holdout':
+                self.Folds = NumpyEngine.HoldoutFolds(NumpyEngine.BuildBlockStats(
+                    self.Xdata, Targets, self.Stride, self.Centres, self.Scales,
+                    self.HoldoutBlocks))
+        elif self.BankDegree is not None:
+            self.FeatureBank = NumpyEngine.PolyFeatures(self.Xdata, 
+                self.Stride, self.Centres, self.Scales)
+            
+    def BankColumns(self, BusList):
+        """Where the powers 1..PolynomialDegree of each bus sit in the bank"""
+        return [self.XColumn[Bus] * self.Stride + p for Bus in BusList
+                for p in range(self.PolynomialDegree)]
+
+    def StartPool(self):
+        """Puts the data in shared memory and starts self.Workers processes
+        that fit against it"""
+        import concurrent.futures
+        self.StopPool()
+        XMemory, X = NumpyEngine.ShareArray(self.Xdata)
+        YMemory, Y = NumpyEngine.ShareArray(self.Ydata)
+        self.SharedData = [XMemory, YMemory]
+        self.Pool = concurrent.futures.ProcessPoolExecutor(self.Workers,
+            initializer = NumpyEngine.AttachShared, initargs = (X, Y, 
+            self.Centres, self.Scales))
+        
+    def StopPool(self):
+        if self.Pool is not None:
+            self.Pool.shutdown()
+            self.Pool = None
+        for Memory in self.SharedData:
+            Memory.close()
+            Memory.unlink()
+        self.SharedData = []
 
 class SuportFunctions(ReadCSVdata):
     """This creates the strings that are fed to the rpy2 interface,
@@ -176,6 +920,14 @@ class SuportFunctions(ReadCSVdata):
         self.fomulaBreakDown = BusList
         #print self.formula
         
+    def VerboseRow(self, Row):
+        """A row for the VerboseOutput goes straight to the writer when the
+        output is being streamed, otherwise it's held until WriteAllToCSV"""
+        if self.VerboseWriter is not None:
+            self.VerboseWriter.Write(Row)
+        elif self.VerboseOP == True:
+            self.VerboseDataOP.append(Row)
+        
 class StatAnalysis(SuportFunctions):
     """Only the linear model is run, the formula to be applied (anticipated as
     a polynomial) is taken as an argument. The function sets the object 
@@ -183,17 +935,188 @@ class StatAnalysis(SuportFunctions):
     def __init__(self):
         SuportFunctions.__init__(self)
         
+    def RunLinearMods(self, ModelList):
+        """Fits every model (a list of busses) in ModelList and returns their
+        R^2 values. With a process pool the fits not already in the fit cache
+        are handed out to the workers; results come back and are recorded in 
+        ModelList order, so the outcome is exactly that of the serial loop"""
+        if self.Pool is None:
+            ResSquares = []
+            for lmPMUs in ModelList:
+                self.SetFormula(lmPMUs)
+                self.RunLinearMod()
+                ResSquares.append(self.ResSquare)
+            return ResSquares
+        if self.FitCache is None:
+            self.FitCache = FitCache(self.FitCacheSize)
+        Fits = []
+        Misses = []
+        for lmPMUs in ModelList:
+            Key = self.FitCache.Key(self.FileStamp, self.Yheader,
+                self.PolynomialDegree, lmPMUs, self.ScoreKey())
+            Fits.append(self.FitCache.Get(Key, lmPMUs, self.PolynomialDegree))
+            if Fits[-1] is None:
+                Misses.append(len(Fits) - 1)
+        Indexes = [([self.XColumn[Bus] for Bus in ModelList[n]], 
+                    self.PolynomialDegree, self.ScoreMethod, self.HoldoutBlocks)
+                   for n in Misses]
+        ChunkSize = max(1, len(Misses) // (4 * self.Workers))
+        Start = time.perf_counter()
+        for n, Fit in zip(Misses, self.Pool.map(NumpyEngine.FitShared, Indexes,
+                                                chunksize = ChunkSize)):
+            Fits[n] = Fit
+            Key = self.FitCache.Key(self.FileStamp, self.Yheader,
+                self.PolynomialDegree, ModelList[n], self.ScoreKey())
+            self.FitCache.Put(Key, ModelList[n], self.PolynomialDegree, *Fit)
+        if self.Trace is not None:
+            #the workers' time is shared out evenly over their fits
+            Seconds = (time.perf_counter() - Start) / max(1, len(Misses))
+            for n, (lmPMUs, Fit) in enumerate(zip(ModelList, Fits)):
+                self.Trace.Fit(lmPMUs, Fit[0], Seconds if n in Misses else 0.0,
+                               n not in Misses)
+        for lmPMUs, (ResSquare, Coefficients) in zip(ModelList, Fits):
+            self.SetFormula(lmPMUs)
+            self.VerboseRow([ResSquare] + [str(self.formula)] + 
+                                      lmPMUs + Coefficients)
+        self.ResSquare = Fits[-1][0]
+        return [Fit[0] for Fit in Fits]
+        
     def RunLinearMod(self):
+        self.ResSquare, Coefficients = self.FitModel(self.fomulaBreakDown)
+        self.VerboseRow([self.ResSquare] + [str(self.formula)] + 
+            self.fomulaBreakDown + Coefficients)
+        
+    def FitModel(self, BusList):
+        """Returns R^2 and the coefficients (intercept, then x^1..x^d for
+        each bus in order) of the model in self.formula, from the fit cache if
+        this set of busses has been fitted before"""
+        if self.FitCache is None:
+            self.FitCache = FitCache(self.FitCacheSize)
+        Start = time.perf_counter()
+        Key = self.FitCache.Key(self.FileStamp, self.Yheader,
+                                self.PolynomialDegree, BusList, self.ScoreKey())
+        Cached = self.FitCache.Get(Key, BusList, self.PolynomialDegree)
+        if Cached is not None:
+            if self.Trace is not None:
+                self.Trace.Fit(BusList, Cached[0], time.perf_counter() - Start,
+                               True)
+            return Cached
+        if self.Engine in ('numpy', 'gram'):
+            ResSquare, Coefficients = self.NumpyLinearMod(BusList)
+        else:
+            ResSquare, Coefficients = self.RLinearMod()
+        self.FitCache.Put(Key, BusList, self.PolynomialDegree, ResSquare,
+                          Coefficients)
+        if self.Trace is not None:
+            self.Trace.Fit(BusList, ResSquare, time.perf_counter() - Start)
+        return ResSquare, Coefficients
+    
+    def ScoreKey(self):
+        """What the fit cache needs to tell scores made different ways apart"""
+        if self.ScoreMethod == 'holdout':
+            return (self.ScoreMethod, self.HoldoutBlocks)
+        return self.ScoreMethod
+    
+    def RLinearMod(self):
+        """Runs lm in R:, coef() is used for the coefficients rather than
+        the summary table as it keeps NA in place for aliased terms. With
+        ScoreMethod set the score replaces R^2, see RScores"""
+        Start = time.perf_counter()
         robjects.r['gc']()
+        self.TraceStage('R gc', Start)
+        Start = time.perf_counter()
         if self.AttachData == True:
             lmResults = robjects.r['lm'](self.formula)
         else:
             lmResults = robjects.r['lm'](self.formula, data = self.dataframe)
-        self.ResSquare = robjects.r['summary'](lmResults)[7][0]
+        self.TraceStage('R lm', Start)
+        Start = time.perf_counter()
+        if self.ScoreMethod == 'R2':
+            ResSquare = robjects.r['summary'](lmResults)[7][0]
+            self.TraceStage('R summary', Start)
+        else:
+            if self.ScoreMethod not in RScoreFunctions:
+                RScoreFunctions[self.ScoreMethod] = robjects.r(
+                    RScores[self.ScoreMethod])
+            ResSquare = float(RScoreFunctions[self.ScoreMethod](lmResults,
+                              self.HoldoutBlocks)[0])
+            self.TraceStage('R score', Start)
+        Start = time.perf_counter()
+        Coefficients = [float(Coefficient) for Coefficient in 
+                        robjects.r['coef'](lmResults)]
+        self.TraceStage('R coef', Start)
+        return ResSquare, Coefficients
+        
+    def NumpyLinearMod(self, BusList):
+        """Fits the formula for BusList on the numpy arrays, returns R^2 and
+        the coefficients (intercept, then x^1..x^d for each bus in order)"""
+        Index = [self.XColumn[Bus] for Bus in BusList]
+        if self.FeatureBank is not None and self.Stride >= self.PolynomialDegree:
+            return NumpyEngine.FitFeatures(self.FeatureBank[:, 
+                self.BankColumns(BusList)], self.Ydata, self.PolynomialDegree,
+                self.Centres[Index], self.Scales[Index], self.ScoreMethod,
+                self.HoldoutBlocks)
+        return NumpyEngine.FitPolyModel(self.Xdata[:, Index], self.Ydata,
+            self.PolynomialDegree, self.Centres[Index], self.Scales[Index],
+            self.ScoreMethod, self.HoldoutBlocks)
+        
+    def ScreenCandidates(self, TrialPMUs):
+        """Cuts TrialPMUs down to the ScreenTopK (and/or above 
+        ScreenThreshold) whose powers correlate best with the residual of the
+        current fit, see NumpyEngine.ScreenScores. The R: engine reads numpy
+        copies of the columns for this the first time it's needed; columns
+        numpy can't read are never screened out"""
+        if self.Xdata is None:
+            LoadBackend('numpy')
+            Headers, Data, Rejected = NumpyEngine.ReadNumericCSV(self.ip_filename)
+            Yindex = Headers.index(self.Yheader)
+            self.Ydata = Data[:, Yindex]
+            self.Xdata = NumpyEngine.np.delete(Data, Yindex, axis = 1)
+            Headers.remove(self.Yheader)
+            self.XColumn = {Bus: n for n, Bus in enumerate(Headers)}
+            self.Centres, self.Scales = NumpyEngine.ColumnScaling(self.Xdata)
+        if self.ScreenBlock is None or self.ScreenDegree != self.PolynomialDegree:
+            self.ScreenDegree = self.PolynomialDegree
+            self.ScreenBlock = NumpyEngine.ScreenFeatures(self.Xdata, 
+                self.PolynomialDegree, self.Centres, self.Scales)
+        Scores = NumpyEngine.ScreenScores(self.ScreenBlock, self.Ydata, 
+            [self.XColumn[Bus] for Bus in self.PlacedPMUs[1:] if Bus in 
+            self.XColumn], self.PolynomialDegree)
+        Ranked = sorted([(Scores[self.XColumn[Bus]], Bus) for Bus in TrialPMUs
+                         if Bus in self.XColumn], reverse = True)
+        if self.ScreenThreshold is not None:
+            Ranked = [Ranked[0]] + [(Score, Bus) for Score, Bus in Ranked[1:]
+                                    if Score >= self.ScreenThreshold]
+        if self.ScreenTopK > 0:
+            Ranked = Ranked[:self.ScreenTopK]
+        Kept = set(Bus for Score, Bus in Ranked)
+        return [Bus for Bus in TrialPMUs if Bus in Kept or Bus not in 
+                self.XColumn]
+        
+    def SyncSolver(self):
+        """Brings the gram engine's solver in line with self.PlacedPMUs,
+        making the solver for the current degree from self.Stats if needed"""
+        if self.Stride < self.PolynomialDegree and self.Xdata is None:
+            self.StreamRead()
+        elif self.Stride < self.PolynomialDegree:
+            self.BuildFeatureBank()
+        if self.Solver is None or self.Solver.Degree != self.PolynomialDegree:
+            #the target comes after the features in self.Stats
+            if self.TargetColumns is None:
+                Target = len(self.XColumn) * self.Stride
+            else:
+                Target = self.Xdata.shape[1] * self.Stride + \
+                         self.TargetColumns.index(self.TargetColumn)
+            self.Solver = NumpyEngine.BlockSolver(self.Stats, 
+                self.PolynomialDegree, self.Stride, Target, self.Centres, 
+                self.Scales)
+        self.Solver.SetPlaced([self.XColumn[Bus] for Bus in self.PlacedPMUs[1:]])
         
-        self.VerboseDataOP.append([self.ResSquare] +  [str(self.formula)] + 
-            self.fomulaBreakDown + list(robjects.r['summary'](lmResults)[3])[
-                    :( 1 + len(self.PlacedPMUs) * self.PolynomialDegree)])
+    def HoldoutScore(self, BusList):
+        """ScoreMethod = 'holdout' for the gram engine, worked out from the
+        cross products of each block of rows (self.Folds)"""
+        return NumpyEngine.HoldoutScore(self.Folds, self.BankColumns(BusList),
+                                        self.Solver.Target)
         
     def GenerateMetaData(self):
         """this is auxilliary info, at present only on the coefficients of the 
@@ -202,16 +1125,23 @@ class StatAnalysis(SuportFunctions):
         which are not stored, the line is parsed to only return the estimates 
         of the coefficients."""
         if self.GenMetaData == True:        
+            Start = time.perf_counter()
             PMUpositions = self.PlacedPMUs[1:]
             self.SetFormula(PMUpositions)
             self.MetaData = [str(self.formula)]
-            lmResults = robjects.r['lm'](self.formula, data = self.dataframe)
-            FitData = robjects.r['summary'](lmResults)[3]
+            if self.Engine == 'gram':
+                self.SyncSolver()
+                FitData = self.Solver.Coefficients(
+                    [self.XColumn[Bus] for Bus in PMUpositions])
+            else:
+                FitData = self.FitModel(PMUpositions)[1]
             #print 'length',len(self.PlacedPMUs)
             
-            for n in range(0, ( len(self.PlacedPMUs) * self.PolynomialDegree)-1):
+            #intercept plus one coefficient per power per PMU
+            for n in range(0, 1 + len(PMUpositions) * self.PolynomialDegree):
                 self.MetaData.append(FitData[n])
             self.MetaDataOP.append(self.MetaData)
+            self.TraceStage('metadata', Start)
        
   
 class PlacePMUs(StatAnalysis):
@@ -224,6 +1154,92 @@ class PlacePMUs(StatAnalysis):
         StatAnalysis.__init__(self)
     
     def AddBestPMU(self):
+        if self.Trace is not None:
+            Start = self.Trace.StartStep('add')
+        if self.ReplayStep('add') == True:
+            pass
+        elif self.Engine == 'gram' and self.ScoreMethod != 'PRESS':
+            self.GramAddBestPMU()
+            self.LogStep('add')
+        else:
+            self.RefitAddBestPMU()
+        if self.Trace is not None:
+            self.Trace.EndStep(Start, self.PolynomialDegree, self.PlacedPMUs)
+            
+    def RemoveWorstPMU(self):
+        if self.Trace is not None:
+            Start = self.Trace.StartStep('remove')
+        if self.ReplayStep('remove') == True:
+            pass
+        elif self.Engine == 'gram' and self.ScoreMethod != 'PRESS':
+            self.GramRemoveWorstPMU()
+            self.LogStep('remove')
+        else:
+            self.RefitRemoveWorstPMU()
+        if self.Trace is not None:
+            self.Trace.EndStep(Start, self.PolynomialDegree, self.PlacedPMUs)
+            
+    def LogStep(self, Phase):
+        """Incremental mode, notes the choice the gram engine just made and
+        the RSS of the runner up, which can only go up as rows are added, so
+        a later run on more rows can tell if the choice could change (see 
+        ReplayStep). If the last run is being replayed and made a different
+        choice here, the rest of it no longer applies"""
+        if self.Incremental is None:
+            return
+        Bound = None
+        if self.RunnerUp is not None:
+            Bound = self.Solver.TSS * (1.0 - self.RunnerUp)
+        self.StepLog.append((Phase, list(self.PlacedPMUs[1:]), Bound))
+        if self.Replay is not None:
+            if self.Replay[0][1] == self.PlacedPMUs[1:]:
+                self.Replay.pop(0)
+            else:
+                print('       the choice changed with the new rows, searching',
+                      'afresh from here')
+                self.Replay = None
+            
+    def ReplayStep(self, Phase):
+        """Incremental mode, takes the last run's next step without scoring
+        any candidates if its choice can't have changed: every other model's
+        RSS is at least what it was on the fewer rows, so if the chosen 
+        model's RSS on all the rows is still below the runner up's old RSS 
+        it is still the best. Returns False if the step has to be scored"""
+        if self.Replay is None:
+            return False
+        if len(self.Replay) == 0 or self.Replay[0][0] != Phase:
+            self.Replay = None
+            return False
+        Phase, Chosen, Bound = self.Replay[0]
+        Placed = self.PlacedPMUs[1:]
+        if Phase == 'add':
+            Changed = [Bus for Bus in Chosen if Bus not in Placed]
+            Same = len(Changed) == 1 and len(Chosen) == len(Placed) + 1
+        else:
+            Changed = [Bus for Bus in Placed if Bus not in Chosen]
+            Same = len(Changed) == 1 and len(Chosen) == len(Placed) - 1
+        if Same == False:
+            self.Replay = None
+            return False
+        self.SyncSolver()
+        if Phase == 'add':
+            ResSquare = float(self.Solver.ScoreAdd([self.XColumn[Changed[0]]])[0])
+            RSS = self.Solver.TSS * (1.0 - ResSquare)
+        else:
+            RSS = self.Solver.ScoreDrop(self.XColumn[Changed[0]])
+            ResSquare = float(self.Solver.ResSquare(RSS))
+        if Bound is not None and RSS >= Bound - 1e-10 * self.Solver.TSS:
+            self.Rescored += 1
+            return False
+        self.Replay.pop(0)
+        self.Replayed += 1
+        self.StepLog.append((Phase, list(Chosen), Bound))
+        self.PlacedPMUs = [ResSquare] + list(Chosen)
+        return True
+            
+    def RefitAddBestPMU(self):
+        """Fits every candidate model afresh (or takes it from the fit
+        cache) and keeps the one with the best R^2"""
        # if (len(self.PlacedPMUs)-1) < self.MaxPMUs and \
        # (len(self.PlacedPMUs) - 1) < (len(self.Xheaders) 
        # - len(self.ExcludedBusses)):
@@ -233,29 +1249,131 @@ class PlacePMUs(StatAnalysis):
             """Populate list with potential bus placements"""
             if Bus not in self.PlacedPMUs and Bus not in self.ExcludedBusses:
                 self.TrialPMUs.append(Bus)
+        Screened = self.TrialPMUs
+        Check = False
+        if self.ScreenTopK > 0 or self.ScreenThreshold is not None:
+            Screened = self.ScreenCandidates(self.TrialPMUs)
+            self.ScreenSteps += 1
+            Check = self.ScreenCheckEvery > 0 and \
+                    self.ScreenSteps % self.ScreenCheckEvery == 0
+            if Check == False:
+                self.TrialPMUs = Screened
                 
-        for Bus in self.TrialPMUs:
-            lmPMUs = list(self.PlacedPMUs[1:]) + [Bus]
-            self.SetFormula(lmPMUs)
-            self.RunLinearMod()
-            lmResults.append([self.ResSquare] + lmPMUs)
+        ModelList = [list(self.PlacedPMUs[1:]) + [Bus] for Bus in self.TrialPMUs]
+        for ResSquare, lmPMUs in zip(self.RunLinearMods(ModelList), ModelList):
+            lmResults.append([ResSquare] + lmPMUs)
         lmResults = sorted(lmResults, reverse = True)
+        if Check == True and lmResults[0][-1] not in Screened:
+            self.ScreenMisses += 1
+            Best = [Result for Result in lmResults if Result[-1] in Screened][0]
+            print('       screening missed', lmResults[0][-1], lmResults[0][0], 
+                  'the best screened was', Best[-1], Best[0], '(', 
+                  self.ScreenMisses, 'misses in', self.ScreenSteps, 'steps)')
         self.PlacedPMUs = lmResults[0]
    # else:
         #print "All PMUs Placed"
             
-    def RemoveWorstPMU(self):
+    def RefitRemoveWorstPMU(self):
         lmResults = []
+        ModelList = []
         for Bus in self.PlacedPMUs[1:]:
             lmPMUs = list(self.PlacedPMUs[1:])
             lmPMUs.remove(Bus)
-            self.SetFormula(lmPMUs)
-            self.RunLinearMod()
-            lmResults.append([self.ResSquare] + lmPMUs)
+            ModelList.append(lmPMUs)
+        for ResSquare, lmPMUs in zip(self.RunLinearMods(ModelList), ModelList):
+            lmResults.append([ResSquare] + lmPMUs)
             
         lmResults = sorted(lmResults, reverse = True)
         self.PlacedPMUs = lmResults[0]
         
+    def GramAddBestPMU(self):
+        """AddBestPMU for the gram engine, rather than refitting every 
+        candidate the R^2 of adding each one is worked out in one go from the
+        solver holding the currently placed PMUs"""
+        self.SyncSolver()
+        self.TrialPMUs = [Bus for Bus in self.Xheaders if Bus not in 
+                          self.PlacedPMUs and Bus not in self.ExcludedBusses]
+        Placed = [self.XColumn[Bus] for Bus in self.PlacedPMUs[1:]]
+        Start = time.perf_counter()
+        if self.ScoreMethod == 'holdout':
+            ResSquares = [self.HoldoutScore(list(self.PlacedPMUs[1:]) + [Bus])
+                          for Bus in self.TrialPMUs]
+        else:
+            ResSquares = self.Solver.ScoreAdd(
+                [self.XColumn[Bus] for Bus in self.TrialPMUs])
+        #all the candidates are scored together, each gets an even share
+        Seconds = (time.perf_counter() - Start) / max(1, len(self.TrialPMUs))
+        lmResults = []
+        for Bus, ResSquare in zip(self.TrialPMUs, ResSquares):
+            lmPMUs = list(self.PlacedPMUs[1:]) + [Bus]
+            if self.Trace is not None:
+                self.Trace.Fit(lmPMUs, ResSquare, Seconds)
+            if self.VerboseOP == True:
+                self.SetFormula(lmPMUs)
+                self.VerboseRow([float(ResSquare)] + [str(self.formula)]
+                    + lmPMUs + self.Solver.CandidateCoefficients(Placed + 
+                    [self.XColumn[Bus]], self.XColumn[Bus]))
+            lmResults.append([float(ResSquare)] + lmPMUs)
+        lmResults = sorted(lmResults, reverse = True)
+        self.RunnerUp = lmResults[1][0] if len(lmResults) > 1 else None
+        self.PlacedPMUs = lmResults[0]
+        
+    def GramRemoveWorstPMU(self):
+        """RemoveWorstPMU for the gram engine, each reduced model is solved
+        from the cross products rather than refitted over the rows"""
+        if self.DowndateRemovals == True:
+            self.DowndateWorstPMU()
+            return
+        self.SyncSolver()
+        lmResults = []
+        for Bus in self.PlacedPMUs[1:]:
+            lmPMUs = list(self.PlacedPMUs[1:])
+            lmPMUs.remove(Bus)
+            Start = time.perf_counter()
+            ResSquare, Coefficients = self.Solver.FitSubset(
+                [self.XColumn[Bus] for Bus in lmPMUs])
+            if self.ScoreMethod == 'holdout':
+                ResSquare = self.HoldoutScore(lmPMUs)
+            if self.Trace is not None:
+                self.Trace.Fit(lmPMUs, ResSquare, time.perf_counter() - Start)
+            if self.VerboseOP == True:
+                self.SetFormula(lmPMUs)
+                self.VerboseRow([ResSquare] + [str(self.formula)] + 
+                                          lmPMUs + Coefficients)
+            lmResults.append([ResSquare] + lmPMUs)
+        lmResults = sorted(lmResults, reverse = True)
+        self.RunnerUp = lmResults[1][0] if len(lmResults) > 1 else None
+        self.PlacedPMUs = lmResults[0]
+        
+    def DowndateWorstPMU(self):
+        """Every one PMU removal is scored at once from the current fit's 
+        inverse Gram matrix, then the chosen PMU is taken out by downdating it,
+        so the add that follows carries on from there"""
+        self.SyncSolver()
+        Placed = [self.XColumn[Bus] for Bus in self.PlacedPMUs[1:]]
+        Start = time.perf_counter()
+        ResSquares = dict(zip(list(self.Solver.Placed), self.Solver.ScoreRemove()))
+        Seconds = (time.perf_counter() - Start) / max(1, len(Placed))
+        lmResults = []
+        for Bus in self.PlacedPMUs[1:]:
+            lmPMUs = list(self.PlacedPMUs[1:])
+            lmPMUs.remove(Bus)
+            ResSquare = float(ResSquares[self.XColumn[Bus]])
+            if self.ScoreMethod == 'holdout':
+                ResSquare = self.HoldoutScore(lmPMUs)
+            if self.Trace is not None:
+                self.Trace.Fit(lmPMUs, ResSquare, Seconds)
+            if self.VerboseOP == True:
+                self.SetFormula(lmPMUs)
+                self.VerboseRow([ResSquare] + [str(self.formula)] + 
+                    lmPMUs + self.Solver.DropCoefficients([Column for Column in
+                    Placed if Column != self.XColumn[Bus]], self.XColumn[Bus]))
+            lmResults.append([ResSquare] + lmPMUs + [Bus])
+        lmResults = sorted(lmResults, reverse = True)
+        self.RunnerUp = lmResults[1][0] if len(lmResults) > 1 else None
+        self.Solver.Remove(self.XColumn[lmResults[0][-1]])
+        self.PlacedPMUs = lmResults[0][:-1]
+        
         
         
 class PMUitterator(PlacePMUs):
@@ -275,6 +1393,15 @@ class PMUitterator(PlacePMUs):
         add second PMU (if new state save). End Game -> have the requisite
         number of PMUs been added? [if no] -> run over main body [if yes] ->
         return results"""
+        if self.BeamWidth > 1:
+            self.PlaceBeam()
+            return
+        if self.CheckpointDirectory is not None and self.PlacedPMUs == [0]:
+            self.LoadCheckpoint()
+        if self.StreamOutput == True and self.OPwriter is None:
+            self.OpenOutput()
+        if self.Incremental is not None and self.PlacedPMUs == [0]:
+            self.StartReplay()
         while len(self.PlacedPMUs) <= 4 and \
         (len(self.PlacedPMUs) - 1) <= (len(self.Xheaders) - 
         len(self.ExcludedBusses)) and \
@@ -283,36 +1410,258 @@ class PMUitterator(PlacePMUs):
             self.DataOP.append(list(self.PlacedPMUs))
             self.GenerateMetaData()
             print('Opening Placements - placed', (len(self.PlacedPMUs) - 1), 'regression value')
-            self.PMUstates.append(sorted(self.PlacedPMUs[1:]))
+            self.RecordState()
+            if self.CheckpointDirectory is not None:
+                self.SaveCheckpoint()
         
         while (len(self.PlacedPMUs)-1) < self.MaxPMUs and \
         (len(self.PlacedPMUs) - 1) < (len(self.Xheaders)
         - len(self.ExcludedBusses)):
             PMUstateHold = list(self.PlacedPMUs)
             self.RemoveWorstPMU()
-            if sorted(self.PlacedPMUs[1:]) in self.PMUstates:
+            if self.PlacedPMUs[1:] in self.PMUstates:
                 print('retrograde PMU removal, undone')
                 self.PlacedPMUs = PMUstateHold
                 self.AddBestPMU()
 
             else:
                 self.DataOP.append(self.PlacedPMUs)
-                self.PMUstates.append(sorted(self.PlacedPMUs[1:]))
                 self.GenerateMetaData()
+                self.RecordState()
                 print('new diminished state')
                 if self.VeryParsimonious == False:
                     self.AddBestPMU()
-                if sorted(self.PlacedPMUs[1:]) not in self.PMUstates:
+                if self.PlacedPMUs[1:] not in self.PMUstates:
                     self.DataOP.append(self.PlacedPMUs)
                     self.GenerateMetaData()
-                    self.PMUstates.append(sorted(self.PlacedPMUs[1:]))
+                    self.RecordState()
                 self.AddBestPMU()
 
-            if sorted(self.PlacedPMUs[1:]) not in self.PMUstates:
+            if self.PlacedPMUs[1:] not in self.PMUstates:
                 self.DataOP.append(self.PlacedPMUs)
                 self.GenerateMetaData()
-                self.PMUstates.append(sorted(self.PlacedPMUs[1:]))
+                self.RecordState()
             print('1 back 2 forward - placed',(len(self.PlacedPMUs)-1), 'PMUs')
+            if self.OPwriter is not None:
+                self.WriteSteps()
+            if self.CheckpointDirectory is not None:
+                self.SaveCheckpoint()
+        if self.Incremental is not None:
+            self.EndReplay()
+            
+    def SearchKey(self):
+        """The settings a search's steps depend on (MaxPMUs only decides 
+        where it stops)"""
+        return (self.PolynomialDegree, self.VeryParsimonious, 
+                tuple(sorted(self.ExcludedBusses)), self.DowndateRemovals,
+                self.IndexColumns, self.DropCollinear, self.CollinearTolerance)
+                
+    def StartReplay(self):
+        """Incremental mode, sets up the last search on this file with these
+        settings to be replayed (see ReplayStep)"""
+        if self.VerboseOP == True:
+            print('       VerboseOP needs every candidate scored, not replaying')
+            return
+        if self.SearchKey() in self.Incremental['Searches']:
+            self.Replay = list(self.Incremental['Searches'][self.SearchKey()])
+            
+    def EndReplay(self):
+        """Keeps the steps of this search for the next run"""
+        if self.Replayed + self.Rescored > 0:
+            print('       incremental -', self.Replayed, 'steps kept,', 
+                  self.Rescored, 'scored again')
+        self.Replay = None
+        self.Incremental['Searches'][self.SearchKey()] = self.StepLog
+        self.SaveIncremental()
+
+    def PlaceBeam(self):
+        """PlaceAllPMUs for BeamWidth > 1. Rather than one placement being
+        built up and pared back, the BeamWidth best sets of busses of each
+        size are kept and every one of them is extended by every bus not in
+        it; a set reached from more than one member of the beam is only
+        scored once. The best set of each size goes in self.DataOP. With the
+        gram engine each member keeps its own solver state (its inverse Gram
+        matrix) and a member's extensions are all scored from it at once, the
+        other engines fit all the extensions of the beam in one batch (spread
+        over the Workers with the numpy engine)"""
+        if self.StreamOutput == True and self.OPwriter is None:
+            self.OpenOutput()
+        Size = min(self.MaxPMUs, len(self.Xheaders) - len(self.ExcludedBusses))
+        Beam = [[]]
+        States = None
+        if self.Engine == 'gram' and self.ScoreMethod != 'PRESS':
+            self.PlacedPMUs = [0]
+            self.SyncSolver()
+            States = [self.Solver.Snapshot()]
+        while len(Beam[0]) < Size:
+            if self.Trace is not None:
+                Start = self.Trace.StartStep('beam')
+            if States is None:
+                Scored = self.BeamRefitExtensions(Beam)
+            else:
+                Scored = self.BeamGramExtensions(Beam, States)
+            if len(Scored) == 0:
+                break
+            Scored = sorted(Scored, key = lambda Extension: Extension[0],
+                            reverse = True)[:self.BeamWidth]
+            if States is not None:
+                NewStates = []
+                for ResSquare, lmPMUs, Parent in Scored:
+                    self.Solver.Restore(States[Parent])
+                    self.Solver.Add(self.XColumn[lmPMUs[-1]])
+                    NewStates.append(self.Solver.Snapshot())
+                States = NewStates
+            Beam = [lmPMUs for ResSquare, lmPMUs, Parent in Scored]
+            self.PlacedPMUs = [Scored[0][0]] + list(Scored[0][1])
+            if self.Trace is not None:
+                self.Trace.EndStep(Start, self.PolynomialDegree, self.PlacedPMUs)
+            self.DataOP.append(list(self.PlacedPMUs))
+            self.GenerateMetaData()
+            self.RecordState()
+            print('beam of', len(Beam), '- placed', len(self.PlacedPMUs) - 1,
+                  'PMUs regression value', self.PlacedPMUs[0])
+            if self.OPwriter is not None:
+                self.WriteSteps()
+
+    def BeamTrials(self, BusList):
+        return [Bus for Bus in self.Xheaders if Bus not in BusList and Bus
+                not in self.ExcludedBusses]
+
+    def BeamGramExtensions(self, Beam, States):
+        """Scores every one bus extension of the sets in Beam (States holding
+        the solver for each), returns (R^2, busses, position in Beam of the
+        set extended) for each distinct set"""
+        Scored = {}
+        for Parent, (BusList, State) in enumerate(zip(Beam, States)):
+            self.Solver.Restore(State)
+            Placed = [self.XColumn[Bus] for Bus in BusList]
+            Trials = [Bus for Bus in self.BeamTrials(BusList) if
+                      frozenset(BusList + [Bus]) not in Scored]
+            Start = time.perf_counter()
+            if self.ScoreMethod == 'holdout':
+                ResSquares = [self.HoldoutScore(BusList + [Bus]) for Bus in
+                              Trials]
+            else:
+                ResSquares = self.Solver.ScoreAdd([self.XColumn[Bus] for Bus
+                                                   in Trials])
+            Seconds = (time.perf_counter() - Start) / max(1, len(Trials))
+            for Bus, ResSquare in zip(Trials, ResSquares):
+                lmPMUs = BusList + [Bus]
+                if self.Trace is not None:
+                    self.Trace.Fit(lmPMUs, ResSquare, Seconds)
+                if self.VerboseOP == True:
+                    self.SetFormula(lmPMUs)
+                    self.VerboseRow([float(ResSquare)] + [str(self.formula)]
+                        + lmPMUs + self.Solver.CandidateCoefficients(Placed +
+                        [self.XColumn[Bus]], self.XColumn[Bus]))
+                Scored[frozenset(lmPMUs)] = (float(ResSquare), lmPMUs, Parent)
+        return list(Scored.values())
+
+    def BeamRefitExtensions(self, Beam):
+        """BeamGramExtensions for the engines that fit each model, the
+        distinct extensions of the whole beam are fitted as one batch"""
+        ModelList = []
+        Parents = []
+        Seen = set()
+        for Parent, BusList in enumerate(Beam):
+            Trials = self.BeamTrials(BusList)
+            if self.ScreenTopK > 0 or self.ScreenThreshold is not None:
+                self.PlacedPMUs = [0] + BusList
+                Trials = self.ScreenCandidates(Trials)
+            for Bus in Trials:
+                if frozenset(BusList + [Bus]) not in Seen:
+                    Seen.add(frozenset(BusList + [Bus]))
+                    ModelList.append(BusList + [Bus])
+                    Parents.append(Parent)
+        return [(float(ResSquare), lmPMUs, Parent) for ResSquare, lmPMUs,
+                Parent in zip(self.RunLinearMods(ModelList), ModelList, Parents)]
+
+    def RecordState(self):
+        """Adds the current placement to self.PMUstates and hands it, with 
+        its MetaData row if there is one, to self.StepCallback"""
+        self.PMUstates.Add(self.PlacedPMUs)
+        if self.StepCallback is not None:
+            MetaData = None
+            if self.GenMetaData == True and len(self.MetaDataOP) == len(self.DataOP):
+                MetaData = self.MetaDataOP[-1]
+            self.StepCallback(list(self.PlacedPMUs), MetaData)
+
+    def SwapSearch(self, BusList):
+        """The warm start for a window (gram engine), rather than building up
+        a placement from nothing it starts from BusList, the last window's,
+        and then takes out the least vital PMU and adds the best one for as
+        long as that raises R^2. Returns the number of swaps made"""
+        self.PlacedPMUs = [0] + list(BusList)
+        self.SyncSolver()
+        self.PlacedPMUs[0] = float(self.Solver.ResSquare(self.Solver.RSS))
+        Swaps = 0
+        while len(self.PlacedPMUs) > 1:
+            PMUstateHold = list(self.PlacedPMUs)
+            self.RemoveWorstPMU()
+            self.AddBestPMU()
+            if self.PlacedPMUs[0] <= PMUstateHold[0]:
+                self.PlacedPMUs = PMUstateHold
+                break
+            Swaps += 1
+        return Swaps
+
+    def PlaceWindows(self):
+        """Runs the search on every self.WindowRows rows of the file loaded,
+        self.WindowStride rows apart, and returns a row per window for the
+        table (headed by self.Header). The cross products are slid along with the
+        window, the rows coming into it are merged in and those leaving it
+        taken out, so however much the windows overlap every row is only gone
+        over twice"""
+        Length = self.WindowRows
+        Step = self.WindowStride or Length
+        Label = None
+        Labels = []
+        if self.WindowLabel == self.Yheader:
+            Label = self.Ydata
+        elif self.WindowLabel in self.XColumn:
+            Label = self.Xdata[:, self.XColumn[self.WindowLabel]]
+        elif self.WindowLabel is not None:
+            print('Header Error', self.WindowLabel, 'not in', self.Xheaders)
+        if Label is not None:
+            Labels = [self.WindowLabel + ' from', self.WindowLabel + ' to']
+        self.MakeHeader()
+        Header = ['First row', 'Last row'] + Labels + ['Res^2', 'Swaps'] + \
+                 self.Header[1:]
+
+        def Rows(First, Last):
+            return NumpyEngine.BuildMomentStats(self.Xdata[First:Last],
+                self.Ydata[First:Last], self.Stride, self.Centres, self.Scales)
+
+        if self.Xdata.shape[0] < Length:
+            print('       only', self.Xdata.shape[0], 'rows, no window of', Length)
+        Table = []
+        Stats = None
+        for First in range(0, self.Xdata.shape[0] - Length + 1, Step):
+            Start = time.perf_counter()
+            if Stats is None or Step >= Length:
+                Stats = Rows(First, First + Length)
+            else:
+                Stats.Merge(Rows(First + Length - Step, First + Length))
+                Stats = Stats.LeaveOut(Rows(First - Step, First))
+            self.TraceStage('window', Start)
+            Previous = self.PlacedPMUs[1:]
+            self.ResetSearch()
+            self.Stats = Stats
+            if self.WindowWarmStart == True and len(Table) > 0:
+                Swaps = self.SwapSearch(Previous)
+            else:
+                self.PlaceAllPMUs()
+                Swaps = '-'
+            Row = [First + 1, First + Length]
+            if Label is not None:
+                Row += [float(Label[First]), float(Label[First + Length - 1])]
+            Row += [float(self.PlacedPMUs[0]), Swaps] + self.PlacedPMUs[1:]
+            Table.append(Row + ['-'] * (len(Header) - len(Row)))
+            print('       window rows', First + 1, 'to', First + Length,
+                  'regression value', self.PlacedPMUs[0], '-', 'full search' if
+                  Swaps == '-' else str(Swaps) + ' swaps')
+        self.Header = Header
+        return Table
 
     def PlaceSinglePMU(self):
         """selectively add and remove a single PMU, this process will throw an
@@ -326,8 +1675,6 @@ class PMUitterator(PlacePMUs):
         add second PMU (if new state save). End Game -> have the requisite
         number of PMUs been added? [if no] -> run over main body [if yes] ->
         return results"""
-        self.DataOP = []
-        self.MetaDataOP = []
         if len(self.PlacedPMUs) <= 4 and \
         (len(self.PlacedPMUs) - 1) <= (len(self.Xheaders) - 
         len(self.ExcludedBusses)) and \
@@ -336,34 +1683,34 @@ class PMUitterator(PlacePMUs):
             self.DataOP.append(list(self.PlacedPMUs))
             self.GenerateMetaData()
             print('Opening - placed', (len(self.PlacedPMUs) - 1), 'PMUs')
-            self.PMUstates.append(sorted(self.PlacedPMUs[1:]))
+            self.RecordState()
         
         elif (len(self.PlacedPMUs)-1) < self.MaxPMUs and \
         (len(self.PlacedPMUs) - 1) < (len(self.Xheaders)
         - len(self.ExcludedBusses)):
             PMUstateHold = list(self.PlacedPMUs)
             self.RemoveWorstPMU()
-            if sorted(self.PlacedPMUs[1:]) in self.PMUstates:
+            if self.PlacedPMUs[1:] in self.PMUstates:
                 #print 'retrograde PMU removal, undone'
                 self.PlacedPMUs = PMUstateHold
                 self.AddBestPMU()
 
             else:
                 self.DataOP.append(self.PlacedPMUs)
-                self.PMUstates.append(sorted(self.PlacedPMUs[1:]))
+                self.RecordState()
                 #print 'new diminished state'
                 if self.VeryParsimonious == False:
                     self.AddBestPMU()
-                if sorted(self.PlacedPMUs[1:]) not in self.PMUstates:
+                if self.PlacedPMUs[1:] not in self.PMUstates:
                     self.DataOP.append(self.PlacedPMUs)
                     self.GenerateMetaData()
-                    self.PMUstates.append(sorted(self.PlacedPMUs[1:]))
+                    self.RecordState()
                 self.AddBestPMU()
 
-            if sorted(self.PlacedPMUs[1:]) not in self.PMUstates:
+            if self.PlacedPMUs[1:] not in self.PMUstates:
                 self.DataOP.append(self.PlacedPMUs)
                 self.GenerateMetaData()
-                self.PMUstates.append(sorted(self.PlacedPMUs[1:]))
+                self.RecordState()
             print('1 back 2 forward - placed',(len(self.PlacedPMUs)-1), 'PMUs')
         else:
             print("%%%%%%%%%% PROBLEM - CONDITION NOT MET %%%%%%%%%%%%%")
@@ -377,12 +1724,14 @@ class OPsupportFunctions(PMUitterator):
         """This produces a header of length, desired number or PMUs, or, total
         number of busses minus number of excluded busses - whichever is the 
         shortest. The first column is called Res^2, this is the residual 
-        squared (R-squared = Explained variation / Total variation). The 
+        squared (R-squared = Explained variation / Total variation), or the
+        score the search ranked by if ScoreMethod is set. The 
         following headers are Var 1 through Max, these are the variables that 
         should be picked"""
         headerLength = min(self.MaxPMUs, 
                                (len(self.Xheaders) - len(self.ExcludedBusses)))
-        self.Header = ["Res^2"]
+        self.Header = [{'R2': "Res^2", 'PRESS': "PRESS R^2", 
+                        'holdout': "Holdout R^2"}[self.ScoreMethod]]
         for n in range(1, (headerLength + 1)):
             self.Header.append(("B" + str(n)))
         #self.Header.append()
@@ -395,22 +1744,7 @@ class OPsupportFunctions(PMUitterator):
         single row of data and a number of rows of data and handles them
         appropriately"""
         if type(self.DataOP[0]) == list:
-            
-            DataHold = []
-            for Row in self.DataOP:
-                RowHold = []
-                for Cell in Row:
-                    if type(Cell) == float:
-                        RowHold.append(Cell)
-                    elif type(Cell) == str:
-                        RowHold.append((str(Cell)))
-                    else:
-                        print("potential error", Row)
-                while len(RowHold) < len(self.Header):
-                    RowHold.append('-')
-                DataHold.append(RowHold)
-            self.DataOP = DataHold
-            DataHold, Row, Cell = None, None, None
+            self.DataOP = [self.PrepRow(Row) for Row in self.DataOP]
         elif type(self.DataOP[0]) == str or isinstance(self.DataOP, Number):
             RowHold = []
             for Cell in self.DataOP:
@@ -427,6 +1761,26 @@ class OPsupportFunctions(PMUitterator):
         else:
             print('Error? self.DataOP =', self.DataOP)
             
+    def PrepRow(self, Row):
+        """One row of self.DataOP ready for output, padded to the header"""
+        RowHold = []
+        for Cell in Row:
+            if type(Cell) == float:
+                RowHold.append(Cell)
+            elif type(Cell) == str:
+                RowHold.append((str(Cell)))
+            else:
+                print("potential error", Row)
+        while len(RowHold) < len(self.Header):
+            RowHold.append('-')
+        return RowHold
+            
+    def MetaHeader(self):
+        HeaderAux = ['Formula', 'Intercept']
+        for n in range(1, (self.PolynomialDegree + 1)):
+            HeaderAux.append(('x^'+ str(n)))
+        return HeaderAux
+            
     def MakeFileName(self): 
         if len(self.ExcludedBusses) > 0:
             ExFiles = 'Busses '
@@ -435,9 +1789,12 @@ class OPsupportFunctions(PMUitterator):
             ExFiles += ' Excluded '
         else:
             ExFiles = ' '
+        if self.ScoreMethod != 'R2':
+            ExFiles += self.ScoreMethod + ' scored '
+        if self.BeamWidth > 1:
+            ExFiles += 'beam ' + str(self.BeamWidth) + ' '
             
-        start = self.ip_filename.index('\\') + 1
-        filename = self.ip_filename[start:-4]
+        filename = os.path.basename(self.ip_filename)[:-4]
         
         if self.VeryParsimonious == True:
             self.OPcsvFileName = self.op_directory + "Output/" + filename + "_" +str(self.TargetValue) + " Very Parsimonius Table - degree " + str(self.PolynomialDegree) + ' ' + ExFiles + ".csv"
@@ -454,75 +1811,199 @@ class OPsupportFunctions(PMUitterator):
                 self.VerboseOPcsvFileName = self.op_directory + "VerboseOutput/" + filename + "_" +str(self.TargetValue) + " Verbose Parsimonius Table - degree " + ' ' + str(self.PolynomialDegree) + ExFiles + ".csv"
                 
         
-    def WriteAllToCSV(self):
-        """This function writes all the data, including headers, at the same
-        time, this is good for stable code, but if a crash is likly then line
-        by line can be more desirable"""
+    def MakeWindowFileName(self):
+        """The Output file for the table of windows (see WindowAllFiles)"""
+        ExFiles = ' '
+        if len(self.ExcludedBusses) > 0:
+            ExFiles = ' Busses ' + ' '.join(str(Num) for Num in 
+                                            self.ExcludedBusses) + ' Excluded '
+        filename = os.path.basename(self.ip_filename)[:-4]
+        self.WindowcsvFileName = self.op_directory + "Output/" + filename + \
+            "_" + str(self.TargetValue) + " Windows of " + str(self.WindowRows) \
+            + " rows every " + str(self.WindowStride or self.WindowRows) + \
+            " - degree " + str(self.PolynomialDegree) + ExFiles + ".csv"
+        
+    def OpenOutput(self, VerboseOffset = None):
+        """Opens the Output, MetaData and VerboseOutput files for the current
+        file and degree (over writing any there) and writes their headers;
+        rows are then appended through OutputWriter's buffers. VerboseOffset
+        (from a checkpoint) carries on the verbose file from that point"""
+        self.CloseOutput()
         self.MakeHeader()
-        self.PrepData()
-        self.DataOP = [self.Header] + self.DataOP
         self.MakeFileName()
         print("writing to")
         print(self.OPcsvFileName)
-                
-        with open(self.OPcsvFileName, 'w', newline = '') as opFile:
-            writer = csv.writer(opFile, delimiter = ',')
-            for row in self.DataOP:
-                writer.writerow(row)
-            
+        Options = {'FlushRows': self.FlushRows, 'FlushSeconds': 
+                   self.FlushSeconds, 'FsyncPolicy': self.FsyncPolicy}
+        self.OPwriter = OutputWriter.BufferedCSV(self.OPcsvFileName, 
+                                                 self.Header, **Options)
         if self.GenMetaData == True:
-            HeaderAux = ['Formula', 'Intercept']
-            for n in range(1, (self.PolynomialDegree + 1)):
-                HeaderAux.append(('x^'+ str(n)))
-            self.MetaDataOP = [HeaderAux] + self.MetaDataOP
-            with open(self.MetaOPcsvFileName, 'w', newline = '') as opFile:
-                writer = csv.writer(opFile, delimiter = ',')
-                for row in self.MetaDataOP:
-                    writer.writerow(row)
-                    
-        if self.VerboseOP == True:
-            with open(self.VerboseOPcsvFileName, 'w', newline = '') as opFile:
-                writer = csv.writer(opFile, delimiter = ',')
-                for row in self.VerboseDataOP:
-                    writer.writerow(row)
+            self.MetaWriter = OutputWriter.BufferedCSV(self.MetaOPcsvFileName,
+                                                   self.MetaHeader(), **Options)
+        if self.VerboseOP == True and self.VerboseFormat == 'npz':
+            self.VerboseWriter = OutputWriter.VerboseNPZ(
+                self.VerboseOPcsvFileName[:-4] + '.npz', self.Xheaders, 
+                self.Yheader, self.PolynomialDegree, Offset = VerboseOffset,
+                **Options)
+        elif self.VerboseOP == True:
+            self.VerboseWriter = OutputWriter.BufferedCSV(
+                self.VerboseOPcsvFileName, Offset = VerboseOffset, **Options)
+        self.RowsWritten = 0
+        self.MetaRowsWritten = 0
+        
+    def WriteSteps(self):
+        """Appends the Output and MetaData rows made since it was last called,
+        and any verbose rows being held"""
+        for Row in self.DataOP[self.RowsWritten:]:
+            self.OPwriter.Write(self.PrepRow(Row))
+        self.RowsWritten = len(self.DataOP)
+        if self.MetaWriter is not None:
+            for Row in self.MetaDataOP[self.MetaRowsWritten:]:
+                self.MetaWriter.Write(Row)
+            self.MetaRowsWritten = len(self.MetaDataOP)
+        if self.VerboseWriter is not None:
+            for Row in self.VerboseDataOP:
+                self.VerboseWriter.Write(Row)
+        self.VerboseDataOP = []
+        
+    def CloseOutput(self, Finished = False):
+        """Closes the output files. Unless Finished, a checkpointed npz
+        verbose file is only suspended, its raw files kept for the search to
+        be resumed (e.g. by FailoverAllFiles) rather than packed"""
+        if Finished == False and self.CheckpointDirectory is not None and \
+        isinstance(self.VerboseWriter, OutputWriter.VerboseNPZ):
+            self.VerboseWriter.Suspend()
+        for Writer in [self.OPwriter, self.MetaWriter, self.VerboseWriter]:
+            if Writer is not None:
+                Writer.Close()
+        self.OPwriter = None
+        self.MetaWriter = None
+        self.VerboseWriter = None
+        
+    def CheckpointName(self):
+        self.MakeFileName()
+        return os.path.join(self.CheckpointDirectory, 
+            os.path.basename(self.OPcsvFileName)[:-4] + '.checkpoint')
+    
+    def CheckpointSource(self):
+        """What a checkpoint has to match to be resumed from, the input
+        file as it is now and the settings that change the search"""
+        Stat = os.stat(self.ip_filename)
+        return [os.path.abspath(self.ip_filename), Stat.st_size, 
+                Stat.st_mtime_ns, self.Engine, self.TargetValue, 
+                self.PolynomialDegree, self.MaxPMUs, self.VeryParsimonious,
+                sorted(self.ExcludedBusses), self.VerboseOP, self.GenMetaData,
+                self.StreamOutput, self.VerboseFormat, self.ScoreMethod,
+                self.HoldoutBlocks, self.IndexColumns, self.DropCollinear,
+                self.CollinearTolerance]
+        
+    def SaveCheckpoint(self):
+        """Saves where the search is up to; it's written to a temporary file
+        which is then moved over the last checkpoint, so a crash part way
+        through leaves the last one whole"""
+        import pickle
+        os.makedirs(self.CheckpointDirectory, exist_ok = True)
+        Name = self.CheckpointName()
+        State = {'Source': self.CheckpointSource(),
+                 'PlacedPMUs': self.PlacedPMUs,
+                 'PMUstates': self.PMUstates,
+                 'DataOP': self.DataOP,
+                 'MetaDataOP': self.MetaDataOP,
+                 'VerboseDataOP': self.VerboseDataOP,
+                 'VerboseOffset': None,
+                 'FitCache': self.FitCache}
+        if self.VerboseWriter is not None:
+            State['VerboseOffset'] = self.VerboseWriter.Checkpoint()
+        with open(Name + '.tmp', 'wb') as opFile:
+            pickle.dump(State, opFile, pickle.HIGHEST_PROTOCOL)
+            opFile.flush()
+            os.fsync(opFile.fileno())
+        os.replace(Name + '.tmp', Name)
+        
+    def LoadCheckpoint(self):
+        """Picks up the search from the checkpoint for this file and these
+        settings if there is one"""
+        import pickle
+        Name = self.CheckpointName()
+        if not os.path.exists(Name):
+            return
+        with open(Name, 'rb') as ipFile:
+            State = pickle.load(ipFile)
+        if State['Source'] != self.CheckpointSource():
+            print('       checkpoint', Name, 'is for other data or settings,',
+                  'starting afresh')
+            return
+        #CheckpointName made the file names
+        if State['VerboseOffset'] is not None and self.VerboseFormat == 'npz' \
+        and not OutputWriter.VerboseNPZ.CanResume(self.VerboseOPcsvFileName[:-4]
+                                                  + '.npz', State['VerboseOffset']):
+            print('       verbose output of checkpoint', Name, 'is gone,',
+                  'starting afresh')
+            return
+        self.PlacedPMUs = State['PlacedPMUs']
+        self.PMUstates = State['PMUstates']
+        self.DataOP = State['DataOP']
+        self.MetaDataOP = State['MetaDataOP']
+        self.VerboseDataOP = State['VerboseDataOP']
+        if State['FitCache'] is not None:
+            self.FitCache = State['FitCache']
+        if State['VerboseOffset'] is not None:
+            self.OpenOutput(State['VerboseOffset'])
+        print('       resuming from checkpoint -', len(self.PlacedPMUs) - 1,
+              'PMUs placed')
+        
+    def RemoveCheckpoint(self):
+        if self.CheckpointDirectory is not None and \
+        os.path.exists(self.CheckpointName()):
+            os.remove(self.CheckpointName())
+        
+    def WriteAllToCSV(self):
+        """This function writes all the data, including headers, at the same
+        time, this is good for stable code, but if a crash is likly then line
+        by line can be more desirable. If the output has been streamed 
+        (self.StreamOutput) it just writes what's left and closes the files"""
+        Start = time.perf_counter()
+        if self.OPwriter is None:
+            self.OpenOutput()
+        self.WriteSteps()
+        #the checkpoint goes first, the npz's raw files are only packed (and
+        #removed) once nothing could resume from them
+        self.RemoveCheckpoint()
+        self.CloseOutput(Finished = True)
+        if self.ColumnIndexRows is not None:
+            self.WriteColumnIndex()
+        self.TraceStage('write', Start)
                 
+    def WriteColumnIndex(self):
+        """Writes the classes of columns the column index found (see
+        ApplyColumnIndex) for this file and target, a row per class with the
+        1 - R^2 of the nearest to collinear member of a cluster"""
+        Folder = self.op_directory + 'ColumnIndex/'
+        os.makedirs(Folder, exist_ok = True)
+        Name = Folder + os.path.basename(self.ip_filename)[:-4] + '_' + \
+               str(self.TargetValue) + ' Column Index.csv'
+        with open(Name, 'w', newline = '') as opFile:
+            Writer = csv.writer(opFile)
+            Writer.writerow(['Class', '1 - R^2', 'Columns', 'Left out'])
+            Writer.writerows(self.ColumnIndexRows)
+            
     def WriteHeaderToCSV(self):
         """This function writes a header to a new file, if there is an existing
         file with that name it will be over written. This function is used when
-        appending a single line to a file, more tollerant of crashes."""
-        self.MakeHeader()
-        self.MakeFileName()
-        
-        with open(self.OPcsvFileName, 'w', newline = '') as opFile:
-            writer = csv.writer(opFile, delimiter = ',')
-            writer.writerow(self.Header)
-            
-        if self.GenMetaData == True:
-            HeaderAux = ['Formula', 'Intercept']
-            for n in range(1, (self.PolynomialDegree + 1)):
-                HeaderAux.append(('x^'+ str(n)))
-            with open(self.MetaOPcsvFileName, 'w', newline = '') as opFile:
-                writer = csv.writer(opFile, delimiter = ',')
-                writer.writerow(HeaderAux)
+        appending a single line to a file, more tollerant of crashes. The files
+        are kept open until CloseOutput, verbose rows are streamed to them."""
+        self.OpenOutput()
             
     def WriteLineCSV(self):
         """This function writes a single line of data to the specified file, if
         code is prone to crash then cashed data is not lost. Actually it is the
         data from a single sweep, if 1 PMU is removed, revealing a new state, 
         then two PMUs are added, with each being a new state, then as many as
-        three lines might be added."""
-        self.PrepData()        
-        
-        with open(self.OPcsvFileName, 'a', newline = '') as opFile:
-            writer = csv.writer(opFile, delimiter = ',')
-            for row in self.DataOP:
-                writer.writerow(row)
-            
-        if self.GenMetaData == True:
-            with open(self.MetaOPcsvFileName, 'w', newline = '') as opFile:
-                writer = csv.writer(opFile, delimiter = ',')
-                for row in self.MetaDataOP:
-                    writer.writerow(row)
+        three lines might be added. Only the new rows are appended, the
+        writer's buffer decides when they reach the disk."""
+        Start = time.perf_counter()
+        self.WriteSteps()
+        self.TraceStage('write', Start)
             
 class FileItterator(OPsupportFunctions):
     """This looks in the root folder self.working_directory, pulls out all the
@@ -539,19 +2020,151 @@ class FileItterator(OPsupportFunctions):
             self.Rread()
             print("       Data Loaded")
             self.PlaceAllPMUs()
+            self.FitCacheReport()
             self.WriteAllToCSV()
             self.Reset()
             
+    def ScheduleAllJobs(self, Targets = None, Degrees = None, 
+                        ExcludedSets = None, Jobs = 2):
+        """Runs every combination of file, target, polynomial degree and set
+        of excluded busses as separate jobs, Jobs at a time, through 
+        JobScheduler. Anything not given is taken from the current settings.
+        Returns one (job name, error or None, seconds) entry per job"""
+        import JobScheduler
+        self.filenames()
+        if Targets is None:
+            Targets = [self.TargetValue]
+        if Degrees is None:
+            Degrees = [self.PolynomialDegree]
+        if ExcludedSets is None:
+            ExcludedSets = [self.ExcludedBusses]
+        Settings = {Name: getattr(self, Name) for Name in self.SettingNames}
+        JobList = JobScheduler.ExpandJobs(self.ip_filenames_list, Targets, 
+                                          Degrees, ExcludedSets, Settings)
+        print('######', len(JobList), 'jobs on', Jobs, 'processes ######')
+        return JobScheduler.ScheduleJobs(JobList, Jobs)
+        
+    def SweepAllFiles(self, Degrees):
+        """ItterateAllFiles for a list of polynomial degrees, each file is
+        read once and all the degrees are searched on it before moving on to
+        the next; with the numpy and gram engines the powers of the columns
+        are built once, up to the largest degree"""
+        self.filenames()
+        Degrees = [int(Degree) for Degree in Degrees]
+        #only for this sweep, a later search builds the powers it needs
+        Held = self.BankDegree
+        self.BankDegree = max(Degrees + [self.BankDegree or 0])
+        try:
+            for self.ip_filename in self.ip_filenames_list:
+                print("###### Starting on", self.ip_filename, "######")
+                self.PolynomialDegree = Degrees[0]
+                self.Rread()
+                print("       Data Loaded")
+                for self.PolynomialDegree in Degrees:
+                    print("       degree", self.PolynomialDegree)
+                    self.PlaceAllPMUs()
+                    self.FitCacheReport()
+                    self.WriteAllToCSV()
+                    self.ResetSearch()
+                self.Reset()
+        finally:
+            self.BankDegree = Held
+        
+    def MultiTargetAllFiles(self, Targets, Degrees = None):
+        """ItterateAllFiles for a list of targets (and optionally a list of
+        polynomial degrees as SweepAllFiles). With the numpy and gram engines
+        each file is read, and its columns' powers or cross products worked
+        out, once for all the targets; each target still gets its own Output,
+        MetaData and VerboseOutput files. The R: engine just goes through the
+        targets one at a time"""
+        if Degrees is None:
+            Degrees = [self.PolynomialDegree]
+        Degrees = [int(Degree) for Degree in Degrees]
+        if self.Engine not in ('numpy', 'gram'):
+            for self.TargetValue in Targets:
+                self.SweepAllFiles(Degrees)
+            return
+        self.filenames()
+        Held = self.BankDegree
+        self.BankDegree = max(Degrees + [self.BankDegree or 0])
+        try:
+            for self.ip_filename in self.ip_filenames_list:
+                print("###### Starting on", self.ip_filename, "######")
+                self.PolynomialDegree = Degrees[0]
+                self.MultiTargetRead(Targets)
+                print("       Data Loaded")
+                for Target in [self.AllHeaders[Column] for Column in 
+                               self.TargetColumns]:
+                    print("       target", Target)
+                    for self.PolynomialDegree in Degrees:
+                        self.SelectTarget(Target)
+                        print("       degree", self.PolynomialDegree)
+                        self.PlaceAllPMUs()
+                        self.FitCacheReport()
+                        self.WriteAllToCSV()
+                self.Reset()
+        finally:
+            self.BankDegree = Held
+        
+    def WindowAllFiles(self):
+        """ItterateAllFiles with the search run on windows of WindowRows rows
+        in turn (see PlaceWindows) rather than on every row; for each file a 
+        table of every window's placement and R^2 is written to Output. The
+        windows are searched with the gram engine (see WindowSettings)"""
+        if self.WindowRows <= 0:
+            print('set WindowRows to the number of rows in a window')
+            return
+        Held = {Name: getattr(self, Name) for Name in WindowSettings}
+        Changed = [Name for Name in WindowSettings if Held[Name] != 
+                   WindowSettings[Name]]
+        if len(Changed) > 0:
+            print('       windows are searched with', {Name: WindowSettings[Name]
+                                                       for Name in Changed})
+        for Name, Value in WindowSettings.items():
+            setattr(self, Name, Value)
+        self.filenames()
+        try:
+            for self.ip_filename in self.ip_filenames_list:
+                print("###### Starting on", self.ip_filename, "######")
+                self.Rread()
+                print("       Data Loaded")
+                Table = self.PlaceWindows()
+                Start = time.perf_counter()
+                self.MakeWindowFileName()
+                print("writing to")
+                print(self.WindowcsvFileName)
+                Writer = OutputWriter.BufferedCSV(self.WindowcsvFileName, 
+                    self.Header, self.FlushRows, self.FlushSeconds, 
+                    self.FsyncPolicy)
+                for Row in Table:
+                    Writer.Write(Row)
+                Writer.Close()
+                if self.ColumnIndexRows is not None:
+                    self.WriteColumnIndex()
+                self.TraceStage('write', Start)
+                self.Reset()
+        finally:
+            for Name, Value in Held.items():
+                setattr(self, Name, Value)
+        
+    def FitCacheReport(self):
+        if self.FitCache is not None:
+            print('       models fitted', self.FitCache.Misses, 
+                  'fit cache hits', self.FitCache.Hits)
+            
     def FailoverAllFiles(self):
         self.filenames()
-        for self.ip_filename in self.ip_filenames_list:
+        for FileName in self.ip_filenames_list:
             n = 0
             while n < 3:
-                try:                    
+                try:
+                    #Reset clears ip_filename, so it's set for every attempt
+                    self.ip_filename = FileName
                     print("###### Starting on", self.ip_filename[17:], "######")
                     self.Rread()
                     print("       Data Loaded")
                     self.PlaceAllPMUs()
+                    self.FitCacheReport()
                     self.WriteAllToCSV()
                     self.Reset()
                     n = 4
@@ -572,14 +2185,13 @@ class FileItterator(OPsupportFunctions):
             self.Rread()
             print("       Data Loaded")
             self.WriteHeaderToCSV()
-            print('writing to')
-            print(self.OPcsvFileName)
             #try:
             while (len(self.PlacedPMUs)-1) < self.MaxPMUs and \
             (len(self.PlacedPMUs) - 1) < (len(self.Xheaders)
             - len(self.ExcludedBusses)):
                    self.PlaceSinglePMU()
                    self.WriteLineCSV()
+            self.CloseOutput()
                        
                        
 #            except:
@@ -588,12 +2200,102 @@ class FileItterator(OPsupportFunctions):
 #                print self.formula
 #            self.Reset()
 
+def Main(Arguments = None, run = None):
+    """The command line, e.g.
+        python ParsimoniusPlacement.py inputFolder/ --target CO2.Intensity.kg.MW
+            --degrees 2 3 --max-pmus 10 --engine gram --jobs 4
+    runs what QuickRun.py would with those settings. Nothing is imported
+    from R: or numpy until a file is read, so --help returns straight away.
+    run is the FileItterator to use (e.g. a DistributedPlacement), a new
+    one if not given"""
+    import argparse
+    if run is None:
+        run = FileItterator()
+    Parser = argparse.ArgumentParser(description = 'Parsimonious placement' +
+        ' of the columns that best predict a target by polynomial regression')
+    Parser.add_argument('input', nargs = '?', default = run.working_directory,
+                        help = 'folder of CSV files (default %(default)s)')
+    Parser.add_argument('--output', default = run.op_directory, 
+                        help = 'folder for Output, MetaData and VerboseOutput')
+    Parser.add_argument('--target', nargs = '+', default = [run.TargetValue],
+                        help = 'column(s) to predict')
+    Parser.add_argument('--degrees', nargs = '+', type = int, 
+                        default = [run.PolynomialDegree],
+                        help = 'polynomial degree(s) to search at')
+    Parser.add_argument('--max-pmus', type = int, default = run.MaxPMUs,
+                        help = 'most columns to place')
+    Parser.add_argument('--engine', choices = ['R', 'numpy', 'gram'], 
+                        default = run.Engine)
+    Parser.add_argument('--workers', type = int, default = run.Workers,
+                        help = 'processes used per step by the numpy engine')
+    Parser.add_argument('--jobs', type = int, default = 1, help = 'run each' +
+                        ' file, target and degree as a separate job, this' +
+                        ' many at a time')
+    Parser.add_argument('--exclude', nargs = '*', default = [],
+                        help = 'columns never to place')
+    Parser.add_argument('--score', choices = ['R2', 'PRESS', 'holdout'],
+                        default = run.ScoreMethod, help = 'what models are' +
+                        ' ranked by, see ScoreMethod')
+    Parser.add_argument('--holdout-blocks', type = int, 
+                        default = run.HoldoutBlocks)
+    Parser.add_argument('--incremental', default = run.IncrementalDirectory,
+                        help = 'folder to keep the cross products in, see' +
+                        ' IncrementalDirectory (gram engine)')
+    Parser.add_argument('--beam', type = int, default = run.BeamWidth,
+                        help = 'keep this many of the best sets of each size,' +
+                        ' see PlaceBeam (1 is the parsimonious search)')
+    Parser.add_argument('--window', type = int, default = run.WindowRows,
+                        help = 'search every this many rows in turn, see' +
+                        ' WindowAllFiles (first target only)')
+    Parser.add_argument('--window-stride', type = int, 
+                        default = run.WindowStride, help = 'rows from one' +
+                        ' window to the next (default the window length)')
+    Parser.add_argument('--window-label', default = run.WindowLabel,
+                        help = 'column whose first and last values in each' +
+                        ' window are tabled, a time stamp say')
+    Parser.add_argument('--index-columns', action = 'store_true', 
+                        default = run.IndexColumns, help = 'leave constant' +
+                        ' and duplicate columns out, see IndexColumns')
+    Parser.add_argument('--drop-collinear', action = 'store_true',
+                        default = run.DropCollinear, help = 'only search the' +
+                        ' pivots of near collinear clusters too')
+    Parser.add_argument('--collinear-tolerance', type = float, 
+                        default = run.CollinearTolerance, help = '1 - R^2' +
+                        ' below which a column counts as collinear')
+    Options = Parser.parse_args(Arguments)
+    run.working_directory = os.path.join(Options.input, '')
+    run.op_directory = os.path.join(Options.output, '')
+    run.MaxPMUs = Options.max_pmus
+    run.Engine = Options.engine
+    run.Workers = Options.workers
+    run.ExcludedBusses = Options.exclude
+    run.ScoreMethod = Options.score
+    run.HoldoutBlocks = Options.holdout_blocks
+    run.IncrementalDirectory = Options.incremental
+    run.TargetValue = Options.target[0]
+    run.PolynomialDegree = Options.degrees[0]
+    run.BeamWidth = Options.beam
+    run.WindowRows = Options.window
+    run.WindowStride = Options.window_stride
+    run.WindowLabel = Options.window_label
+    run.IndexColumns = Options.index_columns or Options.drop_collinear
+    run.DropCollinear = Options.drop_collinear
+    run.CollinearTolerance = Options.collinear_tolerance
+    if Options.window > 0:
+        for run.PolynomialDegree in Options.degrees:
+            run.WindowAllFiles()
+    elif Options.jobs > 1:
+        run.ScheduleAllJobs(Targets = Options.target, Degrees = Options.degrees,
+                            Jobs = Options.jobs)
+    elif len(Options.target) > 1:
+        run.MultiTargetAllFiles(Options.target, Options.degrees)
+    elif len(Options.degrees) > 1:
+        run.SweepAllFiles(Options.degrees)
+    else:
+        run.ItterateAllFiles()
+        
+        
+#the guard stops worker processes re-running this on Windows
 if __name__ == '__main__':
-    run = FileItterator()
-#    run.ModelsToTest = [' 30 O']
-#    run.ExcludedBusses = ['X1']
-    run.ItterateAllFiles() 
-    #run.IttAllLineByLine()
-    #run.FailoverAllFiles()
-    
-    print('Endeetoe')
\ No newline at end of file
+    Main()
+    print('Endeetoe')
@@ -0,0 +1,15 @@
+# -*- coding: utf-8 -*-
+"""
+Command line entry point, python PlacementCLI.py --help for the options
+(see ParsimoniusPlacement.Main). It is kept apart from ParsimoniusPlacement.py
+so that is imported from its compiled .pyc, a script run directly is compiled
+from scratch on every start.
+
+@author: pbrogan
+"""
+
+import ParsimoniusPlacement
+
+#the guard stops worker processes re-running this on Windows
+if __name__ == '__main__':
+    ParsimoniusPlacement.Main()
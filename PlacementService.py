@@ -0,0 +1,291 @@
+# -*- coding: utf-8 -*-
+"""
+A placement service that keeps datasets in memory between jobs.
+
+Run it with
+    python PlacementService.py --socket /tmp/placement.sock
+or  python PlacementService.py --port 8765     (localhost only)
+
+and talk to it in lines of JSON, one request per line. Every request can
+carry an "id" which is copied onto everything sent back for it, so several
+jobs can be run at once over one connection.
+
+    {"op": "load", "file": "inputFolder/x.csv", "degree": 5}
+        reads the file and works out the cross products of the powers of
+        every column (numpy engine: the powers themselves) up to degree, with
+        every column as a possible target. Jobs load their file if need be.
+    {"op": "place", "file": "inputFolder/x.csv", "target": "CO2.Intensity.kg.MW",
+     "degree": 3, "maxpmus": 10, "excluded": [], "engine": "gram", "beam": 1}
+        runs a search ("beam" > 1 a beam search, see PlaceBeam); each
+        placement is sent back as it's found
+        ({"event": "step", "r2": .., "busses": [..], "coefficients": [..]})
+        then {"event": "done", "output": [rows of the Output table]}.
+        "op_directory" also writes the usual output files there.
+    {"op": "datasets"}          what's loaded, with its size
+    {"op": "evict", "file": ..} drops a dataset
+
+Datasets are kept until MaxBytes is reached, then the least recently used
+ones not in use by a job are dropped. Searches run in a pool of threads, the
+numpy work in them mostly runs outside the GIL. The R: engine isn't served,
+its data lives in the one embedded R session.
+
+@author: pbrogan
+"""
+
+import argparse
+import asyncio
+import concurrent.futures
+import json
+import os
+import time
+import traceback
+from collections import OrderedDict
+
+import ParsimoniusPlacement
+
+
+#what a FileItterator gets from a dataset after MultiTargetRead
+DatasetState = ['AllHeaders', 'TargetColumns', 'Xdata', 'Centres', 'Scales',
+                'Stride', 'Stats', 'FeatureBank', 'FileStamp']
+
+
+class Dataset():
+    """One file read and featurised once (see MultiTargetRead) and shared,
+    read only, by every job on it"""
+    def __init__(self, FileName, Engine, Degree, CacheParsedCSV = False):
+        run = ParsimoniusPlacement.FileItterator()
+        run.Engine = Engine
+        run.PolynomialDegree = Degree
+        run.BankDegree = Degree
+        run.CacheParsedCSV = CacheParsedCSV
+        run.working_directory = os.path.dirname(FileName) + '/'
+        run.ip_filename = FileName
+        run.MultiTargetRead(None)
+        self.FileName = FileName
+        self.Engine = Engine
+        self.Degree = Degree
+        self.ModifiedTime = os.stat(FileName).st_mtime_ns
+        self.State = {Name: getattr(run, Name) for Name in DatasetState}
+        self.Bytes = sum(Value.nbytes for Value in [run.Xdata, run.FeatureBank]
+                         if Value is not None)
+        if run.Stats is not None:
+            self.Bytes += run.Stats.CoMoment.nbytes
+        self.Users = 0
+
+    def Runner(self):
+        """A FileItterator set up on this dataset, ready for SelectTarget"""
+        run = ParsimoniusPlacement.FileItterator()
+        for Name, Value in self.State.items():
+            setattr(run, Name, Value)
+        run.Engine = self.Engine
+        run.BankDegree = self.Degree
+        run.ip_filename = self.FileName
+        return run
+
+
+class DatasetStore():
+    """The datasets held, least recently used first"""
+    def __init__(self, MaxBytes):
+        self.MaxBytes = MaxBytes
+        self.Datasets = OrderedDict()
+
+    def Key(self, FileName, Engine):
+        return (os.path.abspath(FileName), Engine)
+
+    def Get(self, FileName, Engine, Degree):
+        """The dataset for FileName, read (again) if it isn't held, is out
+        of date or was featurised to a lower degree"""
+        Key = self.Key(FileName, Engine)
+        Data = self.Datasets.get(Key)
+        if Data is None or Data.Degree < Degree or \
+        Data.ModifiedTime != os.stat(FileName).st_mtime_ns:
+            Data = Dataset(FileName, Engine, max(Degree, Data.Degree if Data
+                           is not None else 0))
+            self.Datasets[Key] = Data
+        self.Datasets.move_to_end(Key)
+        self.Evict()
+        return Data
+
+    def Evict(self):
+        Total = sum(Data.Bytes for Data in self.Datasets.values())
+        for Key in list(self.Datasets):
+            if Total <= self.MaxBytes:
+                break
+            #the newest is kept even if it's over the cap on its own
+            if self.Datasets[Key].Users == 0 and Key != next(reversed(
+                    self.Datasets)):
+                Total -= self.Datasets.pop(Key).Bytes
+
+    def Drop(self, FileName, Engine):
+        return self.Datasets.pop(self.Key(FileName, Engine), None) is not None
+
+    def Report(self):
+        return [{'file': Key[0], 'engine': Key[1], 'degree': Data.Degree,
+                 'bytes': Data.Bytes, 'users': Data.Users} for Key, Data in
+                self.Datasets.items()]
+
+
+def RunPlacement(Data, Job, Send):
+    """Runs one search (in a worker thread), Send is called with every step"""
+    run = Data.Runner()
+    run.PolynomialDegree = int(Job.get('degree', 3))
+    run.MaxPMUs = int(Job.get('maxpmus', 20))
+    run.ExcludedBusses = list(Job.get('excluded', []))
+    run.VeryParsimonious = bool(Job.get('veryparsimonious', True))
+    run.BeamWidth = int(Job.get('beam', 1))
+    run.VerboseOP = 'op_directory' in Job and bool(Job.get('verbose', False))
+    run.SelectTarget(Job['target'])
+
+    def Step(PlacedPMUs, MetaData):
+        Send({'event': 'step', 'r2': PlacedPMUs[0], 'busses': PlacedPMUs[1:],
+              'coefficients': None if MetaData is None else MetaData[1:]})
+
+    run.StepCallback = Step
+    run.PlaceAllPMUs()
+    Output = [list(Row) for Row in run.DataOP]
+    if 'op_directory' in Job:
+        run.op_directory = Job['op_directory']
+        run.WriteAllToCSV()
+    return Output
+
+
+class PlacementService():
+    def __init__(self, MaxBytes = 2 ** 30, Threads = 4):
+        self.Store = DatasetStore(MaxBytes)
+        self.Executor = concurrent.futures.ThreadPoolExecutor(Threads)
+        self.Loading = {}
+
+    async def GetDataset(self, FileName, Engine, Degree):
+        """The dataset, loading it in a worker thread if need be; jobs that
+        want the same file while it's loading wait for the one load"""
+        Key = self.Store.Key(FileName, Engine)
+        while Key in self.Loading:
+            await self.Loading[Key]
+        Data = self.Store.Datasets.get(Key)
+        if Data is not None and Data.Degree >= Degree and \
+        Data.ModifiedTime == os.stat(FileName).st_mtime_ns:
+            self.Store.Datasets.move_to_end(Key)
+            return Data
+        Loop = asyncio.get_running_loop()
+        self.Loading[Key] = Loop.run_in_executor(self.Executor, self.Store.Get,
+                                                 FileName, Engine, Degree)
+        try:
+            return await self.Loading[Key]
+        finally:
+            del self.Loading[Key]
+
+    async def Handle(self, Request, Send):
+        Op = Request.get('op')
+        Engine = Request.get('engine', 'gram')
+        if Op == 'datasets':
+            Send({'event': 'datasets', 'datasets': self.Store.Report()})
+            return
+        if Op == 'evict':
+            Send({'event': 'evicted', 'evicted': self.Store.Drop(
+                Request['file'], Engine)})
+            return
+        if Op not in ('load', 'place'):
+            Send({'event': 'error', 'message': 'unknown op ' + str(Op)})
+            return
+        if Engine not in ('numpy', 'gram'):
+            Send({'event': 'error', 'message': 'the service runs the numpy' +
+                  ' and gram engines only'})
+            return
+        Start = time.time()
+        Data = await self.GetDataset(Request['file'], Engine,
+                                  int(Request.get('degree', 3)))
+        if Op == 'load':
+            Send({'event': 'loaded', 'headers': Data.State['AllHeaders'],
+                  'bytes': Data.Bytes, 'seconds': time.time() - Start})
+            return
+        Loop = asyncio.get_running_loop()
+        Data.Users += 1
+        try:
+            Output = await Loop.run_in_executor(self.Executor, RunPlacement,
+                Data, Request, lambda Message: Loop.call_soon_threadsafe(
+                Send, Message))
+        finally:
+            Data.Users -= 1
+        Send({'event': 'done', 'output': Output, 'seconds': time.time() - Start})
+
+    async def Connection(self, Reader, Writer):
+        """Serves one client, each request runs as its own task"""
+        Tasks = set()
+
+        def Sender(Id):
+            def Send(Message):
+                if Id is not None:
+                    Message['id'] = Id
+                Writer.write((json.dumps(Message) + '\n').encode())
+            return Send
+
+        async def Run(Request):
+            Send = Sender(Request.get('id'))
+            try:
+                await self.Handle(Request, Send)
+            except Exception:
+                Send({'event': 'error', 'message': traceback.format_exc()})
+            await Writer.drain()
+
+        while True:
+            Line = await Reader.readline()
+            if not Line:
+                break
+            try:
+                Request = json.loads(Line)
+            except ValueError:
+                Sender(None)({'event': 'error', 'message': 'not JSON'})
+                continue
+            Task = asyncio.create_task(Run(Request))
+            Tasks.add(Task)
+            Task.add_done_callback(Tasks.discard)
+        if len(Tasks) > 0:
+            await asyncio.wait(Tasks)
+        Writer.close()
+
+    async def Serve(self, Socket = None, Port = 8765):
+        if Socket is not None:
+            Server = await asyncio.start_unix_server(self.Connection, Socket)
+            print('placement service on', Socket)
+        else:
+            Server = await asyncio.start_server(self.Connection, '127.0.0.1',
+                                                Port)
+            print('placement service on 127.0.0.1 port', Port)
+        async with Server:
+            await Server.serve_forever()
+
+
+async def Submit(Request, Socket = None, Port = 8765):
+    """Client side, sends one request and yields what comes back for it
+    until it's done (or fails)"""
+    if Socket is not None:
+        Reader, Writer = await asyncio.open_unix_connection(Socket)
+    else:
+        Reader, Writer = await asyncio.open_connection('127.0.0.1', Port)
+    Writer.write((json.dumps(Request) + '\n').encode())
+    await Writer.drain()
+    try:
+        while True:
+            Line = await Reader.readline()
+            if not Line:
+                return
+            Message = json.loads(Line)
+            yield Message
+            if Message['event'] != 'step':
+                return
+    finally:
+        Writer.close()
+
+
+if __name__ == '__main__':
+    Parser = argparse.ArgumentParser(description = 'Placement service')
+    Parser.add_argument('--socket', help = 'unix socket to listen on')
+    Parser.add_argument('--port', type = int, default = 8765,
+                        help = 'localhost port if no socket is given')
+    Parser.add_argument('--max-bytes', type = float, default = 2 ** 30,
+                        help = 'memory the datasets held may use')
+    Parser.add_argument('--threads', type = int, default = 4,
+                        help = 'searches run at once')
+    Arguments = Parser.parse_args()
+    asyncio.run(PlacementService(int(Arguments.max_bytes),
+        Arguments.threads).Serve(Arguments.socket, Arguments.port))
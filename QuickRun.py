@@ -9,6 +9,8 @@ import ParsimoniusPlacement as PP
 
 PP = PP.FileItterator()
 
+#a list of targets (e.g. ['CO2.Intensity.kg.MW', 'Wind.Total.MW']) is
+#searched on one read of each file with the numpy and gram engines
 PP.TargetValue = 'CO2.Intensity.kg.MW'
 
 #poly degree can be an integer or a list of integers
@@ -24,16 +26,40 @@ PP.MaxPMUs = MaxPlacements
 PP.working_directory = 'inputFolder/'
 PP.op_directory = "opFolder/" 
 
+#'R', 'numpy' or 'gram', see ParsimoniusPlacement.py
+PP.Engine = 'R'
+#'R2', or 'PRESS' / 'holdout' to rank models by out of sample error
+PP.ScoreMethod = 'R2'
+#more than 1 keeps that many of the best sets of each size (a beam search)
+PP.BeamWidth = 1
+#leave out constant and duplicate columns, near collinear ones are reported
+PP.IndexColumns = False
+#processes used per step by the numpy engine
+PP.Workers = 1
+#more than 1 runs each file and degree as a separate job, this many at a time
+Jobs = 1
+
 if type(PolynomialDegree) == int:
     PolynomialDegree = [PolynomialDegree] 
     
-if type(PolynomialDegree) == list:
+#the guard stops worker processes re-running this on Windows
+if __name__ == '__main__' and Jobs > 1 and type(PP.TargetValue) == list:
+    PP.ScheduleAllJobs(Targets = PP.TargetValue, Degrees = PolynomialDegree,
+                       Jobs = Jobs)
+elif __name__ == '__main__' and Jobs > 1:
+    PP.ScheduleAllJobs(Degrees = PolynomialDegree, Jobs = Jobs)
+elif __name__ == '__main__' and type(PolynomialDegree) == list:
+    Degrees = []
     for PD in PolynomialDegree:
         if type(PD) == float:
             PD = int(PD)
         if type(PD) == int:
-            PP.PolynomialDegree = PD
-            PP.ItterateAllFiles() 
+            Degrees.append(PD)
         else:
             print('error in Polynomial Degree input - should be an interger')
+    #each file is read once and searched at every degree (and target)
+    if type(PP.TargetValue) == list:
+        PP.MultiTargetAllFiles(PP.TargetValue, Degrees)
+    else:
+        PP.SweepAllFiles(Degrees)
         
\ No newline at end of file